@@ -0,0 +1,57 @@
+'''
+Measure how long the plugin takes to load against a large synthetic db.
+
+Usage: python3 benchmarks/bench_startup.py --rows 1000000
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+
+def import_time():
+    '''
+    Measure a cold import of the plugin in a fresh interpreter, net of the interpreter startup
+    '''
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([ sys.executable, '-c', code ], cwd = os.path.dirname(os.path.abspath(__file__)), check = True)
+        return (time.perf_counter() - start) * 1000
+    baseline = min(run('import common; common.install_stubs()') for _ in range(3))
+    return min(run('import common; common.import_wardriver()') for _ in range(3)) - baseline
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Wardriver startup benchmark')
+    parser.add_argument('--rows', type = int, default = 100000, help = 'wardrive rows in the synthetic db')
+    parser.add_argument('--sessions', type = int, default = 200, help = 'sessions in the synthetic db')
+    parser.add_argument('--empty-sessions', type = int, default = 500, help = 'empty sessions left by previous runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        db_path = os.path.join(path, 'wardriver.db')
+        print(f'Creating synthetic db with {args.rows} rows...')
+        common.create_synthetic_db(db_path, args.rows, sessions = args.sessions, empty_sessions = args.empty_sessions)
+        print(f'DB size: {os.path.getsize(db_path) / 1024 / 1024:.1f} MB')
+
+        wardriver = common.import_wardriver()
+
+        plugin = wardriver.Wardriver()
+        plugin.options = { 'path': path }
+        _, load_time = common.measure(plugin.on_loaded)
+
+        # The empty sessions cleanup runs in background right after on_loaded
+        start = time.perf_counter()
+        plugin._Wardriver__maintenance.startup_done.wait()
+        deferred_time = (time.perf_counter() - start) * 1000 + load_time
+
+        plugin.on_unload(None)
+
+    print(f'Module import:         {import_time():8.1f} ms')
+    print(f'on_loaded:             {load_time:8.1f} ms')
+    print(f'Deferred maintenance:  {deferred_time:8.1f} ms (off the boot path)')
+
+if __name__ == '__main__':
+    main()
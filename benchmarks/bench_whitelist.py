@@ -0,0 +1,62 @@
+'''
+Compare the whitelist matcher with the plain list lookup on large whitelists.
+
+Usage: python3 benchmarks/bench_whitelist.py --rules 1000 --aps 100000
+'''
+import argparse
+import random
+
+import common
+
+def generate_rules(rng, count):
+    '''
+    Mix of exact SSIDs (80%), MAC prefixes (15%) and wildcard/regex patterns (5%)
+    '''
+    rules = []
+    for index in range(count):
+        kind = rng.random()
+        if kind < 0.80:
+            rules.append(f'corporate-{index}')
+        elif kind < 0.95:
+            rules.append(':'.join(f'{rng.randint(0, 255):02x}' for _ in range(3)))
+        elif kind < 0.975:
+            rules.append(f'guest-{index}-*')
+        else:
+            rules.append(f're:^printer-{index}-[0-9]+$')
+    return rules
+
+def generate_aps(rng, count, rules):
+    exact = [ rule for rule in rules if rule.startswith('corporate-') ]
+    aps = []
+    for index in range(count):
+        if rng.random() < 0.2 and exact:
+            hostname = rng.choice(exact)
+        else:
+            hostname = f'home-{index}'
+        aps.append({ 'hostname': hostname, 'mac': common.random_mac(rng) })
+    return aps
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Wardriver whitelist benchmark')
+    parser.add_argument('--rules', type = int, nargs = '+', default = [ 10, 100, 1000, 10000 ], help = 'whitelist sizes')
+    parser.add_argument('--aps', type = int, default = 100000, help = 'APs to filter for each whitelist size')
+    args = parser.parse_args()
+
+    wardriver = common.import_wardriver()
+    rng = random.Random(42)
+
+    print(f'{"rules":>8} {"build":>10} {"list lookup":>14} {"matcher":>14} {"speedup":>8}')
+    for count in args.rules:
+        rules = generate_rules(rng, count)
+        aps = generate_aps(rng, args.aps, rules)
+
+        matcher, build_time = common.measure(wardriver.WhitelistMatcher, rules)
+        _, list_time = common.measure(lambda: [ ap for ap in aps if ap['hostname'] not in rules ])
+        _, matcher_time = common.measure(lambda: [ ap for ap in aps if not matcher.match(ap['hostname'], ap['mac']) ])
+
+        list_ns = list_time * 1e6 / len(aps)
+        matcher_ns = matcher_time * 1e6 / len(aps)
+        print(f'{count:>8} {build_time:>8.2f}ms {list_ns:>11.0f}ns/AP {matcher_ns:>11.0f}ns/AP {list_ns / matcher_ns:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
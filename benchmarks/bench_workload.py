@@ -0,0 +1,95 @@
+'''
+Replay a synthetic wardriving workload through the plugin and report latencies at several db sizes.
+
+For each db size it reports:
+- `on_unfiltered_ap_list` latency percentiles (GPS read from a fake GPSD server or a fake bettercap agent)
+- db growth during the replay
+- CSV export time of the biggest session
+- latency of the web UI endpoints
+
+Usage: python3 benchmarks/bench_workload.py --sizes 10000 100000 1000000 --scans 500
+'''
+import argparse
+import json
+import os
+import tempfile
+
+import common
+from workload import Workload, FakeAgent, FakeGpsdServer, FakeRequest
+
+WEBHOOKS = [ 'current-session', 'general-stats', 'sessions', 'networks', 'map-networks', 'metrics' ]
+
+def run(size, args):
+    wardriver = common.import_wardriver()
+    workload = Workload(networks = args.networks, density = args.density, hidden_ratio = args.hidden_ratio, speed = args.speed)
+    agent = FakeAgent()
+    gpsd = FakeGpsdServer().start() if args.gps == 'gpsd' else None
+    results = { 'rows': size }
+
+    with tempfile.TemporaryDirectory() as path:
+        db_path = os.path.join(path, 'wardriver.db')
+        common.create_synthetic_db(db_path, size, sessions = args.sessions)
+        size_before = os.path.getsize(db_path)
+
+        plugin = wardriver.Wardriver()
+        plugin.options = { 'path': path, 'gps': { 'method': args.gps, 'host': '127.0.0.1', 'port': gpsd.port if gpsd else 0 } }
+        plugin.on_loaded()
+        plugin.on_ready(agent)
+
+        latencies = []
+        for scan in range(args.scans):
+            coordinates = workload.coordinates(scan)
+            agent.gps = coordinates
+            if gpsd:
+                gpsd.set_fix(coordinates)
+            _, elapsed = common.measure(plugin.on_unfiltered_ap_list, agent, workload.aps(scan))
+            latencies.append(elapsed)
+        results['callback_ms'] = common.percentiles(latencies)
+        results['callback_ms']['max'] = max(latencies)
+        results['db_growth_kb'] = (os.path.getsize(db_path) - size_before) / 1024
+
+        _, results['csv_export_ms'] = common.measure(plugin.on_webhook, f'csv/{args.sessions // 2}', FakeRequest())
+
+        results['webhooks_ms'] = dict()
+        for path in WEBHOOKS:
+            _, results['webhooks_ms'][path] = common.measure(plugin.on_webhook, path, FakeRequest())
+
+        plugin.on_unload(None)
+    if gpsd:
+        gpsd.stop()
+    return results
+
+def print_results(results):
+    callback = results['callback_ms']
+    print(f'\n=== {results["rows"]} rows ===')
+    print(f'on_unfiltered_ap_list: p50 {callback["p50"]:.2f} ms, p90 {callback["p90"]:.2f} ms, p99 {callback["p99"]:.2f} ms, max {callback["max"]:.2f} ms')
+    print(f'DB growth:             {results["db_growth_kb"]:.1f} KB')
+    print(f'CSV export:            {results["csv_export_ms"]:.1f} ms')
+    for path, elapsed in results['webhooks_ms'].items():
+        print(f'{path + ":":<22} {elapsed:.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Wardriver synthetic workload benchmark')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [ 10000, 100000, 1000000 ], help = 'wardrive rows in the synthetic db')
+    parser.add_argument('--sessions', type = int, default = 100, help = 'sessions in the synthetic db')
+    parser.add_argument('--scans', type = int, default = 300, help = 'APs lists to replay')
+    parser.add_argument('--networks', type = int, default = 20000, help = 'networks along the route')
+    parser.add_argument('--density', type = int, default = 60, help = 'networks visible for each scan')
+    parser.add_argument('--hidden-ratio', type = float, default = 0.1, help = 'ratio of hidden networks')
+    parser.add_argument('--speed', type = int, default = 10, help = 'speed in m/s')
+    parser.add_argument('--gps', choices = [ 'gpsd', 'bettercap' ], default = 'gpsd', help = 'GPS method')
+    parser.add_argument('--json', help = 'save the results to this file to compare runs')
+    args = parser.parse_args()
+
+    all_results = []
+    for size in args.sizes:
+        results = run(size, args)
+        print_results(results)
+        all_results.append(results)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(all_results, output, indent = 2)
+
+if __name__ == '__main__':
+    main()
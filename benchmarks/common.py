@@ -0,0 +1,108 @@
+'''
+Shared helpers for the wardriver benchmarks.
+
+The plugin runs inside pwnagotchi, so the `pwnagotchi` modules it imports are replaced here with
+minimal stand-ins. Every other dependency (flask, requests, ...) must be installed.
+'''
+import os
+import sys
+import sqlite3
+import random
+import time
+import types
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install_stubs():
+    '''
+    Register fake `pwnagotchi` modules so that wardriver.py can be imported outside of pwnagotchi
+    '''
+    if 'pwnagotchi' in sys.modules:
+        return
+
+    class Plugin():
+        options = dict()
+
+    class Widget():
+        def __init__(self, xy, color = 0):
+            self.xy = xy
+            self.color = color
+
+    class LabeledValue(Widget):
+        def __init__(self, color, label, value, position, label_font, text_font, **kwargs):
+            super().__init__(position, color)
+            self.label = label
+            self.value = value
+
+    modules = {
+        'pwnagotchi': {},
+        'pwnagotchi.plugins': { 'Plugin': Plugin },
+        'pwnagotchi.ui': {},
+        'pwnagotchi.ui.components': { 'Widget': Widget, 'LabeledValue': LabeledValue },
+        'pwnagotchi.ui.view': { 'BLACK': 0 },
+        'pwnagotchi.ui.fonts': { 'Small': None, 'Medium': None, 'Bold': None }
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+    sys.modules['pwnagotchi'].plugins = sys.modules['pwnagotchi.plugins']
+    sys.modules['pwnagotchi'].ui = sys.modules['pwnagotchi.ui']
+
+def import_wardriver():
+    install_stubs()
+    if REPO_PATH not in sys.path:
+        sys.path.insert(0, REPO_PATH)
+    import wardriver
+    return wardriver
+
+def random_mac(rng):
+    return ':'.join(f'{rng.randint(0, 255):02x}' for _ in range(6))
+
+def create_synthetic_db(path, rows, sessions = 50, networks = None, empty_sessions = 0, seed = 42):
+    '''
+    Create a wardriver db at `path` with `rows` wardrive rows spread over `sessions` sessions.
+    The schema is created by the plugin itself, rows are bulk inserted
+    '''
+    wardriver = import_wardriver()
+    rng = random.Random(seed)
+    networks = networks or max(1, rows // 3)
+    if os.path.exists(path):
+        os.remove(path)
+    db = wardriver.Database(path)
+    db.disconnect()
+
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.executemany('INSERT INTO sessions(id, created_at, wigle_uploaded) VALUES (?, datetime(\'now\', ?), ?)',
+                       [ (session_id, f'-{sessions - session_id} days', session_id % 2) for session_id in range(1, sessions + 1) ])
+    cursor.executemany('INSERT INTO sessions(created_at) VALUES (datetime(\'now\'))', [ () for _ in range(empty_sessions) ])
+    cursor.executemany('INSERT INTO networks(id, mac, ssid) VALUES (?, ?, ?)',
+                       [ (network_id, random_mac(rng), f'network-{network_id}' if rng.random() > 0.1 else '') for network_id in range(1, networks + 1) ])
+
+    def observations():
+        latitude, longitude = 45.4642, 9.1900
+        for row in range(rows):
+            session_id = 1 + row * sessions // rows
+            latitude += rng.uniform(-0.0005, 0.0005)
+            longitude += rng.uniform(-0.0005, 0.0005)
+            yield (session_id, rng.randint(1, networks), rng.choice(['[WPA2][CCMP][PSK]', '[WPA3][CCMP][SAE]', '[OPEN]', '']),
+                   f'{latitude:.6f}', f'{longitude:.6f}', f'{rng.uniform(100, 200):.1f}', 50, rng.choice([1, 6, 11, 36, 44]), rng.randint(-95, -30))
+
+    cursor.executemany('INSERT INTO wardrive(session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', observations())
+    connection.commit()
+    connection.close()
+
+def measure(function, *args, **kwargs):
+    '''
+    Run `function` and return its result along with the elapsed time in milliseconds
+    '''
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def percentiles(values, points = (50, 90, 99)):
+    if len(values) == 0:
+        return { f'p{point}': 0 for point in points }
+    ordered = sorted(values)
+    return { f'p{point}': ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points }
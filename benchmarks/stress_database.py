@@ -0,0 +1,144 @@
+'''
+Hammer the db from all the threads that use it at the same time and report errors and latencies:
+- the agent thread replaying APs lists through `on_unfiltered_ap_list`
+- web UI threads calling all the read webhooks, including CSV and export downloads
+- a background thread running the coverage and maintenance writes
+
+Any exception (e.g. "recursive use of cursors", "database is locked") is counted and makes the script exit with 1,
+as it does when no network is written or too many APs lists are skipped for lack of a GPS fix: then the writer
+would only measure no-ops.
+
+Usage: python3 benchmarks/stress_database.py --rows 100000 --readers 4 --seconds 30
+'''
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import common
+from workload import Workload, FakeAgent, FakeRequest
+
+MAX_GPS_MISSES = 0.05 # ratio of the APs lists skipped for lack of a GPS fix
+
+WEBHOOKS = [ 'current-session', 'general-stats', 'sessions', 'networks', 'map-networks', 'map-networks/1', 'heatmap', 'maintenance', 'metrics' ]
+
+class Stats():
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.first_errors = []
+
+    def measure(self, name, function, *args):
+        try:
+            _, elapsed = common.measure(lambda: consume(function(*args)))
+        except Exception as error:
+            with self.__lock:
+                self.errors[f'{name}: {type(error).__name__}: {error}'] += 1
+                if len(self.first_errors) < 5:
+                    self.first_errors.append(traceback.format_exc())
+            return
+        with self.__lock:
+            self.latencies[name].append(elapsed)
+
+def consume(result):
+    '''
+    Read streamed responses till the end, as the browser would do
+    '''
+    body = getattr(result, 'response', None)
+    if body is not None and not isinstance(body, (str, bytes)):
+        for _ in body:
+            pass
+        close = getattr(body, 'close', None)
+        if close:
+            close()
+
+def writer(plugin, workload, agent, stop, stats):
+    scan = 0
+    while not stop.is_set():
+        agent.gps = workload.coordinates(scan)
+        stats.measure('on_unfiltered_ap_list', plugin.on_unfiltered_ap_list, agent, workload.aps(scan))
+        scan += 1
+
+def reader(plugin, sessions, stop, stats, index):
+    requests = [ (path, FakeRequest()) for path in WEBHOOKS ]
+    requests.append((f'csv/{sessions // 2}', FakeRequest()))
+    requests.append(('export', FakeRequest(args = { 'sessions': f'{sessions // 2},{sessions // 3}', 'format': 'csv', 'archive': 'none' })))
+    position = index # readers don't call the same webhooks at the same time
+    while not stop.is_set():
+        path, request = requests[position % len(requests)]
+        stats.measure(f'webhook:{path.split("/")[0]}', plugin.on_webhook, path, request)
+        position += 1
+
+def maintenance(db, session_id, stop, stats):
+    while not stop.is_set():
+        stats.measure('aggregate_coverage', db.aggregate_coverage, 500)
+        stats.measure('remove_empty_sessions', db.remove_empty_sessions, session_id)
+        stats.measure('incremental_vacuum', db.incremental_vacuum, 16)
+        stop.wait(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Wardriver db concurrency stress test')
+    parser.add_argument('--rows', type = int, default = 100000, help = 'wardrive rows in the synthetic db')
+    parser.add_argument('--sessions', type = int, default = 50, help = 'sessions in the synthetic db')
+    parser.add_argument('--readers', type = int, default = 4, help = 'web UI threads')
+    parser.add_argument('--seconds', type = int, default = 30, help = 'test duration')
+    args = parser.parse_args()
+
+    wardriver = common.import_wardriver()
+    workload = Workload()
+    agent = FakeAgent()
+    stats = Stats()
+    stop = threading.Event()
+
+    with tempfile.TemporaryDirectory() as path:
+        common.create_synthetic_db(os.path.join(path, 'wardriver.db'), args.rows, sessions = args.sessions)
+        plugin = wardriver.Wardriver()
+        plugin.options = { 'path': path, 'gps': { 'method': 'bettercap' } }
+        plugin.on_loaded()
+        agent.gps = workload.coordinates(0) # the bettercap client reads the first fix in on_ready
+        plugin.on_ready(agent)
+        db = plugin._Wardriver__db
+
+        threads = [ threading.Thread(target = writer, args = (plugin, workload, agent, stop, stats)) ]
+        threads += [ threading.Thread(target = reader, args = (plugin, args.sessions, stop, stats, index)) for index in range(args.readers) ]
+        threads.append(threading.Thread(target = maintenance, args = (db, plugin._Wardriver__session_id, stop, stats)))
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        counters = plugin._Wardriver__metrics.snapshot()['counters']
+        plugin.on_unload(None)
+
+    print(f'{"operation":<28} {"calls":>7} {"p50":>9} {"p99":>9} {"max":>9}')
+    for name, latencies in sorted(stats.latencies.items()):
+        points = common.percentiles(latencies)
+        print(f'{name:<28} {len(latencies):>7} {points["p50"]:>7.1f}ms {points["p99"]:>7.1f}ms {max(latencies):>7.1f}ms')
+    scans = len(stats.latencies['on_unfiltered_ap_list'])
+    gps_misses = counters.get('gps_misses', 0) / scans if scans else 1
+    print(f'\nAPs written: {counters.get("aps_written", 0)}, GPS misses: {gps_misses:.1%} of the APs lists')
+    failed = False
+    if counters.get('aps_written', 0) == 0:
+        print('No network written')
+        failed = True
+    if gps_misses > MAX_GPS_MISSES:
+        print(f'GPS misses over {MAX_GPS_MISSES:.0%}')
+        failed = True
+    if stats.errors:
+        print(f'\n{sum(stats.errors.values())} errors:')
+        for error, count in stats.errors.most_common():
+            print(f'{count:>7} {error}')
+        print('\n' + '\n'.join(stats.first_errors))
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
+    print('\nNo errors')
+
+if __name__ == '__main__':
+    main()
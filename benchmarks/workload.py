@@ -0,0 +1,127 @@
+'''
+Synthetic bettercap/GPS workload used by the benchmarks.
+'''
+import bisect
+import json
+import random
+import socket
+import socketserver
+import threading
+
+class Workload():
+    '''
+    A drive along a route through an urban area. Networks are spread along the route and each
+    scan sees the ones around the current position, so consecutive scans repeat most sightings.
+    '''
+    START = (45.4642, 9.1900)
+    STEP = 0.00002 # degrees for each route unit (~2m)
+
+    def __init__(self, networks = 20000, density = 60, hidden_ratio = 0.1, speed = 25, seed = 42):
+        self.__rng = random.Random(seed)
+        self.__speed = speed # route units between two scans
+        self.__window = density // 2 # networks visible on each side of the current position
+        self.__networks = sorted((self.__network(index, networks * 2, hidden_ratio) for index in range(networks)), key = lambda network: network[0])
+        self.__positions = [ network[0] for network in self.__networks ]
+        self.route_length = self.__positions[-1]
+
+    def __network(self, index, route_length, hidden_ratio):
+        rng = self.__rng
+        position = rng.uniform(0, route_length)
+        encryption = rng.choice([ ('WPA2', 'CCMP', 'PSK'), ('WPA3', 'CCMP', 'SAE'), ('WPA2', 'CCMP', 'MGT'), ('OPEN', '', '') ])
+        return (
+            position,
+            {
+                'mac': ':'.join(f'{rng.randint(0, 255):02x}' for _ in range(6)),
+                'hostname': '<hidden>' if rng.random() < hidden_ratio else f'network-{index}',
+                'encryption': encryption[0],
+                'cipher': encryption[1],
+                'authentication': encryption[2],
+                'channel': rng.choice([ 1, 6, 11, 36, 40, 44, 48 ])
+            }
+        )
+
+    def coordinates(self, scan):
+        position = (scan * self.__speed) % self.route_length
+        return {
+            'Latitude': self.START[0] + position * self.STEP,
+            'Longitude': self.START[1] + position * self.STEP / 2,
+            'Altitude': 120.0,
+            'Speed': float(self.__speed) # route units are ~2m and scans happen every ~2s
+        }
+
+    def aps(self, scan):
+        '''
+        Return the APs list seen by bettercap during the `scan`-th scan
+        '''
+        position = (scan * self.__speed) % self.route_length
+        index = bisect.bisect_left(self.__positions, position)
+        visible = self.__networks[max(0, index - self.__window):index + self.__window]
+        return [ dict(network, rssi = max(-95, -30 - int(abs(network_position - position)))) for network_position, network in visible ]
+
+class FakeAgent():
+    '''
+    Minimal pwnagotchi agent: bettercap session with GPS data
+    '''
+    mode = 'auto'
+
+    def __init__(self):
+        self.gps = { 'Latitude': None, 'Longitude': None, 'Altitude': None }
+
+    def session(self, sess = 'session'):
+        if sess == 'session/gps':
+            return dict(self.gps)
+        return { 'gps': dict(self.gps), 'wifi': { 'aps': [] } }
+
+class FakeGpsdServer(socketserver.ThreadingTCPServer):
+    '''
+    GPSD speaking just enough of the protocol for GpsdClient: WATCH and POLL
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeGpsdHandler)
+        self.fix = { 'lat': None, 'lon': None, 'alt': None, 'speed': None }
+        self.__thread = threading.Thread(target = self.serve_forever, daemon = True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def set_fix(self, coordinates):
+        self.fix = { 'lat': coordinates['Latitude'], 'lon': coordinates['Longitude'], 'alt': coordinates['Altitude'], 'speed': coordinates.get('Speed') }
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FakeGpsdHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode().strip()
+            if command.startswith('?WATCH'):
+                response = { 'class': 'VERSION', 'release': 'fake', 'proto_major': 3, 'proto_minor': 14 }
+            elif command.startswith('?POLL'):
+                response = { 'class': 'POLL', 'tpv': [ dict(self.server.fix, **{ 'class': 'TPV', 'mode': 3 }) ] }
+            else:
+                continue
+            try:
+                self.wfile.write((json.dumps(response) + '\n').encode())
+            except (BrokenPipeError, ConnectionResetError, socket.error):
+                return
+
+class FakeRequest():
+    '''
+    Flask request as seen by `on_webhook`
+    '''
+    def __init__(self, method = 'GET', args = None, data = None):
+        self.method = method
+        self.args = args or dict()
+        self.form = data or dict()
+        self.files = dict()
+        self.headers = dict()
+        self.accept_encodings = [ 'gzip' ] # as sent by browsers
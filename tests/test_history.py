@@ -0,0 +1,134 @@
+'''
+Deduplicated network history (see `Database.add_wardrived_network` and the `session_wardrive` view).
+
+Usage: python3 -m pytest tests
+'''
+import gzip
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import common
+
+wardriver = common.import_wardriver()
+
+HOME = ('45.000000', '9.000000')
+NEAR_HOME = ('45.000200', '9.000000') # ~22m from home
+OFFICE = ('45.010000', '9.000000') # ~1.1km from home
+
+def log(db, session_id, index, coordinates, rssi, seen_timestamp, channel = 6):
+    return db.add_wardrived_network(session_id, f'00:11:22:33:44:{index:02x}', f'network-{index}', '[WPA2-PSK-CCMP][ESS]', *coordinates, '120', 5, channel, rssi, seen_timestamp)
+
+def rows(db_path, query):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute(query).fetchall()
+    finally:
+        connection.close()
+
+def read_csv(path):
+    with gzip.open(path, 'rt') as file:
+        return file.read()
+
+def test_network_sighted_again_nearby_is_not_saved_again(tmp_path):
+    db_path = str(tmp_path / 'wardriver.db')
+    db = wardriver.Database(db_path, deduplicate_distance = 50)
+    try:
+        session_id = db.new_wardriving_session()
+        assert log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00') == (*HOME, '120', 5)
+        # same session, within the distance: only the counters change, the saved coordinates are returned
+        assert log(db, session_id, 0, NEAR_HOME, -60, '2024-01-01 10:01:00') == (*HOME, '120', 5)
+        assert rows(db_path, 'SELECT latitude, rssi, sightings, last_seen FROM wardrive') == [ (HOME[0], -70, 2, '2024-01-01 10:01:00') ] # seen twice
+        assert rows(db_path, 'SELECT COUNT(*) FROM sightings') == [ (0,) ]
+
+        # a later session records its own sighting of the same row
+        later_session_id = db.new_wardriving_session()
+        log(db, later_session_id, 0, NEAR_HOME, -50, '2024-01-02 10:00:00')
+        assert rows(db_path, 'SELECT session_id, wardrive_id, rssi FROM sightings') == [ (later_session_id, 1, -50) ]
+        assert rows(db_path, 'SELECT COUNT(*) FROM wardrive') == [ (1,) ]
+    finally:
+        db.disconnect()
+
+def test_network_changed_or_far_away_is_saved_again(tmp_path):
+    db_path = str(tmp_path / 'wardriver.db')
+    db = wardriver.Database(db_path, deduplicate_distance = 50)
+    try:
+        session_id = db.new_wardriving_session()
+        log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+        assert log(db, session_id, 0, OFFICE, -70, '2024-01-01 11:00:00') == (*OFFICE, '120', 5)
+        log(db, session_id, 0, HOME, -70, '2024-01-01 12:00:00', channel = 11)
+        assert rows(db_path, 'SELECT latitude, channel FROM wardrive ORDER BY id') == [ (HOME[0], 6), (OFFICE[0], 6), (HOME[0], 11) ]
+    finally:
+        db.disconnect()
+
+def test_deduplication_disabled(tmp_path):
+    db_path = str(tmp_path / 'wardriver.db')
+    db = wardriver.Database(db_path)
+    try:
+        session_id = db.new_wardriving_session()
+        log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+        assert log(db, session_id, 0, HOME, -60, '2024-01-01 10:01:00') == (*HOME, '120', 5)
+        assert rows(db_path, 'SELECT COUNT(*) FROM wardrive') == [ (2,) ]
+    finally:
+        db.disconnect()
+
+def test_session_wardrive_view_has_a_row_for_each_sighting(tmp_path):
+    db = wardriver.Database(str(tmp_path / 'wardriver.db'), deduplicate_distance = 50)
+    try:
+        session_id = db.new_wardriving_session()
+        log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+        log(db, session_id, 1, HOME, -75, '2024-01-01 10:00:01')
+        later_session_id = db.new_wardriving_session()
+        log(db, later_session_id, 0, NEAR_HOME, -50, '2024-01-02 10:00:00')
+        log(db, later_session_id, 2, OFFICE, -65, '2024-01-02 10:00:02')
+
+        assert [ (network['ssid'], network['latitude'], network['rssi'], network['seen_timestamp']) for network in db.session_networks(later_session_id) ] == [
+            ('network-0', HOME[0], -50, '2024-01-02 10:00:00'), # coordinates of the saved row, signal and time of the sighting
+            ('network-2', OFFICE[0], -65, '2024-01-02 10:00:02')
+        ]
+        assert [ network['rssi'] for network in db.session_networks(session_id) ] == [ -70, -75 ]
+        assert db.session_networks_count(session_id) == 2
+        assert db.session_networks_count(later_session_id) == 2
+    finally:
+        db.disconnect()
+
+def test_csv_cache_trusts_complete_running_file_with_sightings(tmp_path):
+    db = wardriver.Database(str(tmp_path / 'wardriver.db'), deduplicate_distance = 50)
+    generator = wardriver.CSVGenerator()
+    cache = wardriver.CSVCache(str(tmp_path / 'csv'), db, generator)
+    try:
+        session_id = db.new_wardriving_session()
+        log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+        later_session_id = db.new_wardriving_session()
+        # the plugin writes each network to the running CSV with the coordinates returned by the db
+        written = []
+        for index, coordinates, rssi, seen_timestamp in [ (0, NEAR_HOME, -50, '2024-01-02 10:00:00'), (2, OFFICE, -65, '2024-01-02 10:00:02') ]:
+            latitude, longitude, altitude, accuracy = log(db, later_session_id, index, coordinates, rssi, seen_timestamp)
+            written.append({ 'mac': f'00:11:22:33:44:{index:02x}', 'ssid': f'network-{index}', 'auth_mode': '[WPA2-PSK-CCMP][ESS]', 'seen_timestamp': seen_timestamp,
+                             'channel': 6, 'rssi': rssi, 'latitude': latitude, 'longitude': longitude, 'altitude': altitude, 'accuracy': accuracy })
+        cache.append(later_session_id, written)
+
+        csv = read_csv(cache.session_file(later_session_id))
+        assert csv.count('\n') == 3 # header and networks, the sighting included
+        assert csv == generator.networks_to_csv(db.session_networks(later_session_id))
+    finally:
+        db.disconnect()
+
+def test_csv_cache_rebuilds_incomplete_running_file(tmp_path):
+    db = wardriver.Database(str(tmp_path / 'wardriver.db'), deduplicate_distance = 50)
+    generator = wardriver.CSVGenerator()
+    cache = wardriver.CSVCache(str(tmp_path / 'csv'), db, generator)
+    try:
+        session_id = db.new_wardriving_session()
+        log(db, session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+        later_session_id = db.new_wardriving_session()
+        log(db, later_session_id, 0, NEAR_HOME, -50, '2024-01-02 10:00:00')
+        log(db, later_session_id, 2, OFFICE, -65, '2024-01-02 10:00:02')
+        cache.append(later_session_id, []) # e.g. the plugin crashed before writing the networks
+
+        csv = read_csv(cache.session_file(later_session_id))
+        assert csv.count('\n') == 3
+        assert csv == generator.networks_to_csv(db.session_networks(later_session_id))
+    finally:
+        db.disconnect()
@@ -0,0 +1,70 @@
+'''
+AP locations estimate (see `LocationEstimator`).
+
+Usage: python3 -m pytest tests
+'''
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import common
+
+wardriver = common.import_wardriver()
+
+def python_estimator():
+    estimator = wardriver.LocationEstimator()
+    estimator._LocationEstimator__numpy = None # as on units without NumPy
+    return estimator
+
+def observations(networks = 50, seed = 1):
+    '''
+    (network id, latitude, longitude, rssi, accuracy) rows ordered by network id, from 1 to 12 observations each
+    '''
+    generator = random.Random(seed)
+    rows = []
+    for network_id in range(1, networks + 1):
+        latitude, longitude = 45 + generator.uniform(-0.05, 0.05), 9 + generator.uniform(-0.05, 0.05)
+        for _ in range(generator.randint(1, 12)):
+            rows.append((network_id * 3, latitude + generator.gauss(0, 0.0005), longitude + generator.gauss(0, 0.0005), generator.randint(-90, -40), generator.choice([ 5, 10, 50 ])))
+    return rows
+
+def test_python_and_numpy_estimates_match():
+    pytest.importorskip('numpy')
+    rows = observations()
+    expected = python_estimator().estimate(rows)
+    estimates = wardriver.LocationEstimator().estimate(rows)
+    assert [ estimate[0] for estimate in estimates ] == [ estimate[0] for estimate in expected ]
+    for estimate, python_estimate in zip(estimates, expected):
+        assert estimate[1] == pytest.approx(python_estimate[1], abs = 1e-9)
+        assert estimate[2] == pytest.approx(python_estimate[2], abs = 1e-9)
+        assert estimate[3] == pytest.approx(python_estimate[3], rel = 1e-6)
+        assert estimate[4] == python_estimate[4]
+
+@pytest.mark.parametrize('numpy', [ False, True ])
+def test_outliers_are_rejected(numpy):
+    if numpy:
+        pytest.importorskip('numpy')
+    estimator = wardriver.LocationEstimator() if numpy else python_estimator()
+    rows = [ (7, 45.0000 + offset, 9.0000 + offset, -60, 10) for offset in (-0.0001, 0, 0.0001, 0.00005, -0.00005) ]
+    rows.append((7, 45.05, 9.05, -60, 10)) # ~7km away, e.g. a wrong GPS fix
+    (network_id, latitude, longitude, uncertainty, used), = estimator.estimate(rows)
+    assert network_id == 7
+    assert used == 5
+    assert latitude == pytest.approx(45.0, abs = 1e-6)
+    assert longitude == pytest.approx(9.0, abs = 1e-6)
+    assert 10 <= uncertainty < 50
+
+@pytest.mark.parametrize('numpy', [ False, True ])
+def test_few_observations_are_all_used(numpy):
+    if numpy:
+        pytest.importorskip('numpy')
+    estimator = wardriver.LocationEstimator() if numpy else python_estimator()
+    rows = [ (1, 45.0, 9.0, -50, 5), (1, 45.01, 9.0, -50, 5), (2, 46.0, 10.0, -70, 20) ]
+    (_, latitude, _, uncertainty, used), (_, _, _, single_uncertainty, single_used) = estimator.estimate(rows)
+    assert used == 2 # too few observations to look for outliers
+    assert latitude == pytest.approx(45.005)
+    assert uncertainty == pytest.approx(556, rel = 0.01) # half the distance between the two
+    assert (single_uncertainty, single_used) == (20, 1) # the GPS accuracy of the only observation
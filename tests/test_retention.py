@@ -0,0 +1,77 @@
+'''
+Pruning old sessions with networks sighted again in later sessions (see `Database.prepare_prune`).
+
+Usage: python3 -m pytest tests
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import common
+
+wardriver = common.import_wardriver()
+
+HOME = ('45.000000', '9.000000')
+OFFICE = ('45.010000', '9.000000') # ~1.1km from home
+
+def log(db, session_id, index, coordinates, rssi, seen_timestamp):
+    db.add_wardrived_network(session_id, f'00:11:22:33:44:{index:02x}', f'network-{index}', '[WPA2-PSK-CCMP][ESS]', *coordinates, '120', 5, 6, rssi, seen_timestamp)
+
+def prune(db, sessions_ids, keep_best):
+    db.prepare_prune(sessions_ids, keep_best)
+    last_id, count = 0, 1
+    while count > 0:
+        last_id, count = db.prune_batch(last_id, 2)
+    db.finish_prune()
+    db.remove_orphan_networks()
+
+def seen(db, session_id):
+    return [ (network['ssid'], network['latitude'], network['rssi'], network['seen_timestamp']) for network in db.session_networks(session_id) ]
+
+def setup(tmp_path):
+    db = wardriver.Database(str(tmp_path / 'wardriver.db'), deduplicate_distance = 50)
+    old_session_id = db.new_wardriving_session()
+    log(db, old_session_id, 0, HOME, -70, '2024-01-01 10:00:00')
+    log(db, old_session_id, 0, OFFICE, -40, '2024-01-01 11:00:00') # best observation of network 0
+    log(db, old_session_id, 1, HOME, -80, '2024-01-01 10:00:01')
+    log(db, old_session_id, 1, OFFICE, -50, '2024-01-01 11:00:01')
+    session_id = db.new_wardriving_session()
+    log(db, session_id, 0, HOME, -60, '2024-02-01 10:00:00') # sighted again: it refers to the old observation
+    log(db, session_id, 2, HOME, -65, '2024-02-01 10:00:02')
+    return db, old_session_id, session_id
+
+def test_keep_best_keeps_observations_sighted_again(tmp_path):
+    db, old_session_id, session_id = setup(tmp_path)
+    try:
+        before = seen(db, session_id)
+        prune(db, [ old_session_id ], keep_best = True)
+
+        assert seen(db, session_id) == before == [
+            ('network-0', HOME[0], -60, '2024-02-01 10:00:00'),
+            ('network-2', HOME[0], -65, '2024-02-01 10:00:02')
+        ]
+        # the home observation of network 0 is weaker but still sighted, the one of network 1 is gone
+        assert seen(db, old_session_id) == [
+            ('network-0', HOME[0], -70, '2024-01-01 10:00:00'),
+            ('network-0', OFFICE[0], -40, '2024-01-01 11:00:00'),
+            ('network-1', OFFICE[0], -50, '2024-01-01 11:00:01')
+        ]
+    finally:
+        db.disconnect()
+
+def test_dropped_session_hands_over_observations_sighted_again(tmp_path):
+    db, old_session_id, session_id = setup(tmp_path)
+    try:
+        before = seen(db, session_id)
+        prune(db, [ old_session_id ], keep_best = False)
+        db.remove_empty_sessions(session_id)
+
+        assert seen(db, session_id) == before
+        assert seen(db, old_session_id) == []
+        assert [ session['id'] for session in db.sessions() ] == [ session_id ]
+        assert db.session_networks_count(session_id) == 2
+        # the handed over observation belongs to the later session now: sighting it again there adds nothing
+        log(db, session_id, 0, HOME, -55, '2024-02-01 10:05:00')
+        assert seen(db, session_id) == before
+    finally:
+        db.disconnect()
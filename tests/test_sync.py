@@ -0,0 +1,48 @@
+'''
+Merging other dbs into this one (see `Database.merge` and `DatabaseSync`).
+
+Usage: python3 -m pytest tests
+'''
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import common
+
+wardriver = common.import_wardriver()
+
+def drive(db, session_id, first, count):
+    for index in range(first, first + count):
+        db.add_wardrived_network(session_id, f'00:11:22:33:44:{index:02x}', f'network-{index}', '[WPA2-PSK-CCMP][ESS]', f'{45 + index / 1000:.6f}', '9.000000', '120', 5, 6, -60, f'2024-01-01 10:00:{index:02d}')
+
+def read_csv(path):
+    with gzip.open(path, 'rt') as file:
+        return file.read()
+
+def test_merge_invalidates_cached_sessions(tmp_path):
+    source = wardriver.Database(str(tmp_path / 'source.db'))
+    source_session_id = source.new_wardriving_session()
+    drive(source, source_session_id, 0, 10)
+
+    db = wardriver.Database(str(tmp_path / 'wardriver.db'))
+    current_session_id = db.new_wardriving_session()
+    generator = wardriver.CSVGenerator()
+    cache = wardriver.CSVCache(str(tmp_path / 'csv'), db, generator)
+    sync = wardriver.DatabaseSync(db, str(tmp_path / 'sync'), lambda: current_session_id, on_merged = cache.invalidate)
+    try:
+        sync.merge(str(tmp_path / 'source.db'))
+        session_id, = [ session['id'] for session in db.sessions() ]
+        assert read_csv(cache.session_file(session_id)).count('\n') == 11 # header and networks
+
+        drive(source, source_session_id, 10, 5) # the session was still running on the other device
+        added = sync.merge(str(tmp_path / 'source.db'))
+        assert added['observations'] == 5
+
+        csv = read_csv(cache.session_file(session_id))
+        assert csv.count('\n') == 16
+        assert 'network-14' in csv
+        assert csv == generator.networks_to_csv(db.session_networks(session_id))
+    finally:
+        source.disconnect()
+        db.disconnect()
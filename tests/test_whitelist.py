@@ -0,0 +1,69 @@
+'''
+Whitelist rules (see `WhitelistMatcher`).
+
+Usage: python3 -m pytest tests
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import common
+
+wardriver = common.import_wardriver()
+
+MAC = '12:34:56:78:9a:bc'
+
+def test_exact_ssid():
+    matcher = wardriver.WhitelistMatcher([ 'home', 'corp-wifi' ])
+    assert matcher.match('home', MAC)
+    assert matcher.match('corp-wifi', MAC)
+    assert not matcher.match('Home', MAC)
+    assert not matcher.match('home-5G', MAC)
+
+def test_wildcards_match_the_whole_ssid():
+    matcher = wardriver.WhitelistMatcher([ 'corp-*', 'guest-??' ])
+    assert matcher.match('corp-', MAC)
+    assert matcher.match('corp-floor-2', MAC)
+    assert matcher.match('guest-01', MAC)
+    assert not matcher.match('guest-001', MAC)
+    assert not matcher.match('my-corp-wifi', MAC)
+
+def test_regex_rules_are_not_exact_ssids():
+    matcher = wardriver.WhitelistMatcher([ 're:^printer-[0-9]+$', 're:cam' ])
+    assert matcher.match('printer-42', MAC)
+    assert not matcher.match('printer-x', MAC)
+    assert not matcher.match('re:cam', MAC)
+    assert matcher.match('cam', MAC)
+    assert not matcher.match('camera', MAC) # the whole SSID has to match
+
+def test_invalid_regex_is_skipped():
+    matcher = wardriver.WhitelistMatcher([ 're:[unclosed', 'home' ])
+    assert matcher.match('home', MAC)
+    assert not matcher.match('[unclosed', MAC)
+
+def test_mac_addresses_and_prefixes():
+    matcher = wardriver.WhitelistMatcher([ 'AA:BB:CC', '12:34:56:78:9a:bd' ])
+    assert matcher.match('', 'aa:bb:cc:00:11:22') # whole OUI, case insensitive
+    assert matcher.match('any', '12:34:56:78:9A:BD')
+    assert not matcher.match('any', MAC)
+    assert not matcher.match('any', 'aa:bb:cd:00:11:22')
+
+def test_oui_prefixes_with_dashes():
+    matcher = wardriver.WhitelistMatcher([ 'aa-bb-cc', '12-34-56-78' ])
+    assert matcher.match('', 'AA:BB:CC:00:11:22')
+    assert matcher.match('', '12:34:56:78:9a:bc')
+    assert not matcher.match('', '12:34:56:79:9a:bc')
+
+def test_mac_rules_also_match_the_ssid():
+    # a rule is checked as an exact SSID before being read as a MAC prefix
+    matcher = wardriver.WhitelistMatcher([ 'aa:bb:cc' ])
+    assert matcher.match('aa:bb:cc', MAC)
+    # wildcards and regexes are SSID rules only
+    matcher = wardriver.WhitelistMatcher([ 'aa:bb:*', 're:aa:bb:.*' ])
+    assert not matcher.match('', 'aa:bb:cc:00:11:22')
+    assert matcher.match('aa:bb:xx', MAC)
+
+def test_empty_whitelist():
+    matcher = wardriver.WhitelistMatcher([])
+    assert not matcher.match('', MAC)
+    assert not matcher.match('home', MAC)
@@ -1,83 +1,468 @@
 import logging
 import re
+import fnmatch
+import math
+import gzip
+import shutil
+import zlib
+import hashlib
+import zipfile
+import itertools
+import functools
+import statistics
+import html
+import io
+import types
 import sqlite3
 import os
+import urllib.parse
 from datetime import datetime, timezone
-import toml
-from threading import Lock
+from threading import Lock, Thread, Event, get_native_id, local, current_thread
 import json
-import requests
-from PIL import Image, ImageOps
+import queue
 import pwnagotchi.plugins as plugins
 from pwnagotchi.ui.components import LabeledValue, Widget
 from pwnagotchi.ui.view import BLACK
 import pwnagotchi.ui.fonts as fonts
 from flask import abort
+from flask import Response
+from flask import send_file
 from flask import render_template_string
 import socket
 import time
 
-try:
-    import websockets
-    import asyncio
-except:
-    pass
+# requests, PIL, toml, asyncio, websockets and numpy are imported only when needed to keep pwnagotchi boot fast
+
+GLOBAL_CONFIG_PATH = '/etc/pwnagotchi/config.toml'
+_global_config_lock = Lock()
+_global_config_cache = {
+    'mtime': None,
+    'data': None
+}
+
+def read_global_config():
+    '''
+    Return pwnagotchi global config. The file is parsed only the first time and whenever it changes
+    '''
+    mtime = os.stat(GLOBAL_CONFIG_PATH).st_mtime
+    with _global_config_lock:
+        if _global_config_cache['mtime'] != mtime:
+            import toml
+            with open(GLOBAL_CONFIG_PATH, 'r') as config_file:
+                _global_config_cache['data'] = toml.load(config_file)
+            _global_config_cache['mtime'] = mtime
+        return _global_config_cache['data']
+
+def as_db_text(value):
+    '''
+    Return `value` formatted as SQLite does when storing it in a TEXT column
+    '''
+    if isinstance(value, float):
+        text = format(value, '.15g')
+        return text if any(char in text for char in '.ein') else f'{text}.0'
+    return str(value) if value is not None else None
+
+def haversine(latitude_1, longitude_1, latitude_2, longitude_2):
+    '''
+    Return the distance in meters between two coordinates
+    '''
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians, [ float(latitude_1), float(longitude_1), float(latitude_2), float(longitude_2) ])
+    a = math.sin((latitude_2 - latitude_1) / 2) ** 2 + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash(latitude, longitude, precision):
+    '''
+    Return the geohash cell of the given precision (number of characters) containing the coordinates
+    '''
+    latitude_range = [ -90.0, 90.0 ]
+    longitude_range = [ -180.0, 180.0 ]
+    latitude, longitude = float(latitude), float(longitude)
+    cell = []
+    bits = 0
+    bits_count = 0
+    even = True
+    while len(cell) < precision:
+        value, value_range = (longitude, longitude_range) if even else (latitude, latitude_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bits_count += 1
+        if bits_count == 5:
+            cell.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bits_count = 0
+    return ''.join(cell)
+
+def geohash_bounds(cell):
+    '''
+    Return the (south, west, north, east) bounds of a geohash cell
+    '''
+    latitude_range = [ -90.0, 90.0 ]
+    longitude_range = [ -180.0, 180.0 ]
+    even = True
+    for char in cell:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = longitude_range if even else latitude_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+    return latitude_range[0], longitude_range[0], latitude_range[1], longitude_range[1]
+
+@functools.lru_cache(maxsize = 4096) # consecutive sightings fall in the same few cells
+def geohash_center(cell):
+    '''
+    Return the (latitude, longitude) center of a geohash cell
+    '''
+    south, west, north, east = geohash_bounds(cell)
+    return (south + north) / 2, (west + east) / 2
+
+def douglas_peucker(points, tolerance):
+    '''
+    Return the indexes of the `points` ((x, y) in meters) kept by the Douglas-Peucker simplification with `tolerance` meters
+    '''
+    if len(points) < 3:
+        return list(range(len(points)))
+    keep = [ False ] * len(points)
+    keep[0] = keep[-1] = True
+    ranges = [ (0, len(points) - 1) ] # iterative, long tracks would exceed the recursion limit
+    while ranges:
+        first, last = ranges.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        farthest, farthest_distance = None, tolerance
+        for index in range(first + 1, last):
+            x, y = points[index]
+            t = min(max(((x - x1) * dx + (y - y1) * dy) / length, 0), 1) if length > 0 else 0
+            distance = math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+            if distance > farthest_distance:
+                farthest, farthest_distance = index, distance
+        if farthest is not None:
+            keep[farthest] = True
+            ranges.append((first, farthest))
+            ranges.append((farthest, last))
+    return [ index for index, kept in enumerate(keep) if kept ]
+
+def simplify_track(fixes, zoom, gap = 60):
+    '''
+    Simplify the (timestamp, latitude, longitude) `fixes` for a map at `zoom`: fixes are split in segments where
+    no fix has been recorded for more than `gap` seconds, then thinned in time buckets and simplified with
+    Douglas-Peucker within ~1 pixel. Return the segments ([ latitude, longitude, timestamp ] lists) and
+    the gaps between them (last fix before and first fix after each gap)
+    '''
+    if not fixes:
+        return [], []
+    latitude = sum(fix[1] for fix in fixes) / len(fixes)
+    tolerance = 156543.03 * math.cos(math.radians(latitude)) / 2 ** zoom * 1.5 # meters in 1.5 pixels
+    bucket = min(max(int(tolerance / 30), 1), 600) # seconds, at 30 m/s (~110 km/h) the track moves less than the tolerance
+    meters_per_degree = 6371000 * math.pi / 180
+    scale = meters_per_degree * math.cos(math.radians(latitude))
+    segments, gaps, segment = [], [], []
+    for fix in fixes:
+        if segment and fix[0] - segment[-1][0] > gap:
+            segments.append(segment)
+            gaps.append([ [ segment[-1][1], segment[-1][2], segment[-1][0] ], [ fix[1], fix[2], fix[0] ] ])
+            segment = []
+        if len(segment) < 2 or fix[0] // bucket != segment[-1][0] // bucket:
+            segment.append(fix)
+        else:
+            segment[-1] = fix # the last fix of each bucket, so that the segment ends on its last fix
+    segments.append(segment)
+    simplified = []
+    for segment in segments:
+        kept = douglas_peucker([ (fix[2] * scale, fix[1] * meters_per_degree) for fix in segment ], tolerance)
+        simplified.append([ [ round(segment[index][1], 6), round(segment[index][2], 6), segment[index][0] ] for index in kept ])
+    return simplified, gaps
+
+def gzip_chunks(path, chunk_size = 64 * 1024):
+    '''
+    Generator over the gzipped content of the file at `path`, compressed while it's read
+    '''
+    compressor = zlib.compressobj(wbits = 31) # gzip container
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+def gunzip_chunks(path, chunk_size = 64 * 1024):
+    '''
+    Generator over the content of the gzipped file at `path`, decompressed while it's read
+    '''
+    with gzip.open(path, 'rb') as file:
+        yield from iter(lambda: file.read(chunk_size), b'')
+
+def read_only_uri(path):
+    '''
+    SQLite URI opening the db at `path` read-only
+    '''
+    return f'file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro'
 
 class Database():
-    def __init__(self, path):
+    '''
+    The db is used by the agent callbacks, the web UI requests and the background jobs, each in its own thread.
+    Every thread gets its own connection and the db is in WAL mode, so reads never wait for writes; writes are
+    serialized by a lock so that they never fail because another connection is writing
+    '''
+    COVERAGE_PRECISIONS = (5, 6, 7, 8) # geohash cells from ~5km to ~40m
+    BUSY_TIMEOUT = 30 # seconds to wait for locks held by other processes (e.g. sqlite3 shell)
+    SEARCH_TOKENIZERS = ('trigram', 'unicode61') # trigram (SQLite >= 3.34) matches any substring, unicode61 only word prefixes
+    MAC_KEY = "lower(replace(replace(mac, ':', ''), '-', ''))" # normalised MAC, same expression as the networks_mac_key index
+    SEARCH_MAX_MATCHES = 10000 # SSID matches ranked for each search, generic queries (e.g. 'net') would rank the whole table
+    SPATIAL_COLUMNS = [ 'id', 'mac', 'ssid', 'auth_mode', 'channel', 'rssi', 'latitude', 'longitude', 'seen_timestamp', 'session_id', 'distance' ]
+    SPATIAL_MAX_RADIUS = 50000 # meters, nearest networks are looked for in growing circles up to this radius
+    SYNC_BATCH_SIZE = 1000 # observations merged in each transaction, the writer waits at most for one batch
+    SYNC_WARDRIVE_COLUMNS = 'session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp, last_seen, sightings, wigle_uploaded'
+
+    def __init__(self, path, deduplicate_distance = 0):
         self.__path = path
+        self.__deduplicate_distance = deduplicate_distance # meters, 0 to always insert a new row
+        self.__write_lock = Lock()
+        self.__coverage_lock = Lock() # the coverage grid is aggregated both while wardriving and by the maintenance job
+        self.__local = local()
+        self.__connections = dict() # thread -> connection, closed when the thread ends or on disconnect
+        self.__connections_lock = Lock()
+        self.__search_tokenizer = None # FTS5 tokenizer of the SSIDs index, None if FTS5 is not available
+        self.__spatial_index = False # R*Tree of the wardrive coordinates, False if this SQLite build has no R*Tree
         self.__db_connect()
-        self.remove_empty_sessions() # Remove old sessions that don't have networks
+
+    @property
+    def __connection(self):
+        '''
+        Connection of the calling thread, opened on first use
+        '''
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.__path, timeout = self.BUSY_TIMEOUT, check_same_thread = False, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, uri = True) # URIs attach merge sources read-only
+            connection.execute('PRAGMA synchronous = NORMAL') # with WAL a power loss can only lose the last commits, never corrupt the db
+            with self.__connections_lock:
+                for thread in [ thread for thread in self.__connections if not thread.is_alive() ]:
+                    self.__connections.pop(thread).close() # e.g. web UI requests threads
+                self.__connections[current_thread()] = connection
+            self.__local.connection = connection
+        return connection
     
     def __db_connect(self):
         logging.info('[WARDRIVER] Setting up database connection...')
-        self.__connection = sqlite3.connect(self.__path, check_same_thread = False, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        cursor = self.__connection.cursor()
-        cursor.execute('CREATE TABLE IF NOT EXISTS sessions ("id" INTEGER, "created_at" TEXT DEFAULT CURRENT_TIMESTAMP, "wigle_uploaded" INTEGER DEFAULT 0, PRIMARY KEY("id" AUTOINCREMENT))') # sessions table contains wardriving sessions
-        cursor.execute('CREATE TABLE IF NOT EXISTS networks ("id" INTEGER, "mac" TEXT NOT NULL, "ssid" TEXT, PRIMARY KEY ("id" AUTOINCREMENT))') # networks table contains seen networks without coordinates/sessions info
-        cursor.execute('CREATE TABLE IF NOT EXISTS wardrive ("id" INTEGER, "session_id" INTEGER NOT NULL, "network_id" INTEGER NOT NULL, "auth_mode" TEXT NOT NULL, "latitude" TEXT NOT NULL, "longitude" TEXT NOT NULL, "altitude" TEXT NOT NULL, "accuracy" INTEGER NOT NULL, "channel" INTEGER NOT NULL, "rssi" INTEGER NOT NULL, "seen_timestamp" TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY("id" AUTOINCREMENT), FOREIGN KEY("session_id") REFERENCES sessions("id"), FOREIGN KEY("network_id") REFERENCES networks("id"))') # wardrive table contains the relations between sessions and networks with timestamp and coordinates
-        cursor.close()
-        self.__connection.commit()
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL') # only effective on newly created db files
+            cursor.execute('PRAGMA journal_mode = WAL') # persistent, readers and the writer don't block each other
+            cursor.execute('CREATE TABLE IF NOT EXISTS sessions ("id" INTEGER, "created_at" TEXT DEFAULT CURRENT_TIMESTAMP, "wigle_uploaded" INTEGER DEFAULT 0, PRIMARY KEY("id" AUTOINCREMENT))') # sessions table contains wardriving sessions
+            cursor.execute('CREATE TABLE IF NOT EXISTS networks ("id" INTEGER, "mac" TEXT NOT NULL, "ssid" TEXT, PRIMARY KEY ("id" AUTOINCREMENT))') # networks table contains seen networks without coordinates/sessions info
+            cursor.execute('CREATE TABLE IF NOT EXISTS wardrive ("id" INTEGER, "session_id" INTEGER NOT NULL, "network_id" INTEGER NOT NULL, "auth_mode" TEXT NOT NULL, "latitude" TEXT NOT NULL, "longitude" TEXT NOT NULL, "altitude" TEXT NOT NULL, "accuracy" INTEGER NOT NULL, "channel" INTEGER NOT NULL, "rssi" INTEGER NOT NULL, "seen_timestamp" TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY("id" AUTOINCREMENT), FOREIGN KEY("session_id") REFERENCES sessions("id"), FOREIGN KEY("network_id") REFERENCES networks("id"))') # wardrive table contains the relations between sessions and networks with timestamp and coordinates
+            cursor.execute('CREATE INDEX IF NOT EXISTS wardrive_session_id ON wardrive(session_id)') # used by all the session queries
+            cursor.execute('CREATE INDEX IF NOT EXISTS networks_mac_ssid ON networks(mac, ssid)') # used when looking for already known networks
+            cursor.execute('CREATE INDEX IF NOT EXISTS wardrive_coordinates ON wardrive(latitude, longitude, network_id)') # used to group the map points
+            cursor.execute('PRAGMA table_info(wardrive)')
+            if 'sightings' not in [ column[1] for column in cursor.fetchall() ]: # db created with older versions
+                cursor.execute('ALTER TABLE wardrive ADD COLUMN "last_seen" TEXT')
+                cursor.execute('ALTER TABLE wardrive ADD COLUMN "sightings" INTEGER NOT NULL DEFAULT 1')
+            cursor.execute('CREATE TABLE IF NOT EXISTS sightings ("session_id" INTEGER NOT NULL, "wardrive_id" INTEGER NOT NULL, "rssi" INTEGER NOT NULL, "seen_timestamp" TEXT NOT NULL, PRIMARY KEY("session_id", "wardrive_id"), FOREIGN KEY("session_id") REFERENCES sessions("id"), FOREIGN KEY("wardrive_id") REFERENCES wardrive("id")) WITHOUT ROWID') # sightings table contains repeat sightings of an unchanged network in later sessions
+            cursor.execute('CREATE INDEX IF NOT EXISTS sightings_wardrive_id ON sightings(wardrive_id)') # used when pruning wardrive rows
+            # session_wardrive view contains a row for each network seen in each session, either logged or sighted again
+            cursor.execute('''CREATE VIEW IF NOT EXISTS session_wardrive AS
+                              SELECT id AS wardrive_id, session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp FROM wardrive
+                              UNION ALL
+                              SELECT w.id, s.session_id, w.network_id, w.auth_mode, w.latitude, w.longitude, w.altitude, w.accuracy, w.channel, s.rssi, s.seen_timestamp FROM sightings s JOIN wardrive w ON w.id = s.wardrive_id''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS wardrive_network_id ON wardrive(network_id)') # used by the networks list and to look for previous observations
+            cursor.execute('CREATE TABLE IF NOT EXISTS coverage ("precision" INTEGER NOT NULL, "cell" TEXT NOT NULL, "latitude" REAL NOT NULL, "longitude" REAL NOT NULL, "networks" INTEGER NOT NULL, "max_rssi" INTEGER NOT NULL, "last_seen" TEXT NOT NULL, PRIMARY KEY("precision", "cell")) WITHOUT ROWID') # coverage table contains networks logged in each geohash cell, kept up to date on insert
+            cursor.execute('CREATE TABLE IF NOT EXISTS coverage_networks ("precision" INTEGER NOT NULL, "cell" TEXT NOT NULL, "network_id" INTEGER NOT NULL, PRIMARY KEY("precision", "cell", "network_id")) WITHOUT ROWID') # coverage_networks table contains the networks counted in each cell, so each one is counted once
+            cursor.execute('CREATE TABLE IF NOT EXISTS metadata ("key" TEXT NOT NULL, "value" TEXT, PRIMARY KEY("key"))') # metadata table contains the state of the background jobs
+            cursor.execute('CREATE TABLE IF NOT EXISTS track ("session_id" INTEGER NOT NULL, "timestamp" INTEGER NOT NULL, "latitude" REAL NOT NULL, "longitude" REAL NOT NULL, "altitude" REAL, "speed" REAL, PRIMARY KEY("session_id", "timestamp"), FOREIGN KEY("session_id") REFERENCES sessions("id")) WITHOUT ROWID') # track table contains the GPS fixes of each session
+            cursor.execute('INSERT OR IGNORE INTO metadata(key, value) VALUES (\'coverage_last_id\', 0)') # last wardrive row aggregated in the coverage grid
+            cursor.execute('PRAGMA table_info(wardrive)')
+            if 'wigle_uploaded' not in [ column[1] for column in cursor.fetchall() ]: # db created with older versions
+                # each observation is uploaded to WiGLE only once, and networks remember where they have been uploaded from
+                cursor.execute('ALTER TABLE wardrive ADD COLUMN "wigle_uploaded" INTEGER NOT NULL DEFAULT 0')
+                cursor.execute('ALTER TABLE sightings ADD COLUMN "wigle_uploaded" INTEGER NOT NULL DEFAULT 0')
+                cursor.execute('ALTER TABLE networks ADD COLUMN "uploaded_latitude" REAL')
+                cursor.execute('ALTER TABLE networks ADD COLUMN "uploaded_longitude" REAL')
+                # rows of the sessions already uploaded are flagged by the maintenance job (see `backfill_uploaded`)
+                cursor.execute('INSERT OR REPLACE INTO metadata(key, value) SELECT \'uploaded_backfill_session_id\', MAX(id) + 1 FROM sessions WHERE wigle_uploaded = 1 HAVING COUNT(*) > 0')
+            cursor.execute('PRAGMA table_info(networks)')
+            if 'estimated_latitude' not in [ column[1] for column in cursor.fetchall() ]: # db created with older versions
+                # position of the AP estimated from all its observations (see LocationEstimator)
+                cursor.execute('ALTER TABLE networks ADD COLUMN "estimated_latitude" REAL')
+                cursor.execute('ALTER TABLE networks ADD COLUMN "estimated_longitude" REAL')
+                cursor.execute('ALTER TABLE networks ADD COLUMN "estimated_uncertainty" REAL') # meters
+                cursor.execute('ALTER TABLE networks ADD COLUMN "estimated_observations" INTEGER') # observations used, outliers excluded
+            cursor.execute('CREATE INDEX IF NOT EXISTS networks_estimated_coordinates ON networks(estimated_latitude, estimated_longitude)') # used by the map
+            cursor.execute('INSERT OR IGNORE INTO metadata(key, value) VALUES (\'locations_last_id\', 0)') # last wardrive row used to estimate the networks locations
+            cursor.execute('PRAGMA table_info(sessions)')
+            if 'origin_device' not in [ column[1] for column in cursor.fetchall() ]: # db created with older versions
+                # sessions merged from other devices remember where they come from, so that merging them again finds them
+                cursor.execute('ALTER TABLE sessions ADD COLUMN "origin_device" TEXT')
+                cursor.execute('ALTER TABLE sessions ADD COLUMN "origin_session_id" INTEGER')
+            cursor.execute('CREATE INDEX IF NOT EXISTS sessions_origin ON sessions(origin_device, origin_session_id)') # used when merging
+            cursor.execute('SELECT 1 FROM metadata WHERE key = \'device_id\'')
+            if cursor.fetchone() is None: # id of this db, see `merge`
+                # dbs of older versions get an id derived from their first observation, so that a copy upgraded to be
+                # merged and the db itself, upgraded later on its device, are still recognised as the same db
+                cursor.execute('SELECT w.id, w.seen_timestamp, w.latitude, w.longitude, n.mac FROM wardrive w JOIN networks n ON n.id = w.network_id ORDER BY w.id LIMIT 1')
+                first = cursor.fetchone()
+                device_id = hashlib.sha1(repr(first).encode()).hexdigest()[:16] if first else os.urandom(8).hex()
+                cursor.execute('INSERT INTO metadata(key, value) VALUES (\'device_id\', ?)', [device_id])
+            self.__search_tokenizer = self.__create_search_index(cursor)
+            self.__spatial_index = self.__create_spatial_index(cursor)
+            cursor.close()
+            self.__connection.commit()
         logging.info('[WARDRIVER] Succesfully connected to db')
     
+    def __create_search_index(self, cursor):
+        '''
+        Create the FTS5 index of the SSIDs, kept in sync with the networks table by triggers. Networks saved before
+        it existed are added by the maintenance job (see `backfill_search_index`).
+        Return its tokenizer, or None if this SQLite build has no FTS5
+        '''
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'networks_fts'")
+        row = cursor.fetchone()
+        if row:
+            return next((tokenizer for tokenizer in self.SEARCH_TOKENIZERS if tokenizer in row[0]), self.SEARCH_TOKENIZERS[-1])
+        for tokenizer in self.SEARCH_TOKENIZERS:
+            try:
+                cursor.execute(f"CREATE VIRTUAL TABLE networks_fts USING fts5(ssid, content = 'networks', content_rowid = 'id', tokenize = '{tokenizer}')")
+                break
+            except sqlite3.OperationalError as e:
+                logging.debug(f'[WARDRIVER] FTS5 {tokenizer} tokenizer not available: {e}')
+        else:
+            logging.warning('[WARDRIVER] SQLite has no FTS5, networks search will scan the whole table')
+            return None
+        # networks not backfilled yet aren't in the index: deleting them from it would corrupt it
+        indexed = "NOT (old.id > IFNULL((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'search_index_last_id'), 0) AND old.id <= IFNULL((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'search_index_end_id'), 0))"
+        cursor.execute('CREATE TRIGGER IF NOT EXISTS networks_fts_insert AFTER INSERT ON networks BEGIN INSERT INTO networks_fts(rowid, ssid) VALUES (new.id, new.ssid); END')
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS networks_fts_delete AFTER DELETE ON networks WHEN {indexed} BEGIN INSERT INTO networks_fts(networks_fts, rowid, ssid) VALUES ('delete', old.id, old.ssid); END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS networks_fts_update AFTER UPDATE OF ssid ON networks WHEN {indexed} BEGIN INSERT INTO networks_fts(networks_fts, rowid, ssid) VALUES ('delete', old.id, old.ssid); INSERT INTO networks_fts(rowid, ssid) VALUES (new.id, new.ssid); END")
+        cursor.execute('INSERT OR REPLACE INTO metadata(key, value) SELECT \'search_index_end_id\', IFNULL(MAX(id), 0) FROM networks') # last network to backfill
+        cursor.execute('INSERT OR REPLACE INTO metadata(key, value) VALUES (\'search_index_last_id\', 0)') # last network backfilled
+        return tokenizer
+
+    def __create_spatial_index(self, cursor):
+        '''
+        Create the R*Tree of the wardrive coordinates, kept in sync with the wardrive table by triggers. Rows saved
+        before it existed are added by the maintenance job (see `backfill_spatial_index`).
+        Return False if this SQLite build has no R*Tree
+        '''
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'wardrive_rtree'")
+        if cursor.fetchone():
+            return True
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE wardrive_rtree USING rtree(id, min_latitude, max_latitude, min_longitude, max_longitude)')
+        except sqlite3.OperationalError as e:
+            logging.warning(f'[WARDRIVER] SQLite has no R*Tree, spatial queries will scan the whole table: {e}')
+            return False
+        # coordinates are stored as TEXT, the index keeps them as (32 bit) REAL: queries check the exact ones
+        cursor.execute('CREATE TRIGGER IF NOT EXISTS wardrive_rtree_insert AFTER INSERT ON wardrive BEGIN INSERT INTO wardrive_rtree VALUES (new.id, CAST(new.latitude AS REAL), CAST(new.latitude AS REAL), CAST(new.longitude AS REAL), CAST(new.longitude AS REAL)); END')
+        cursor.execute('CREATE TRIGGER IF NOT EXISTS wardrive_rtree_delete AFTER DELETE ON wardrive BEGIN DELETE FROM wardrive_rtree WHERE id = old.id; END')
+        cursor.execute('CREATE TRIGGER IF NOT EXISTS wardrive_rtree_update AFTER UPDATE OF latitude, longitude ON wardrive BEGIN UPDATE wardrive_rtree SET min_latitude = CAST(new.latitude AS REAL), max_latitude = CAST(new.latitude AS REAL), min_longitude = CAST(new.longitude AS REAL), max_longitude = CAST(new.longitude AS REAL) WHERE id = new.id; END')
+        cursor.execute('INSERT OR REPLACE INTO metadata(key, value) SELECT \'spatial_index_end_id\', IFNULL(MAX(id), 0) FROM wardrive') # last row to backfill
+        cursor.execute('INSERT OR REPLACE INTO metadata(key, value) VALUES (\'spatial_index_last_id\', 0)') # last row backfilled
+        return True
+
     def disconnect(self):
-        self.__connection.commit()
-        self.__connection.close()
+        with self.__write_lock, self.__connections_lock:
+            for connection in self.__connections.values():
+                connection.commit()
+                connection.close()
+            self.__connections.clear()
+            self.__local = local()
         logging.info('[WARDRIVER] Closed db connection')
 
     def new_wardriving_session(self, timestamp = None, wigle_uploaded = False):
-        cursor = self.__connection.cursor()
-        if timestamp:
-            cursor.execute('INSERT INTO sessions(created_at, wigle_uploaded) VALUES (?, ?)', [timestamp, wigle_uploaded])
-        else:
-            cursor.execute('INSERT INTO sessions(wigle_uploaded) VALUES (?)', [wigle_uploaded]) # using default values
-        session_id = cursor.lastrowid
-        cursor.close()
-        self.__connection.commit()
-        return session_id
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            if timestamp:
+                cursor.execute('INSERT INTO sessions(created_at, wigle_uploaded) VALUES (?, ?)', [timestamp, wigle_uploaded])
+            else:
+                cursor.execute('INSERT INTO sessions(wigle_uploaded) VALUES (?)', [wigle_uploaded]) # using default values
+            session_id = cursor.lastrowid
+            cursor.close()
+            self.__connection.commit()
+            return session_id
     
     def add_wardrived_network(self, session_id, mac, ssid, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp = None):
-        cursor = self.__connection.cursor()
-        cursor.execute('SELECT id FROM networks WHERE mac = ? AND ssid = ?', [mac, ssid])
-        network = cursor.fetchone()
-        network_id = network[0] if network else None
-        if(not network_id):
-            cursor.execute('INSERT INTO networks(mac, ssid) VALUES (?, ?)', [mac, ssid])
-            network_id = cursor.lastrowid
+        '''
+        Save a network seen during a wardriving session. With deduplication enabled, a network already logged with the same
+        auth mode and channel within the configured distance is only counted as sighted again.
+        Return the coordinates (latitude, longitude, altitude, accuracy) saved for the network
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('SELECT id FROM networks WHERE mac = ? AND ssid = ?', [mac, ssid])
+            network = cursor.fetchone()
+            network_id = network[0] if network else None
+            if(not network_id):
+                cursor.execute('INSERT INTO networks(mac, ssid) VALUES (?, ?)', [mac, ssid])
+                network_id = cursor.lastrowid
+            elif self.__deduplicate_distance > 0:
+                observation = self.__previous_observation(cursor, network_id, auth_mode, channel, latitude, longitude)
+                if observation:
+                    wardrive_id, observation_session_id, *coordinates = observation
+                    seen_timestamp = seen_timestamp or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                    cursor.execute('UPDATE wardrive SET last_seen = ?, sightings = sightings + 1 WHERE id = ?', [seen_timestamp, wardrive_id])
+                    if observation_session_id != session_id:
+                        cursor.execute('INSERT OR IGNORE INTO sightings(session_id, wardrive_id, rssi, seen_timestamp) VALUES (?, ?, ?, ?)', [session_id, wardrive_id, rssi, seen_timestamp])
+                    cursor.close()
+                    self.__connection.commit()
+                    return tuple(coordinates)
         
-        if seen_timestamp:
-            cursor.execute('INSERT INTO wardrive(session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp])
-        else:
-            cursor.execute('INSERT INTO wardrive(session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi])
-        cursor.close()
-        self.__connection.commit()
+            if seen_timestamp:
+                cursor.execute('INSERT INTO wardrive(session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp])
+            else:
+                cursor.execute('INSERT INTO wardrive(session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [session_id, network_id, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi])
+            cursor.close()
+            self.__connection.commit()
+            return latitude, longitude, altitude, accuracy
+
+    def __previous_observation(self, cursor, network_id, auth_mode, channel, latitude, longitude, candidates = 10):
+        '''
+        Return the most recent observation of the network with the same attributes within the deduplication distance, if any
+        '''
+        cursor.execute('SELECT id, session_id, latitude, longitude, altitude, accuracy FROM wardrive WHERE network_id = ? AND auth_mode = ? AND channel = ? ORDER BY id DESC LIMIT ?', [network_id, auth_mode, channel, candidates])
+        for observation in cursor.fetchall():
+            if haversine(latitude, longitude, observation[2], observation[3]) <= self.__deduplicate_distance:
+                return observation
+        return None
    
+    def known_networks(self, networks, chunk_size = 500):
+        '''
+        Return the subset of `networks`, a list of (mac, ssid) tuples, already saved in the db
+        '''
+        cursor = self.__connection.cursor()
+        macs = list({ mac for mac, _ in networks })
+        known = set()
+        for start in range(0, len(macs), chunk_size):
+            chunk = macs[start:start + chunk_size]
+            cursor.execute(f'SELECT mac, ssid FROM networks WHERE mac IN ({",".join("?" * len(chunk))})', chunk)
+            known.update((mac, ssid) for mac, ssid in cursor.fetchall())
+        cursor.close()
+        return known.intersection(networks)
+
+    def session_exists(self, session_id):
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT 1 FROM sessions WHERE id = ?', [session_id])
+        row = cursor.fetchone()
+        cursor.close()
+        return row is not None
+
     def session_networks_count(self, session_id):
         '''
         Return the total networks count for a wardriving session given its id
         '''
         cursor = self.__connection.cursor()
-        cursor.execute('SELECT COUNT(wardrive.id) FROM wardrive JOIN networks ON wardrive.network_id = networks.id WHERE wardrive.session_id = ? GROUP BY wardrive.session_id', [session_id])
+        cursor.execute('SELECT COUNT(wardrive.wardrive_id) FROM session_wardrive wardrive JOIN networks ON wardrive.network_id = networks.id WHERE wardrive.session_id = ? GROUP BY wardrive.session_id', [session_id])
         row = cursor.fetchone()
         cursor.close()
         return row[0] if row else 0
@@ -88,7 +473,7 @@ class Database():
         '''
         cursor = self.__connection.cursor()
         networks = []
-        cursor.execute('SELECT networks.mac, networks.ssid, wardrive.auth_mode, wardrive.latitude, wardrive.longitude, wardrive.altitude, wardrive.accuracy, wardrive.channel, wardrive.rssi, wardrive.seen_timestamp FROM wardrive JOIN networks ON wardrive.network_id = networks.id WHERE wardrive.session_id = ?', [session_id])
+        cursor.execute('SELECT networks.mac, networks.ssid, wardrive.auth_mode, wardrive.latitude, wardrive.longitude, wardrive.altitude, wardrive.accuracy, wardrive.channel, wardrive.rssi, wardrive.seen_timestamp FROM session_wardrive wardrive JOIN networks ON wardrive.network_id = networks.id WHERE wardrive.session_id = ? ORDER BY wardrive.seen_timestamp, wardrive.wardrive_id', [session_id])
         rows = cursor.fetchall()
         for row in rows:
             mac, ssid, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp = row
@@ -107,11 +492,107 @@ class Database():
         cursor.close()
         return networks
 
-    def session_uploaded_to_wigle(self, session_id):
+    def size(self):
+        '''
+        Return the size in bytes of the db file, including the write-ahead log if any
+        '''
+        return sum(os.path.getsize(path) for path in [ self.__path, f'{self.__path}-wal' ] if os.path.exists(path))
+
+    def backup(self, path, pages = 256, progress = None):
+        '''
+        Copy the db to `path` with the SQLite online backup API, `pages` pages at a time. The copy is the snapshot of
+        a read transaction kept open till the end: it includes the changes still in the write-ahead log, the writer
+        is never blocked and the copy doesn't start over whenever the plugin writes. `progress` is called after each
+        step with the pages copied and the total, it can raise to abort the backup
+        '''
+        connection = self.__connection
+        connection.commit()
+        target = sqlite3.connect(path)
+        try:
+            connection.execute('BEGIN')
+            connection.execute('SELECT COUNT(*) FROM sqlite_master').fetchone() # starts the read transaction
+            connection.backup(target, pages = pages, progress = (lambda status, remaining, total: progress(total - remaining, total)) if progress else None)
+        finally:
+            connection.rollback()
+            target.close()
+
+    def session_upload_positions(self, session_id):
+        '''
+        Return the number of observations of a session not uploaded to WiGLE yet and the (latitude, longitude) of the
+        latest one of each network, as `session_upload_candidates` would give them, without reading every observation
+        '''
         cursor = self.__connection.cursor()
-        cursor.execute('UPDATE sessions SET "wigle_uploaded" = 1 WHERE id = ?', [session_id])
+        cursor.execute('SELECT (SELECT COUNT(id) FROM wardrive WHERE session_id = ? AND wigle_uploaded = 0) + (SELECT COUNT(wardrive_id) FROM sightings WHERE session_id = ? AND wigle_uploaded = 0)', [session_id, session_id])
+        count = cursor.fetchone()[0]
+        cursor.execute('''SELECT network_id, latitude, longitude FROM (
+                              SELECT network_id, latitude, longitude, ROW_NUMBER() OVER (PARTITION BY network_id ORDER BY seen_timestamp DESC, id DESC) AS position FROM (
+                                  SELECT id, network_id, latitude, longitude, seen_timestamp FROM wardrive WHERE session_id = ? AND wigle_uploaded = 0
+                                  UNION ALL
+                                  SELECT w.id, w.network_id, w.latitude, w.longitude, s.seen_timestamp FROM sightings s JOIN wardrive w ON w.id = s.wardrive_id WHERE s.session_id = ? AND s.wigle_uploaded = 0))
+                          WHERE position = 1''', [session_id, session_id])
+        positions = { network_id: (float(latitude), float(longitude)) for network_id, latitude, longitude in cursor.fetchall() }
         cursor.close()
-        self.__connection.commit()
+        return count, positions
+
+    def session_uploaded_to_wigle(self, session_id, positions = None):
+        '''
+        Mark a session and all its observations as uploaded to WiGLE. `positions` maps the ids of the networks
+        actually sent to the (latitude, longitude) they have been sent with
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('UPDATE sessions SET "wigle_uploaded" = 1 WHERE id = ?', [session_id])
+            cursor.execute('UPDATE wardrive SET wigle_uploaded = 1 WHERE session_id = ? AND wigle_uploaded = 0', [session_id])
+            cursor.execute('UPDATE sightings SET wigle_uploaded = 1 WHERE session_id = ? AND wigle_uploaded = 0', [session_id])
+            if positions:
+                cursor.executemany('UPDATE networks SET uploaded_latitude = ?, uploaded_longitude = ? WHERE id = ?', [ (latitude, longitude, network_id) for network_id, (latitude, longitude) in positions.items() ])
+            cursor.close()
+            self.__connection.commit()
+
+    def session_uploaded_observations(self, session_id):
+        '''
+        Return the number of observations of a session already uploaded to WiGLE
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT (SELECT COUNT(id) FROM wardrive WHERE session_id = ? AND wigle_uploaded = 1) + (SELECT COUNT(wardrive_id) FROM sightings WHERE session_id = ? AND wigle_uploaded = 1)', [session_id, session_id])
+        uploaded = cursor.fetchone()[0]
+        cursor.close()
+        return uploaded
+
+    def session_upload_candidates(self, session_id, chunk_size = 1000):
+        '''
+        Generator over the observations of a session not uploaded to WiGLE yet, along with the position their network
+        has been last uploaded from (None if never uploaded)
+        '''
+        columns = 'n.mac, n.ssid, w.auth_mode, w.latitude, w.longitude, w.altitude, w.accuracy, w.channel'
+        cursor = self.__connection.cursor()
+        try:
+            cursor.execute(f'''SELECT w.id, w.network_id, {columns}, w.rssi, w.seen_timestamp, n.uploaded_latitude, n.uploaded_longitude FROM wardrive w JOIN networks n ON n.id = w.network_id WHERE w.session_id = ? AND w.wigle_uploaded = 0
+                               UNION ALL
+                               SELECT w.id, w.network_id, {columns}, s.rssi, s.seen_timestamp, n.uploaded_latitude, n.uploaded_longitude FROM sightings s JOIN wardrive w ON w.id = s.wardrive_id JOIN networks n ON n.id = w.network_id WHERE s.session_id = ? AND s.wigle_uploaded = 0
+                               ORDER BY 12, 1''', [session_id, session_id])
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    wardrive_id, network_id, mac, ssid, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp, uploaded_latitude, uploaded_longitude = row
+                    yield {
+                        'network_id': network_id,
+                        'mac': mac,
+                        'ssid': ssid,
+                        'auth_mode': auth_mode,
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'altitude': altitude,
+                        'accuracy': accuracy,
+                        'channel': channel,
+                        'rssi': rssi,
+                        'seen_timestamp': seen_timestamp,
+                        'uploaded_position': (uploaded_latitude, uploaded_longitude) if uploaded_latitude is not None else None
+                    }
+        finally:
+            cursor.close()
     
     def wigle_sessions_not_uploaded(self, current_session_id):
         '''
@@ -126,15 +607,126 @@ class Database():
         cursor.close()
         return sessions_ids
 
-    def remove_empty_sessions(self):
+    def remove_empty_sessions(self, current_session_id = None):
+        '''
+        Remove all sessions that doesn't have any network excluding `current_session_id`
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('DELETE FROM track WHERE session_id IN (SELECT id FROM sessions WHERE sessions.id NOT IN (SELECT wardrive.session_id FROM wardrive UNION SELECT sightings.session_id FROM sightings) AND sessions.id IS NOT ?)', [current_session_id])
+            cursor.execute('DELETE FROM sessions WHERE sessions.id NOT IN (SELECT wardrive.session_id FROM wardrive UNION SELECT sightings.session_id FROM sightings) AND sessions.id IS NOT ?', [current_session_id])
+            cursor.close()
+            self.__connection.commit()
+
+    # Maintenance queries
+    def old_sessions(self, days, current_session_id, uploaded_only = False):
+        '''
+        Return the list of ids of sessions created more than `days` days ago excluding `current_session_id`
+        '''
+        cursor = self.__connection.cursor()
+        query = 'SELECT id FROM sessions WHERE created_at < datetime(\'now\', ?) AND id <> ?'
+        if uploaded_only:
+            query += ' AND wigle_uploaded = 1'
+        cursor.execute(query, [f'-{int(days)} days', current_session_id])
+        sessions_ids = [ row[0] for row in cursor.fetchall() ]
+        cursor.close()
+        return sessions_ids
+
+    def prepare_prune(self, sessions_ids, keep_best = True):
+        '''
+        Collect in a temporary table the ids of the wardrive rows to delete for the given sessions.
+        If `keep_best` is set, only the best observation (highest RSSI) of each network is kept.
+        Return the number of rows collected
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('DROP TABLE IF EXISTS temp.prune_ids')
+            cursor.execute('CREATE TEMP TABLE prune_ids ("id" INTEGER PRIMARY KEY)')
+            placeholders = ','.join('?' * len(sessions_ids))
+            if keep_best:
+                # rows sighted again in sessions that are not pruned are still needed by those sessions
+                still_sighted = f'SELECT wardrive_id FROM sightings WHERE session_id NOT IN ({placeholders})'
+                cursor.execute(f'INSERT INTO temp.prune_ids(id) SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY network_id ORDER BY rssi DESC, id ASC) AS position FROM wardrive WHERE session_id IN ({placeholders})) WHERE position > 1 AND id NOT IN ({still_sighted})', sessions_ids * 2)
+            else:
+                cursor.execute(f'DELETE FROM sightings WHERE session_id IN ({placeholders})', sessions_ids)
+                # rows sighted again are handed over to the first later session that sighted them
+                cursor.execute(f'UPDATE wardrive SET (session_id, rssi, seen_timestamp) = (SELECT s.session_id, s.rssi, s.seen_timestamp FROM sightings s WHERE s.wardrive_id = wardrive.id ORDER BY s.session_id LIMIT 1) WHERE session_id IN ({placeholders}) AND id IN (SELECT wardrive_id FROM sightings)', sessions_ids)
+                cursor.execute('DELETE FROM sightings WHERE EXISTS (SELECT 1 FROM wardrive WHERE wardrive.id = sightings.wardrive_id AND wardrive.session_id = sightings.session_id)')
+                cursor.execute(f'INSERT INTO temp.prune_ids(id) SELECT id FROM wardrive WHERE session_id IN ({placeholders})', sessions_ids)
+            cursor.execute('SELECT COUNT(id) FROM temp.prune_ids')
+            total = cursor.fetchone()[0]
+            cursor.close()
+            self.__connection.commit()
+            return total
+
+    def prune_batch(self, last_id, batch_size):
+        '''
+        Delete the next `batch_size` rows collected by `prepare_prune` with id greater than `last_id`.
+        Return the id of the last deleted row and the number of deleted rows
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('SELECT MAX(id), COUNT(id) FROM (SELECT id FROM temp.prune_ids WHERE id > ? ORDER BY id LIMIT ?)', [last_id, batch_size])
+            max_id, count = cursor.fetchone()
+            if count > 0:
+                cursor.execute('DELETE FROM sightings WHERE wardrive_id IN (SELECT id FROM temp.prune_ids WHERE id > ? AND id <= ?)', [last_id, max_id])
+                cursor.execute('DELETE FROM wardrive WHERE id IN (SELECT id FROM temp.prune_ids WHERE id > ? AND id <= ?)', [last_id, max_id])
+            cursor.close()
+            self.__connection.commit()
+            return max_id, count
+
+    def finish_prune(self):
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('DROP TABLE IF EXISTS temp.prune_ids')
+            cursor.close()
+            self.__connection.commit()
+
+    def remove_orphan_networks(self):
         '''
-        Remove all sessions that doesn't have any network
+        Remove all networks that doesn't have any wardrive row. Return the number of removed networks
         '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('DELETE FROM networks WHERE id NOT IN (SELECT DISTINCT network_id FROM wardrive)')
+            removed = cursor.rowcount
+            cursor.close()
+            self.__connection.commit()
+            return removed
+
+    def auto_vacuum_mode(self):
         cursor = self.__connection.cursor()
-        cursor.execute('DELETE FROM sessions WHERE sessions.id NOT IN (SELECT wardrive.session_id FROM wardrive GROUP BY wardrive.session_id)')
+        cursor.execute('PRAGMA auto_vacuum')
+        mode = cursor.fetchone()[0]
         cursor.close()
+        return mode
+
+    def enable_incremental_vacuum(self):
+        '''
+        Switch the db to incremental auto vacuum. This requires a full VACUUM and it's done only once.
+        The write lock is not held: the VACUUM takes the db lock itself and the other writers wait for it
+        '''
         self.__connection.commit()
-    
+        cursor = self.__connection.cursor()
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+        cursor.close()
+
+    def free_pages(self):
+        cursor = self.__connection.cursor()
+        cursor.execute('PRAGMA freelist_count')
+        pages = cursor.fetchone()[0]
+        cursor.close()
+        return pages
+
+    def incremental_vacuum(self, pages):
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+            cursor.fetchall() # the pragma frees one page per returned row
+            cursor.close()
+            self.__connection.commit()
+
     # Web UI queries
     def general_stats(self):
         cursor = self.__connection.cursor()
@@ -153,7 +745,7 @@ class Database():
     
     def sessions(self):
         cursor = self.__connection.cursor()
-        cursor.execute('SELECT sessions.*, COUNT(wardrive.id) FROM sessions JOIN wardrive ON sessions.id = wardrive.session_id GROUP BY sessions.id')
+        cursor.execute('SELECT sessions.id, sessions.created_at, sessions.wigle_uploaded, COUNT(wardrive.wardrive_id) FROM sessions JOIN session_wardrive wardrive ON sessions.id = wardrive.session_id GROUP BY sessions.id')
         rows = cursor.fetchall()
         sessions = []
         for row in rows:
@@ -170,7 +762,7 @@ class Database():
         cursor = self.__connection.cursor()
         cursor.execute('SELECT created_at FROM sessions WHERE id = ?', [session_id])
         created_at = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(id) FROM wardrive WHERE session_id = ?', [session_id])
+        cursor.execute('SELECT COUNT(wardrive_id) FROM session_wardrive WHERE session_id = ?', [session_id])
         networks = cursor.fetchone()[0]
         cursor.close()
         return {
@@ -179,115 +771,2118 @@ class Database():
             "networks": networks
         }
 
-    def networks(self):
+    NETWORKS_COLUMNS = [ 'id', 'mac', 'ssid', 'first_seen', 'first_session', 'last_seen', 'last_session', 'sessions_count' ]
+
+    def networks(self, after_id = 0, limit = 5000):
+        '''
+        Return a page of `limit` networks with id greater than `after_id`, as rows with `NETWORKS_COLUMNS` values,
+        and the id to start the next page from (None if it's the last one)
+        '''
         cursor = self.__connection.cursor()
-        cursor.execute('SELECT n.*, MIN(w.seen_timestamp), MIN(w.session_id), MAX(w.seen_timestamp), MAX(w.session_id), COUNT(n.id) FROM networks n JOIN wardrive w ON n.id = w.network_id GROUP BY n.id')
-        rows = cursor.fetchall()
-        networks = []
-        for row in rows:
-            id, mac, ssid, first_seen, first_session, last_seen, last_session, sessions_count = row
-            networks.append({
-                "id": id,
-                "mac": mac,
-                "ssid": ssid,
-                "first_seen": first_seen,
-                "first_session": first_session,
-                "last_seen": last_seen,
-                "last_session": last_session,
-                "sessions_count": sessions_count
-            })
+        cursor.execute('SELECT id, mac, ssid FROM networks WHERE id > ? ORDER BY id LIMIT ?', [after_id, limit])
+        page = cursor.fetchall()
+        if not page:
+            cursor.close()
+            return [], None
+        history = self.__networks_history(cursor, 'BETWEEN ? AND ?', [page[0][0], page[-1][0]])
         cursor.close()
-        
-        return networks
+        rows = [ [ network_id, mac, ssid, *history[network_id] ] for network_id, mac, ssid in page if network_id in history ]
+        return rows, page[-1][0] if len(page) == limit else None
+
+    def __networks_history(self, cursor, network_filter, parameters):
+        '''
+        Return first seen, first session, last seen, last session and sessions count of the networks whose id
+        matches `network_filter` (e.g. 'IN (?, ?)'), from their observations and sightings
+        '''
+        # both read through the network_id index
+        history = dict()
+        cursor.execute(f'SELECT network_id, MIN(seen_timestamp), MIN(session_id), MAX(IFNULL(last_seen, seen_timestamp)), MAX(session_id), COUNT(id) FROM wardrive WHERE network_id {network_filter} GROUP BY network_id', parameters)
+        for network_id, *row in cursor.fetchall():
+            history[network_id] = row
+        cursor.execute(f'SELECT w.network_id, MIN(s.seen_timestamp), MIN(s.session_id), MAX(s.seen_timestamp), MAX(s.session_id), COUNT(s.session_id) FROM wardrive w JOIN sightings s ON s.wardrive_id = w.id WHERE w.network_id {network_filter} GROUP BY w.network_id', parameters)
+        for network_id, first_seen, first_session, last_seen, last_session, sessions_count in cursor.fetchall():
+            row = history.get(network_id)
+            if row:
+                history[network_id] = [ min(row[0], first_seen), min(row[1], first_session), max(row[2], last_seen), max(row[3], last_session), row[4] + sessions_count ]
+        return history
+
+    def search_networks(self, query, limit = 50, offset = 0):
+        '''
+        Search networks by SSID and MAC/OUI prefix. Return a page of `limit` rows with `NETWORKS_COLUMNS` values,
+        best matches first: MAC prefix matches, exact SSIDs, then SSIDs by FTS5 rank (among the first
+        `SEARCH_MAX_MATCHES`). Also return the offset of the next page (None if it's the last one)
+        '''
+        query = query.strip()
+        if not query:
+            return [], None
+        legs, parameters = [], []
+        cursor = self.__connection.cursor()
+        last_id, end_id = self.__search_backfill(cursor)
+        tokenizer = self.__search_tokenizer if last_id >= end_id else None # the index is used once it has all the networks
+        mac_key = re.sub(r'[\s:.-]', '', query).lower()
+        if len(mac_key) >= 2 and re.fullmatch(r'[0-9a-f]+', mac_key):
+            # hex digits are always lower than 'g': range scan of the normalised MAC index (a scan until it's built)
+            legs.append(f'SELECT id, -2e9 AS score FROM networks WHERE {self.MAC_KEY} >= ? AND {self.MAC_KEY} < ?')
+            parameters += [ mac_key, mac_key + 'g' ]
+        if tokenizer == 'trigram' and len(query) >= 3:
+            # a phrase is matched as a substring by the trigram tokenizer
+            legs.append('SELECT * FROM (SELECT rowid AS id, CASE WHEN lower(ssid) = lower(?) THEN -1e9 ELSE rank END AS score FROM networks_fts WHERE networks_fts MATCH ? LIMIT ?)')
+            parameters += [ query, '"' + query.replace('"', '""') + '"', self.SEARCH_MAX_MATCHES ]
+        elif tokenizer == 'unicode61' and re.search(r'\w', query):
+            # every word must be the prefix of a word of the SSID
+            legs.append('SELECT * FROM (SELECT rowid AS id, CASE WHEN lower(ssid) = lower(?) THEN -1e9 ELSE rank END AS score FROM networks_fts WHERE networks_fts MATCH ? LIMIT ?)')
+            parameters += [ query, ' '.join('"' + word.replace('"', '""') + '"*' for word in re.findall(r'\w+', query)), self.SEARCH_MAX_MATCHES ]
+        else:
+            # no usable index (no FTS5 or query shorter than a trigram): scan, exact and prefix matches first
+            legs.append("SELECT * FROM (SELECT id, CASE WHEN lower(ssid) = lower(?) THEN -1e9 WHEN ssid LIKE ? ESCAPE '\\' THEN -1 ELSE 0 END AS score FROM networks WHERE ssid LIKE ? ESCAPE '\\' LIMIT ?)")
+            pattern = re.sub(r'([\\%_])', r'\\\1', query)
+            parameters += [ query, pattern + '%', '%' + pattern + '%', self.SEARCH_MAX_MATCHES ]
+        cursor.execute(f'SELECT id, MIN(score) FROM ({" UNION ALL ".join(legs)}) GROUP BY id ORDER BY 2, 1 LIMIT ? OFFSET ?', parameters + [ limit + 1, offset ])
+        ids = [ row[0] for row in cursor.fetchall() ]
+        more = len(ids) > limit
+        ids = ids[:limit]
+        if not ids:
+            cursor.close()
+            return [], None
+        placeholders = ','.join('?' * len(ids))
+        cursor.execute(f'SELECT id, mac, ssid FROM networks WHERE id IN ({placeholders})', ids)
+        networks = { network_id: (mac, ssid) for network_id, mac, ssid in cursor.fetchall() }
+        history = self.__networks_history(cursor, f'IN ({placeholders})', ids)
+        cursor.close()
+        rows = [ [ network_id, *networks[network_id], *history[network_id] ] for network_id in ids if network_id in history ]
+        return rows, offset + limit if more else None
+
+    def map_points(self):
+        '''
+        Return the coordinates where networks have been seen, as (point id, latitude, longitude, networks count).
+        The point id is the first wardrive row seen at those coordinates
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT MIN(id), latitude, longitude, COUNT(DISTINCT network_id) FROM wardrive GROUP BY latitude, longitude')
+        points = [ (point_id, float(latitude), float(longitude), count) for point_id, latitude, longitude, count in cursor.fetchall() ]
+        cursor.close()
+        return points
+
+    def map_point_networks(self, point_id, limit = 7):
+        '''
+        Return the networks seen at the coordinates of the given map point (at most `limit`) and their total number
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT latitude, longitude FROM wardrive WHERE id = ?', [point_id])
+        row = cursor.fetchone()
+        if row is None:
+            cursor.close()
+            return None
+        cursor.execute('SELECT COUNT(DISTINCT network_id) FROM wardrive WHERE latitude = ? AND longitude = ?', row)
+        total = cursor.fetchone()[0]
+        cursor.execute('SELECT n.mac, n.ssid FROM networks n WHERE n.id IN (SELECT DISTINCT network_id FROM wardrive WHERE latitude = ? AND longitude = ? LIMIT ?) ORDER BY n.ssid', [*row, limit])
+        networks = [ { 'mac': mac, 'ssid': ssid } for mac, ssid in cursor.fetchall() ]
+        cursor.close()
+        return {
+            'total': total,
+            'networks': networks
+        }
+
+    # Coverage grid
+    def aggregate_coverage(self, limit):
+        '''
+        Aggregate in the coverage grid up to `limit` wardrive rows not aggregated yet. Return how many rows are still pending
+        '''
+        with self.__coverage_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('SELECT CAST(value AS INTEGER) FROM metadata WHERE key = \'coverage_last_id\'')
+            last_id = cursor.fetchone()[0]
+            cursor.execute('SELECT IFNULL(MAX(id), 0) FROM wardrive')
+            max_id = cursor.fetchone()[0]
+            batch_end = min(last_id + limit, max_id)
+            if batch_end > last_id:
+                # cells are computed here and not with a SQL function: Python functions called by SQLite can deadlock with
+                # other threads using the connection
+                finest = max(self.COVERAGE_PRECISIONS)
+                cells = dict()
+                cells_networks = set()
+                cursor.execute('SELECT network_id, latitude, longitude, rssi, seen_timestamp FROM wardrive WHERE id > ? AND id <= ?', [last_id, batch_end])
+                for network_id, latitude, longitude, rssi, seen_timestamp in cursor.fetchall():
+                    finest_cell = geohash(latitude, longitude, finest)
+                    for precision in self.COVERAGE_PRECISIONS: # coarser cells are prefixes of the finest one
+                        key = (precision, finest_cell[:precision])
+                        cells_networks.add((*key, network_id))
+                        cell = cells.get(key)
+                        if cell:
+                            cell[1] = max(cell[1], rssi)
+                            cell[2] = max(cell[2], seen_timestamp or '')
+                        else:
+                            cells[key] = [ 0, rssi, seen_timestamp or '' ]
+                with self.__write_lock: # the writer waits only for the upsert, not for the aggregation
+                    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS coverage_batch ("precision" INTEGER NOT NULL, "cell" TEXT NOT NULL, "network_id" INTEGER NOT NULL, PRIMARY KEY("precision", "cell", "network_id")) WITHOUT ROWID')
+                    cursor.execute('DELETE FROM temp.coverage_batch')
+                    cursor.executemany('INSERT INTO temp.coverage_batch(precision, cell, network_id) VALUES (?, ?, ?)', cells_networks)
+                    # networks already counted in the cell are not counted again
+                    cursor.execute('''SELECT precision, cell, COUNT(*) FROM temp.coverage_batch b
+                                      WHERE NOT EXISTS (SELECT 1 FROM coverage_networks c WHERE c.precision = b.precision AND c.cell = b.cell AND c.network_id = b.network_id) GROUP BY precision, cell''')
+                    for precision, cell, count in cursor.fetchall():
+                        cells[(precision, cell)][0] = count
+                    cursor.execute('INSERT OR IGNORE INTO coverage_networks(precision, cell, network_id) SELECT precision, cell, network_id FROM temp.coverage_batch')
+                    cursor.executemany('''INSERT INTO coverage(precision, cell, latitude, longitude, networks, max_rssi, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                          ON CONFLICT(precision, cell) DO UPDATE SET networks = networks + excluded.networks, max_rssi = MAX(max_rssi, excluded.max_rssi), last_seen = MAX(last_seen, excluded.last_seen)''',
+                                       [ (precision, cell, *geohash_center(cell), *values) for (precision, cell), values in cells.items() ])
+                    cursor.execute('UPDATE metadata SET value = ? WHERE key = \'coverage_last_id\'', [batch_end])
+                    self.__connection.commit()
+            cursor.close()
+            return max_id - batch_end
+
+    def coverage(self, precision, bounds = None):
+        '''
+        Return the coverage cells of the given precision, optionally only the ones with center inside (south, west, north, east) bounds
+        '''
+        cursor = self.__connection.cursor()
+        if bounds:
+            south, west, north, east = bounds
+            cursor.execute('SELECT cell, networks, max_rssi, last_seen FROM coverage WHERE precision = ? AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?', [precision, south, north, west, east])
+        else:
+            cursor.execute('SELECT cell, networks, max_rssi, last_seen FROM coverage WHERE precision = ?', [precision])
+        cells = []
+        for cell, networks, max_rssi, last_seen in cursor.fetchall():
+            cells.append([ *geohash_bounds(cell), networks, max_rssi, last_seen ])
+        cursor.close()
+        return cells
+
+    def backfill_spatial_index(self, limit):
+        '''
+        Add to the spatial index up to `limit` wardrive rows saved before it existed. Return how many rows are still pending
+        '''
+        if not self.__spatial_index:
+            return 0
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            last_id, end_id = self.__spatial_backfill(cursor)
+            batch_end = min(last_id + limit, end_id)
+            if batch_end > last_id:
+                cursor.execute('INSERT INTO wardrive_rtree SELECT id, CAST(latitude AS REAL), CAST(latitude AS REAL), CAST(longitude AS REAL), CAST(longitude AS REAL) FROM wardrive WHERE id > ? AND id <= ?', [last_id, batch_end])
+                cursor.execute('UPDATE metadata SET value = ? WHERE key = \'spatial_index_last_id\'', [batch_end])
+                self.__connection.commit()
+            cursor.close()
+            return end_id - batch_end
+
+    def backfill_uploaded(self, limit):
+        '''
+        Flag as uploaded the rows of up to `limit` sessions uploaded before each row had its own flag, the latest
+        first, and save where their networks have been uploaded from. Meanwhile novel-only uploads see those networks
+        as never uploaded. Return how many sessions are still pending
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('SELECT CAST(value AS INTEGER) FROM metadata WHERE key = \'uploaded_backfill_session_id\'')
+            row = cursor.fetchone()
+            if row is None:
+                cursor.close()
+                return 0
+            next_id = row[0] # sessions with lower ids are still to flag
+            cursor.execute('SELECT id FROM sessions WHERE id < ? AND wigle_uploaded = 1 ORDER BY id DESC LIMIT ?', [next_id, limit])
+            sessions_ids = [ row[0] for row in cursor.fetchall() ]
+            if sessions_ids:
+                placeholders = ','.join('?' * len(sessions_ids))
+                cursor.execute(f'UPDATE wardrive SET wigle_uploaded = 1 WHERE session_id IN ({placeholders})', sessions_ids)
+                cursor.execute(f'UPDATE sightings SET wigle_uploaded = 1 WHERE session_id IN ({placeholders})', sessions_ids)
+                # networks already set have been uploaded from a later session
+                cursor.execute(f'''UPDATE networks SET (uploaded_latitude, uploaded_longitude) = (SELECT CAST(latitude AS REAL), CAST(longitude AS REAL) FROM wardrive WHERE network_id = networks.id AND wigle_uploaded = 1 ORDER BY id DESC LIMIT 1)
+                                   WHERE uploaded_latitude IS NULL AND id IN (SELECT network_id FROM wardrive WHERE session_id IN ({placeholders}))''', sessions_ids)
+                next_id = sessions_ids[-1]
+                cursor.execute('UPDATE metadata SET value = ? WHERE key = \'uploaded_backfill_session_id\'', [next_id])
+            cursor.execute('SELECT COUNT(*) FROM sessions WHERE id < ? AND wigle_uploaded = 1', [next_id])
+            pending = cursor.fetchone()[0]
+            if pending == 0:
+                cursor.execute('DELETE FROM metadata WHERE key = \'uploaded_backfill_session_id\'')
+            cursor.close()
+            self.__connection.commit()
+            return pending
+
+    def backfill_search_index(self, limit):
+        '''
+        Add to the SSIDs index up to `limit` networks saved before it existed. Return how many networks are still pending
+        '''
+        if not self.__search_tokenizer:
+            return 0
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            last_id, end_id = self.__search_backfill(cursor)
+            batch_end = min(last_id + limit, end_id)
+            if batch_end > last_id:
+                cursor.execute('INSERT INTO networks_fts(rowid, ssid) SELECT id, ssid FROM networks WHERE id > ? AND id <= ?', [last_id, batch_end])
+                cursor.execute('UPDATE metadata SET value = ? WHERE key = \'search_index_last_id\'', [batch_end])
+                self.__connection.commit()
+            cursor.close()
+            return end_id - batch_end
+
+    def __search_backfill(self, cursor):
+        '''
+        Return the last network added to the SSIDs index by the backfill and the last one it has to add
+        '''
+        cursor.execute('SELECT key, CAST(value AS INTEGER) FROM metadata WHERE key IN (\'search_index_last_id\', \'search_index_end_id\')')
+        values = dict(cursor.fetchall())
+        return values.get('search_index_last_id', 0), values.get('search_index_end_id', 0)
+
+    def has_mac_index(self):
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE name = \'networks_mac_key\'')
+        row = cursor.fetchone()
+        cursor.close()
+        return row is not None
+
+    def create_mac_index(self):
+        '''
+        Create the normalised MAC index used by the MAC/OUI prefix search. It reads the whole networks table, so the
+        maintenance job builds it once in background instead of at startup
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS networks_mac_key ON networks({self.MAC_KEY})')
+            cursor.close()
+            self.__connection.commit()
+
+    def __spatial_backfill(self, cursor):
+        '''
+        Return the last wardrive row added to the spatial index by the backfill and the last one it has to add
+        '''
+        cursor.execute('SELECT key, CAST(value AS INTEGER) FROM metadata WHERE key IN (\'spatial_index_last_id\', \'spatial_index_end_id\')')
+        values = dict(cursor.fetchall())
+        return values.get('spatial_index_last_id', 0), values.get('spatial_index_end_id', 0)
+
+    def __bounds_filter(self, cursor, south, west, north, east):
+        '''
+        Return the source and the condition (with parameters) selecting the wardrive rows `w` inside the bounds.
+        The spatial index is used only once it has all the rows, before that the whole table is scanned
+        '''
+        exact = 'CAST(w.latitude AS REAL) BETWEEN ? AND ? AND CAST(w.longitude AS REAL) BETWEEN ? AND ?'
+        if self.__spatial_index:
+            last_id, end_id = self.__spatial_backfill(cursor)
+            if last_id >= end_id:
+                # CROSS JOIN: always read the index first
+                return 'wardrive_rtree r CROSS JOIN wardrive w ON w.id = r.id', f'r.max_latitude >= ? AND r.min_latitude <= ? AND r.max_longitude >= ? AND r.min_longitude <= ? AND {exact}', [ south, north, west, east ] * 2
+        return 'wardrive w', exact, [ south, north, west, east ]
+
+    @staticmethod
+    def __split_bounds(south, west, north, east):
+        '''
+        Bounds crossing the antimeridian (west > east) are split in two
+        '''
+        if west > east:
+            return [ (south, west, north, 180), (south, -180, north, east) ]
+        return [ (south, west, north, east) ]
+
+    def networks_in_bounds(self, south, west, north, east, limit = 1000):
+        '''
+        Return the networks seen inside (south, west, north, east) bounds, as rows with `SPATIAL_COLUMNS` values
+        of their strongest observation there, strongest first (at most `limit`)
+        '''
+        networks = dict()
+        cursor = self.__connection.cursor()
+        for bounds in self.__split_bounds(south, west, north, east):
+            source, condition, parameters = self.__bounds_filter(cursor, *bounds)
+            # the bare columns are taken from the row with MAX(rssi)
+            cursor.execute(f'''SELECT w.network_id, n.mac, n.ssid, w.auth_mode, w.channel, MAX(w.rssi), w.latitude, w.longitude, w.seen_timestamp, w.session_id
+                               FROM {source} JOIN networks n ON n.id = w.network_id WHERE {condition} GROUP BY w.network_id ORDER BY 6 DESC LIMIT ?''', parameters + [ limit ])
+            for row in cursor.fetchall():
+                if row[0] not in networks or networks[row[0]][5] < row[5]:
+                    networks[row[0]] = [ *row[:6], float(row[6]), float(row[7]), *row[8:], None ]
+        cursor.close()
+        return sorted(networks.values(), key = lambda network: -network[5])[:limit]
+
+    def networks_in_radius(self, latitude, longitude, radius, limit = 1000):
+        '''
+        Return the networks seen within `radius` meters from the coordinates, as rows with `SPATIAL_COLUMNS` values
+        of their nearest observation, nearest first (at most `limit`, None for all of them)
+        '''
+        # bounding box of the circle from the index, then the exact distance
+        latitude_delta = math.degrees(radius / 6371000)
+        cos_latitude = math.cos(math.radians(latitude))
+        longitude_delta = latitude_delta / cos_latitude if cos_latitude > 1e-6 else 360
+        south, north = max(latitude - latitude_delta, -90), min(latitude + latitude_delta, 90)
+        if longitude_delta >= 180 or south == -90 or north == 90:
+            west, east = -180, 180 # the circle contains a pole
+        else:
+            west, east = (longitude - longitude_delta + 180) % 360 - 180, (longitude + longitude_delta + 180) % 360 - 180
+        # squared equirectangular distance: orders the rows like the exact one, so only the nearest `limit` are read
+        latitude_distance = '(CAST(w.latitude AS REAL) - ?)'
+        longitude_distance = '(MIN(ABS(CAST(w.longitude AS REAL) - ?), 360 - ABS(CAST(w.longitude AS REAL) - ?)) * ?)'
+        distance_parameters = [ latitude, latitude ] + [ longitude, longitude, max(cos_latitude, 1e-6) ] * 2
+        networks = dict()
+        cursor = self.__connection.cursor()
+        for bounds in self.__split_bounds(south, west, north, east):
+            source, condition, parameters = self.__bounds_filter(cursor, *bounds)
+            # the bare columns are taken from the row with MIN(distance)
+            cursor.execute(f'''SELECT w.network_id, n.mac, n.ssid, w.auth_mode, w.channel, w.rssi, w.latitude, w.longitude, w.seen_timestamp, w.session_id,
+                                      MIN({latitude_distance} * {latitude_distance} + {longitude_distance} * {longitude_distance})
+                               FROM {source} JOIN networks n ON n.id = w.network_id WHERE {condition} GROUP BY w.network_id ORDER BY 11 LIMIT ?''',
+                           distance_parameters + parameters + [ limit if limit is not None else -1 ])
+            for row in cursor.fetchall():
+                distance = haversine(latitude, longitude, row[6], row[7])
+                if distance <= radius and (row[0] not in networks or networks[row[0]][-1] > distance):
+                    networks[row[0]] = [ *row[:6], float(row[6]), float(row[7]), *row[8:10], round(distance, 1) ]
+        cursor.close()
+        return sorted(networks.values(), key = lambda network: network[-1])[:limit]
+
+    def nearest_networks(self, latitude, longitude, count = 10):
+        '''
+        Return the `count` networks seen nearest to the coordinates (within `SPATIAL_MAX_RADIUS`), like `networks_in_radius`.
+        The radius grows until `count` networks are inside it, reading at most `count` networks each time
+        '''
+        radius = 100
+        while True:
+            networks = self.networks_in_radius(latitude, longitude, radius, count)
+            if len(networks) >= count or radius >= self.SPATIAL_MAX_RADIUS:
+                return networks
+            radius = min(radius * 4, self.SPATIAL_MAX_RADIUS)
+
+    def add_track_fixes(self, fixes):
+        '''
+        Save the (session id, timestamp, latitude, longitude, altitude, speed) GPS fixes
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.executemany('INSERT OR IGNORE INTO track(session_id, timestamp, latitude, longitude, altitude, speed) VALUES (?, ?, ?, ?, ?, ?)', fixes)
+            cursor.close()
+            self.__connection.commit()
+
+    def session_track(self, session_id):
+        '''
+        Return the (timestamp, latitude, longitude) GPS fixes of the session, in time order
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT timestamp, latitude, longitude FROM track WHERE session_id = ? ORDER BY timestamp', [session_id])
+        fixes = cursor.fetchall()
+        cursor.close()
+        return fixes
+
+    def networks_to_locate(self):
+        '''
+        Return the sorted ids of the networks with observations saved after the last locations estimate, and the last wardrive row
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT CAST(value AS INTEGER) FROM metadata WHERE key = \'locations_last_id\'')
+        last_id = cursor.fetchone()[0]
+        cursor.execute('SELECT IFNULL(MAX(id), 0) FROM wardrive')
+        max_id = cursor.fetchone()[0]
+        if last_id == 0:
+            cursor.execute('SELECT DISTINCT network_id FROM wardrive ORDER BY network_id') # read from the network_id index
+        else:
+            cursor.execute('SELECT DISTINCT network_id FROM wardrive WHERE id > ? AND id <= ? ORDER BY network_id', [last_id, max_id])
+        network_ids = [ row[0] for row in cursor.fetchall() ]
+        cursor.close()
+        return network_ids, max_id
+
+    def location_observations(self, network_ids, chunk_size = 500):
+        '''
+        Return (network id, latitude, longitude, rssi, accuracy) of all the observations of the networks in the sorted
+        `network_ids`, ordered by network. Networks are looked up by id: after the first estimate they are sparse
+        '''
+        cursor = self.__connection.cursor()
+        observations = []
+        for start in range(0, len(network_ids), chunk_size):
+            chunk = network_ids[start:start + chunk_size]
+            cursor.execute(f'SELECT network_id, CAST(latitude AS REAL), CAST(longitude AS REAL), rssi, accuracy FROM wardrive WHERE network_id IN ({",".join("?" * len(chunk))}) ORDER BY network_id', chunk)
+            observations += cursor.fetchall()
+        cursor.close()
+        return observations
+
+    def save_network_locations(self, locations, last_id = None):
+        '''
+        Save the estimated (network id, latitude, longitude, uncertainty, observations) and, once all of them
+        are saved, the last wardrive row used for the estimates
+        '''
+        with self.__write_lock:
+            cursor = self.__connection.cursor()
+            cursor.executemany('UPDATE networks SET estimated_latitude = ?, estimated_longitude = ?, estimated_uncertainty = ?, estimated_observations = ? WHERE id = ?',
+                               [ (latitude, longitude, uncertainty, observations, network_id) for network_id, latitude, longitude, uncertainty, observations in locations ])
+            if last_id is not None:
+                cursor.execute('UPDATE metadata SET value = ? WHERE key = \'locations_last_id\'', [last_id])
+            cursor.close()
+            self.__connection.commit()
+
+    def estimated_locations(self, bounds = None, limit = 5000):
+        '''
+        Return the estimated locations of the networks as [ latitude, longitude, uncertainty, observations, mac, ssid ],
+        optionally only inside (south, west, north, east) bounds, the ones with more observations first
+        '''
+        cursor = self.__connection.cursor()
+        if bounds:
+            south, west, north, east = bounds
+            cursor.execute('SELECT estimated_latitude, estimated_longitude, estimated_uncertainty, estimated_observations, mac, ssid FROM networks WHERE estimated_latitude BETWEEN ? AND ? AND estimated_longitude BETWEEN ? AND ? ORDER BY estimated_observations DESC LIMIT ?', [south, north, west, east, limit])
+        else:
+            cursor.execute('SELECT estimated_latitude, estimated_longitude, estimated_uncertainty, estimated_observations, mac, ssid FROM networks WHERE estimated_latitude IS NOT NULL ORDER BY estimated_observations DESC LIMIT ?', [limit])
+        locations = [ list(row) for row in cursor.fetchall() ]
+        cursor.close()
+        return locations
+
+    # Export queries
+    def sessions_in_range(self, date_from = None, date_to = None):
+        '''
+        Return the ids of sessions created between `date_from` and `date_to` (YYYY-MM-DD, both included)
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT id FROM sessions WHERE (? IS NULL OR created_at >= date(?)) AND (? IS NULL OR created_at < date(?, \'+1 day\')) ORDER BY id', [date_from, date_from, date_to, date_to])
+        sessions_ids = [ row[0] for row in cursor.fetchall() ]
+        cursor.close()
+        return sessions_ids
+
+    def export_networks(self, sessions_ids, deduplicate = False, chunk_size = 1000, estimated = False):
+        '''
+        Generator over the networks of the given sessions, ordered by session, in a single pass over the session index.
+        If `deduplicate` is set, only the best observation (highest RSSI) of each network is returned.
+        If `estimated` is set, networks with an estimated location have its coordinates and uncertainty (as accuracy)
+        '''
+        placeholders = ','.join('?' * len(sessions_ids))
+        columns = 'w.session_id, n.mac, n.ssid, w.auth_mode, w.latitude, w.longitude, w.altitude, w.accuracy, w.channel, w.rssi, w.seen_timestamp'
+        if estimated:
+            columns = columns.replace('w.latitude, w.longitude', 'IFNULL(ROUND(n.estimated_latitude, 7), w.latitude), IFNULL(ROUND(n.estimated_longitude, 7), w.longitude)')
+            columns = columns.replace('w.accuracy', 'IFNULL(CAST(ROUND(n.estimated_uncertainty) AS INTEGER), w.accuracy)')
+        if deduplicate:
+            query = f'SELECT {columns} FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY network_id ORDER BY rssi DESC, wardrive_id ASC) AS position FROM session_wardrive WHERE session_id IN ({placeholders})) w JOIN networks n ON n.id = w.network_id WHERE w.position = 1 ORDER BY w.session_id, w.seen_timestamp, w.wardrive_id'
+        else:
+            query = f'SELECT {columns} FROM session_wardrive w JOIN networks n ON n.id = w.network_id WHERE w.session_id IN ({placeholders}) ORDER BY w.session_id, w.seen_timestamp, w.wardrive_id'
+        cursor = self.__connection.cursor()
+        try:
+            cursor.execute(query, sessions_ids)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    session_id, mac, ssid, auth_mode, latitude, longitude, altitude, accuracy, channel, rssi, seen_timestamp = row
+                    yield {
+                        'session_id': session_id,
+                        'mac': mac,
+                        'ssid': ssid,
+                        'auth_mode': auth_mode,
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'altitude': altitude,
+                        'accuracy': accuracy,
+                        'channel': channel,
+                        'rssi': rssi,
+                        'seen_timestamp': seen_timestamp
+                    }
+        finally:
+            cursor.close()
+
+    # Sync
+    def device_id(self):
+        '''
+        Return the id of this db, used to recognise its sessions once merged into other dbs
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT value FROM metadata WHERE key = \'device_id\'')
+        device_id = cursor.fetchone()[0]
+        cursor.close()
+        return device_id
+
+    def sync_peers(self):
+        '''
+        Return the high-water marks of the dbs merged into this one: device id -> { wardrive_id, session_id, merged_at }
+        '''
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT key, value FROM metadata WHERE key LIKE \'sync:%\'')
+        peers = { key[len('sync:'):]: json.loads(value) for key, value in cursor.fetchall() }
+        cursor.close()
+        return peers
+
+    def export_changeset(self, path, wardrive_id = 0, session_id = 0):
+        '''
+        Write to `path` (a new SQLite file) what a db that has already merged this one up to the given high-water marks
+        is missing: the observations after `wardrive_id`, all the rows of the sessions from `session_id` on and all the
+        sessions, to carry their WiGLE flags. With the default marks it contains the whole db.
+        Return the high-water marks of the changeset
+        '''
+        connection = self.__connection
+        connection.commit() # ATTACH can't run inside a transaction
+        connection.execute('ATTACH DATABASE ? AS changeset', [path])
+        cursor = connection.cursor()
+        try:
+            cursor.execute('BEGIN') # all the tables are read from the same snapshot, the writer is never blocked
+            cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.wardrive')
+            last_wardrive_id = cursor.fetchone()[0]
+            cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.sessions')
+            last_session_id = cursor.fetchone()[0]
+            cursor.execute('CREATE TABLE changeset.metadata ("key" TEXT NOT NULL, "value" TEXT, PRIMARY KEY("key"))')
+            cursor.executemany('INSERT INTO changeset.metadata(key, value) VALUES (?, ?)', [ ('device_id', self.device_id()), ('changeset_wardrive_id', last_wardrive_id), ('changeset_session_id', last_session_id) ])
+            cursor.execute('CREATE TABLE changeset.sessions AS SELECT id, created_at, wigle_uploaded, origin_device, origin_session_id FROM main.sessions')
+            cursor.execute(f'''CREATE TABLE changeset.wardrive AS SELECT id, {self.SYNC_WARDRIVE_COLUMNS} FROM main.wardrive
+                               WHERE id <= ? AND (id > ? OR session_id >= ? OR id IN (SELECT wardrive_id FROM main.sightings WHERE session_id >= ?))''', [last_wardrive_id, wardrive_id, session_id, session_id])
+            cursor.execute('CREATE TABLE changeset.sightings AS SELECT session_id, wardrive_id, rssi, seen_timestamp, wigle_uploaded FROM main.sightings WHERE session_id >= ? AND session_id <= ? AND wardrive_id <= ?', [session_id, last_session_id, last_wardrive_id])
+            cursor.execute('CREATE TABLE changeset.networks AS SELECT id, mac, ssid, uploaded_latitude, uploaded_longitude FROM main.networks WHERE id IN (SELECT network_id FROM changeset.wardrive)')
+            cursor.execute('CREATE TABLE changeset.track AS SELECT * FROM main.track WHERE session_id >= ? AND session_id <= ?', [session_id, last_session_id])
+            for table, column in [ ('wardrive', 'id'), ('wardrive', 'session_id'), ('networks', 'id'), ('sightings', 'session_id'), ('track', 'session_id') ]:
+                cursor.execute(f'CREATE INDEX changeset.{table}_{column} ON {table}({column})') # used by `merge`
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.execute('DETACH DATABASE changeset')
+        return { 'wardrive_id': last_wardrive_id, 'session_id': last_session_id }
+
+    def merge(self, source_path, current_session_id = None, on_progress = None, cancelled = None):
+        '''
+        Merge another wardriver db, or a changeset written by `export_changeset`, into this one. Sessions and networks
+        get new ids: networks are matched on (mac, ssid), observations on (network, session, timestamp, coordinates)
+        and sessions on their origin, so merging the same rows again adds nothing. WiGLE upload flags are merged too:
+        whatever either db has uploaded is uploaded. Only the rows after the high-water marks saved by the previous
+        merge of the same device are read, in batches committed on their own so the writer is never blocked for long.
+        `on_progress` is called with the observations merged and the total, `cancelled` is an event checked between
+        batches. The source is attached read-only and never modified. Return the number of rows added to each table
+        and the ids of the sessions of this db with new rows
+        '''
+        connection = self.__connection
+        connection.commit() # ATTACH can't run inside a transaction
+        connection.execute('ATTACH DATABASE ? AS source', [read_only_uri(source_path)])
+        cursor = connection.cursor()
+        try:
+            try:
+                cursor.execute('SELECT key, value FROM source.metadata WHERE key IN (\'device_id\', \'changeset_wardrive_id\', \'changeset_session_id\')')
+                source = dict(cursor.fetchall())
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f'{source_path} is not a wardriver db: {e}')
+            if 'device_id' not in source:
+                raise ValueError(f'{source_path} has been created by an older version of the plugin, upgrade a copy first (see `DatabaseSync.merge`)')
+            if source['device_id'] == self.device_id():
+                raise ValueError('A db can\'t be merged into itself')
+            if 'changeset_wardrive_id' in source:
+                last_wardrive_id, last_session_id = int(source['changeset_wardrive_id']), int(source['changeset_session_id'])
+            else:
+                cursor.execute('SELECT (SELECT IFNULL(MAX(id), 0) FROM source.wardrive), (SELECT IFNULL(MAX(id), 0) FROM source.sessions)')
+                last_wardrive_id, last_session_id = cursor.fetchone() # rows written later are merged next time
+            peer = f'sync:{source["device_id"]}'
+            cursor.execute('SELECT value FROM metadata WHERE key = ?', [peer])
+            row = cursor.fetchone()
+            marks = json.loads(row[0]) if row else { 'wardrive_id': 0, 'session_id': 0 }
+            # rows of the sessions still running at the last merge are read again: their observations have been updated
+            # and they can have new sightings
+            wardrive_id, session_id = marks['wardrive_id'], marks['session_id']
+            for table in [ 'sync_sessions', 'sync_networks', 'sync_wardrive' ]: # source id -> id in this db
+                cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table} ("source_id" INTEGER PRIMARY KEY, "target_id" INTEGER)')
+                cursor.execute(f'DELETE FROM temp.{table}')
+            connection.commit()
+            merge = { 'source_device': source['device_id'], 'current_session_id': current_session_id, 'changed_sessions': set() }
+            added = { 'sessions': 0, 'networks': 0, 'observations': 0, 'sightings': 0, 'track': 0, 'uploaded_sessions': 0 }
+
+            new_rows = '(w.id > ? OR w.session_id >= ?) AND w.id <= ?'
+            cursor.execute(f'SELECT COUNT(*), MIN(w.id) FROM source.wardrive w WHERE {new_rows}', [wardrive_id, session_id, last_wardrive_id])
+            total, first_id = cursor.fetchone()
+            batch_start, done = (first_id or 0) - 1, 0
+            while batch_start < last_wardrive_id:
+                if cancelled and cancelled.is_set():
+                    raise SyncCancelled()
+                cursor.execute(f'SELECT MAX(id) FROM (SELECT w.id FROM source.wardrive w WHERE w.id > ? AND {new_rows} ORDER BY w.id LIMIT ?)', [batch_start, wardrive_id, session_id, last_wardrive_id, self.SYNC_BATCH_SIZE])
+                batch_end = cursor.fetchone()[0]
+                if batch_end is None:
+                    break
+                with self.__write_lock:
+                    rows = self.__merge_observations(cursor, merge, added, f'w.id > ? AND w.id <= ? AND {new_rows}', [batch_start, batch_end, wardrive_id, session_id, last_wardrive_id])
+                    connection.commit()
+                batch_start, done = batch_end, done + rows
+                if on_progress:
+                    on_progress(done, total)
+
+            cursor.execute('SELECT DISTINCT session_id FROM source.sightings WHERE session_id >= ? AND session_id <= ? ORDER BY session_id', [session_id, last_session_id])
+            for (sightings_session_id,) in cursor.fetchall():
+                if cancelled and cancelled.is_set():
+                    raise SyncCancelled()
+                with self.__write_lock:
+                    # sightings can refer to observations logged before the last merge
+                    referenced = 'w.id IN (SELECT wardrive_id FROM source.sightings WHERE session_id = ?) AND w.id NOT IN (SELECT source_id FROM temp.sync_wardrive)'
+                    self.__merge_observations(cursor, merge, added, referenced, [sightings_session_id])
+                    self.__merge_sessions(cursor, merge, added, 'SELECT ?', [sightings_session_id])
+                    matches = 'FROM source.sightings s JOIN temp.sync_sessions ss ON ss.source_id = s.session_id JOIN temp.sync_wardrive sw ON sw.source_id = s.wardrive_id WHERE s.session_id = ? AND sw.target_id IS NOT NULL'
+                    cursor.execute(f'INSERT OR IGNORE INTO main.sightings(session_id, wardrive_id, rssi, seen_timestamp, wigle_uploaded) SELECT ss.target_id, sw.target_id, s.rssi, s.seen_timestamp, s.wigle_uploaded {matches}', [sightings_session_id])
+                    if cursor.rowcount > 0:
+                        added['sightings'] += cursor.rowcount
+                        cursor.execute('SELECT target_id FROM temp.sync_sessions WHERE source_id = ?', [sightings_session_id])
+                        merge['changed_sessions'].add(cursor.fetchone()[0])
+                    cursor.execute(f'UPDATE main.sightings SET wigle_uploaded = 1 WHERE wigle_uploaded = 0 AND (session_id, wardrive_id) IN (SELECT ss.target_id, sw.target_id {matches} AND s.wigle_uploaded = 1)', [sightings_session_id])
+                    connection.commit()
+
+            with self.__write_lock:
+                # only the sessions with observations have been merged, empty ones would be removed by the maintenance job
+                self.__merge_sessions(cursor, merge, added, 'SELECT DISTINCT session_id FROM source.track WHERE session_id >= ? AND session_id <= ?', [session_id, last_session_id], create = False)
+                cursor.execute('''INSERT OR IGNORE INTO main.track(session_id, timestamp, latitude, longitude, altitude, speed)
+                                  SELECT ss.target_id, t.timestamp, t.latitude, t.longitude, t.altitude, t.speed FROM source.track t JOIN temp.sync_sessions ss ON ss.source_id = t.session_id WHERE t.session_id >= ? AND t.session_id <= ?''', [session_id, last_session_id])
+                added['track'] += cursor.rowcount
+                # older sessions uploaded to WiGLE since the last merge
+                self.__merge_sessions(cursor, merge, added, 'SELECT id FROM source.sessions WHERE wigle_uploaded = 1 AND id < ?', [session_id], create = False)
+                cursor.execute('''UPDATE main.networks SET (uploaded_latitude, uploaded_longitude) = (SELECT n.uploaded_latitude, n.uploaded_longitude FROM temp.sync_networks sn JOIN source.networks n ON n.id = sn.source_id WHERE sn.target_id = networks.id AND n.uploaded_latitude IS NOT NULL LIMIT 1)
+                                  WHERE uploaded_latitude IS NULL AND id IN (SELECT sn.target_id FROM temp.sync_networks sn JOIN source.networks n ON n.id = sn.source_id WHERE n.uploaded_latitude IS NOT NULL)''')
+                marks = { 'wardrive_id': last_wardrive_id, 'session_id': last_session_id, 'merged_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S') }
+                cursor.execute('INSERT OR REPLACE INTO metadata(key, value) VALUES (?, ?)', [peer, json.dumps(marks)])
+                connection.commit()
+            logging.info(f'[WARDRIVER] Merged {source_path} (device {source["device_id"]}): {added}')
+            return added, sorted(merge['changed_sessions'])
+        except:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.execute('DETACH DATABASE source')
+
+    def __merge_sessions(self, cursor, merge, added, sessions_query, parameters, create = True):
+        '''
+        Map the source sessions returned by `sessions_query` to the sessions of this db, creating the missing ones if
+        `create` is set, and merge their WiGLE flag
+        '''
+        device_id = self.device_id()
+        cursor.execute(f'SELECT id, created_at, wigle_uploaded, origin_device, origin_session_id FROM source.sessions WHERE id IN ({sessions_query}) AND id NOT IN (SELECT source_id FROM temp.sync_sessions)', parameters)
+        for source_id, created_at, wigle_uploaded, origin_device, origin_session_id in cursor.fetchall():
+            if not origin_device: # session created by the source db
+                origin_device, origin_session_id = merge['source_device'], source_id
+            target_id = None
+            if origin_device == device_id: # session created by this db and merged back
+                cursor.execute('SELECT id FROM sessions WHERE id = ? AND origin_device IS NULL', [origin_session_id])
+                target_id = (cursor.fetchone() or [ None ])[0]
+            if target_id is None:
+                cursor.execute('SELECT id FROM sessions WHERE origin_device = ? AND origin_session_id = ?', [origin_device, origin_session_id])
+                target_id = (cursor.fetchone() or [ None ])[0]
+            if target_id is None:
+                if not create:
+                    continue
+                cursor.execute('INSERT INTO sessions(created_at, wigle_uploaded, origin_device, origin_session_id) VALUES (?, ?, ?, ?)', [created_at, wigle_uploaded, origin_device, origin_session_id])
+                target_id = cursor.lastrowid
+                added['sessions'] += 1
+            elif wigle_uploaded and target_id != merge['current_session_id']: # the running session is uploaded once it's finished
+                cursor.execute('UPDATE sessions SET wigle_uploaded = 1 WHERE id = ? AND wigle_uploaded = 0', [target_id])
+                if cursor.rowcount:
+                    cursor.execute('UPDATE wardrive SET wigle_uploaded = 1 WHERE session_id = ? AND wigle_uploaded = 0', [target_id])
+                    cursor.execute('UPDATE sightings SET wigle_uploaded = 1 WHERE session_id = ? AND wigle_uploaded = 0', [target_id])
+                    added['uploaded_sessions'] += 1
+            cursor.execute('INSERT INTO temp.sync_sessions(source_id, target_id) VALUES (?, ?)', [source_id, target_id])
+
+    def __merge_observations(self, cursor, merge, added, condition, parameters):
+        '''
+        Merge the source observations matching `condition` (on `source.wardrive w`), along with their sessions and
+        networks. Return how many source observations have been read
+        '''
+        self.__merge_sessions(cursor, merge, added, f'SELECT DISTINCT w.session_id FROM source.wardrive w WHERE {condition}', parameters)
+        networks = f'SELECT DISTINCT w.network_id FROM source.wardrive w WHERE {condition}'
+        cursor.execute(f'''INSERT INTO main.networks(mac, ssid) SELECT n.mac, n.ssid FROM source.networks n
+                           WHERE n.id IN ({networks}) AND n.id NOT IN (SELECT source_id FROM temp.sync_networks) AND NOT EXISTS (SELECT 1 FROM main.networks m WHERE m.mac = n.mac AND m.ssid IS n.ssid)
+                           GROUP BY n.mac, n.ssid ORDER BY MIN(n.id)''', parameters)
+        added['networks'] += cursor.rowcount
+        cursor.execute(f'''INSERT OR IGNORE INTO temp.sync_networks(source_id, target_id)
+                           SELECT n.id, (SELECT m.id FROM main.networks m WHERE m.mac = n.mac AND m.ssid IS n.ssid ORDER BY m.id LIMIT 1) FROM source.networks n WHERE n.id IN ({networks})''', parameters)
+
+        matches = f'''FROM source.wardrive w JOIN temp.sync_sessions ss ON ss.source_id = w.session_id JOIN temp.sync_networks sn ON sn.source_id = w.network_id WHERE {condition}'''
+        same_observation = 't.network_id = sn.target_id AND t.session_id = ss.target_id AND t.seen_timestamp IS w.seen_timestamp AND t.latitude = w.latitude AND t.longitude = w.longitude'
+        columns = self.SYNC_WARDRIVE_COLUMNS.replace('session_id, network_id', 'ss.target_id, sn.target_id')
+        cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.wardrive')
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f'INSERT INTO main.wardrive({self.SYNC_WARDRIVE_COLUMNS}) SELECT {columns} {matches} AND NOT EXISTS (SELECT 1 FROM main.wardrive t WHERE {same_observation}) ORDER BY w.id', parameters)
+        if cursor.rowcount > 0:
+            added['observations'] += cursor.rowcount
+            cursor.execute('SELECT DISTINCT session_id FROM main.wardrive WHERE id > ?', [last_id])
+            merge['changed_sessions'].update(session_id for (session_id,) in cursor.fetchall())
+        cursor.execute(f'INSERT OR REPLACE INTO temp.sync_wardrive(source_id, target_id) SELECT w.id, (SELECT t.id FROM main.wardrive t WHERE {same_observation} ORDER BY t.id LIMIT 1) {matches}', parameters)
+        rows = cursor.rowcount
+        # observations already in this db: keep the latest sighting and the WiGLE flag of both
+        cursor.execute(f'''SELECT t.id, MAX(IFNULL(t.last_seen, ''), IFNULL(w.last_seen, '')), MAX(t.sightings, w.sightings), MAX(t.wigle_uploaded, w.wigle_uploaded)
+                           FROM source.wardrive w JOIN temp.sync_wardrive sw ON sw.source_id = w.id JOIN main.wardrive t ON t.id = sw.target_id
+                           WHERE {condition} AND (IFNULL(w.last_seen, '') > IFNULL(t.last_seen, '') OR w.sightings > t.sightings OR w.wigle_uploaded > t.wigle_uploaded)''', parameters)
+        cursor.executemany('UPDATE wardrive SET last_seen = NULLIF(?, \'\'), sightings = ?, wigle_uploaded = ? WHERE id = ?', [ (last_seen, sightings, wigle_uploaded, wardrive_id) for wardrive_id, last_seen, sightings, wigle_uploaded in cursor.fetchall() ])
+        return rows
+
+class SyncCancelled(Exception):
+    pass
+
+class LocationEstimator():
+    '''
+    Estimate the position of the APs from all their observations: an RSSI-weighted centroid, then again without the
+    observations too far from it (median + 3 MADs of the distances), with the weighted RMS distance of the
+    remaining observations (at least their GPS accuracy) as uncertainty. Observations are processed in batches
+    of networks, vectorized with NumPy when it's installed
+    '''
+    MIN_OUTLIER_DISTANCE = 50 # meters, observations nearer than this to the centroid are never outliers
+    MIN_OUTLIER_OBSERVATIONS = 3 # outliers are looked for only with at least this many observations
+    METERS_PER_DEGREE = 6371000 * math.pi / 180
+
+    def __init__(self):
+        try:
+            import numpy
+            self.__numpy = numpy
+        except ImportError:
+            logging.debug('[WARDRIVER] NumPy not available, estimating networks locations in Python')
+            self.__numpy = None
+
+    def estimate(self, observations):
+        '''
+        Return (network id, latitude, longitude, uncertainty, observations used) for each network in
+        `observations`, a list of (network id, latitude, longitude, rssi, accuracy) ordered by network id
+        '''
+        if not observations:
+            return []
+        if self.__numpy:
+            return self.__estimate_numpy(observations)
+        return [ self.__estimate_network(network_id, list(rows)) for network_id, rows in itertools.groupby(observations, key = lambda row: row[0]) ]
+
+    @staticmethod
+    def __weight(rssi):
+        return 10 ** (rssi / 20) # signal amplitude: stronger observations are nearer to the AP
+
+    def __distances(self, rows, latitude, longitude):
+        scale = self.METERS_PER_DEGREE * math.cos(math.radians(latitude)) # local equirectangular projection
+        return [ math.hypot((row[1] - latitude) * self.METERS_PER_DEGREE, (row[2] - longitude) * scale) for row in rows ]
+
+    @staticmethod
+    def __centroid(rows, weights):
+        total = sum(weights)
+        return sum(row[1] * weight for row, weight in zip(rows, weights)) / total, sum(row[2] * weight for row, weight in zip(rows, weights)) / total
+
+    def __estimate_network(self, network_id, rows):
+        weights = [ self.__weight(row[3]) for row in rows ]
+        latitude, longitude = self.__centroid(rows, weights)
+        if len(rows) >= self.MIN_OUTLIER_OBSERVATIONS:
+            distances = self.__distances(rows, latitude, longitude)
+            median = statistics.median(distances)
+            mad = statistics.median([ abs(distance - median) for distance in distances ])
+            threshold = max(median + 3 * 1.4826 * mad, self.MIN_OUTLIER_DISTANCE)
+            inliers = [ index for index, distance in enumerate(distances) if distance <= threshold ]
+            rows, weights = [ rows[index] for index in inliers ], [ weights[index] for index in inliers ]
+            latitude, longitude = self.__centroid(rows, weights)
+        distances = self.__distances(rows, latitude, longitude)
+        total = sum(weights)
+        rms = math.sqrt(sum(weight * distance ** 2 for weight, distance in zip(weights, distances)) / total)
+        accuracy = sum(weight * row[4] for row, weight in zip(rows, weights)) / total
+        return network_id, latitude, longitude, max(rms, accuracy), len(rows)
+
+    def __estimate_numpy(self, observations):
+        np = self.__numpy
+        # columnar load, rows are already grouped by network
+        data = np.fromiter(itertools.chain.from_iterable(observations), dtype = float, count = len(observations) * 5).reshape(-1, 5)
+        network_ids, latitudes, longitudes, rssis, accuracies = data.T
+        starts = np.flatnonzero(np.r_[True, network_ids[1:] != network_ids[:-1]])
+        counts = np.diff(np.r_[starts, len(network_ids)])
+        groups = np.repeat(np.arange(len(starts)), counts)
+        weights = 10 ** (rssis / 20)
+
+        def centroid(weights):
+            total = np.add.reduceat(weights, starts)
+            return np.add.reduceat(weights * latitudes, starts) / total, np.add.reduceat(weights * longitudes, starts) / total
+
+        def distances(latitude, longitude):
+            scale = self.METERS_PER_DEGREE * np.cos(np.radians(latitude))[groups]
+            return np.hypot((latitudes - latitude[groups]) * self.METERS_PER_DEGREE, (longitudes - longitude[groups]) * scale)
+
+        def median(values):
+            ordered = values[np.lexsort((values, groups))] # sorted inside each network
+            return (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+
+        latitude, longitude = centroid(weights)
+        distance = distances(latitude, longitude)
+        distance_median = median(distance)
+        mad = median(np.abs(distance - distance_median[groups]))
+        threshold = np.maximum(distance_median + 3 * 1.4826 * mad, self.MIN_OUTLIER_DISTANCE)
+        inliers = (distance <= threshold[groups]) | (counts < self.MIN_OUTLIER_OBSERVATIONS)[groups]
+        weights = weights * inliers
+        latitude, longitude = centroid(weights)
+        distance = distances(latitude, longitude)
+        total = np.add.reduceat(weights, starts)
+        rms = np.sqrt(np.add.reduceat(weights * distance ** 2, starts) / total)
+        accuracy = np.add.reduceat(weights * accuracies, starts) / total
+        return list(zip(network_ids[starts].astype(int).tolist(), latitude.tolist(), longitude.tolist(), np.maximum(rms, accuracy).tolist(), np.add.reduceat(inliers.astype(int), starts).tolist()))
+
+class DatabaseMaintenance():
+    '''
+    Low priority background job that removes empty sessions left by previous runs, applies the retention
+    policies and reclaims free space. It never touches the db while an AP list is being processed or shortly after.
+    '''
+    BATCH_SIZE = 500 # wardrive rows deleted for each step
+    LOCATE_BATCH_SIZE = 2000 # networks located for each step
+    BACKFILL_SESSIONS = 5 # sessions flagged as uploaded for each step
+    VACUUM_PAGES = 256 # pages released for each incremental vacuum step
+    SCAN_COOLDOWN = 15 # seconds to wait after the last AP list before running a step
+
+    def __init__(self, db, best_observation_days = 0, uploaded_sessions_days = 0, interval = 60, uploaded_only = True, on_pruned = None, estimate_locations = True, vacuum_conversion = False):
+        self.__db = db
+        self.__on_pruned = on_pruned # called with the ids of the pruned sessions
+        self.__best_observation_days = best_observation_days
+        self.__uploaded_sessions_days = uploaded_sessions_days
+        self.__interval = interval * 60
+        self.__uploaded_only = uploaded_only
+        self.__estimate_locations_enabled = estimate_locations
+        self.__vacuum_conversion = vacuum_conversion
+        self.__current_session_id = None
+        self.__scanning = False
+        self.__last_scan = 0
+        self.__stop = Event()
+        self.__thread = None
+        self.__estimator = LocationEstimator()
+        self.startup_done = Event() # set once the startup tasks are done, the periodic runs go on in background
+        self.status = {
+            'state': 'idle',
+            'task': None,
+            'progress': 0,
+            'total': 0,
+            'last_run': None,
+            'removed_rows': 0,
+            'removed_networks': 0
+        }
+
+    def is_enabled(self):
+        return self.__best_observation_days > 0 or self.__uploaded_sessions_days > 0
+
+    def start(self, current_session_id):
+        self.set_current_session(current_session_id)
+        if self.__thread:
+            return
+        self.__thread = Thread(target = self.__run, name = 'wardriver-maintenance', daemon = True)
+        self.__thread.start()
+        if self.is_enabled():
+            logging.info('[WARDRIVER] Database maintenance scheduled')
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join(timeout = 10)
+            self.__thread = None
+
+    def set_current_session(self, session_id):
+        '''
+        The running session is never pruned
+        '''
+        self.__current_session_id = session_id
+
+    def scan_started(self):
+        self.__scanning = True
+        self.__last_scan = time.time()
+
+    def scan_finished(self):
+        self.__scanning = False
+        self.__last_scan = time.time()
+
+    def __wait_scan_idle(self):
+        '''
+        Block until no AP list has been processed for `SCAN_COOLDOWN` seconds. Return False if the job has been stopped
+        '''
+        while self.__scanning or time.time() - self.__last_scan < self.SCAN_COOLDOWN:
+            if self.__stop.wait(1):
+                return False
+        return not self.__stop.is_set()
+
+    def __run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), 19) # lower only this thread priority
+        except Exception:
+            logging.debug('[WARDRIVER] Cannot lower database maintenance thread priority')
+        try:
+            self.__db.remove_empty_sessions(self.__current_session_id) # Remove old sessions that don't have networks
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed removing empty sessions: {e}')
+        if self.is_enabled():
+            try:
+                self.__convert_vacuum()
+            except Exception as e:
+                logging.error(f'[WARDRIVER] Failed converting db to incremental vacuum: {e}')
+                self.status['state'] = 'error'
+        try:
+            self.__backfill_coverage()
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed building coverage grid: {e}')
+            self.status['state'] = 'error'
+        try:
+            self.__backfill_uploaded()
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed flagging uploaded observations: {e}')
+            self.status['state'] = 'error'
+        try:
+            self.__backfill_search_index()
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed building search index: {e}')
+            self.status['state'] = 'error'
+        try:
+            self.__backfill_spatial_index()
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed building spatial index: {e}')
+            self.status['state'] = 'error'
+        self.startup_done.set()
+        if not self.is_enabled() and not self.__estimate_locations_enabled:
+            return
+        while not self.__stop.wait(self.SCAN_COOLDOWN):
+            if self.is_enabled():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logging.error(f'[WARDRIVER] Database maintenance failed: {e}')
+                    self.status['state'] = 'error'
+            if self.__estimate_locations_enabled:
+                try:
+                    self.__estimate_locations()
+                except Exception as e:
+                    logging.error(f'[WARDRIVER] Failed estimating networks locations: {e}')
+                    self.status['state'] = 'error'
+            if self.__stop.wait(self.__interval):
+                break
+
+    def __set_task(self, task, total):
+        self.status['state'] = 'running'
+        self.status['task'] = task
+        self.status['progress'] = 0
+        self.status['total'] = total
+
+    def __prune(self, task, sessions_ids, keep_best):
+        if len(sessions_ids) == 0 or not self.__wait_scan_idle():
+            return
+        total = self.__db.prepare_prune(sessions_ids, keep_best)
+        self.__set_task(task, total)
+        if total > 0:
+            logging.info(f'[WARDRIVER] Database maintenance: {task} ({total} rows)')
+        last_id = 0
+        try:
+            while self.status['progress'] < total and self.__wait_scan_idle():
+                last_id, deleted = self.__db.prune_batch(last_id, self.BATCH_SIZE)
+                if deleted == 0:
+                    break
+                self.status['progress'] += deleted
+                self.status['removed_rows'] += deleted
+                logging.debug(f'[WARDRIVER] Database maintenance: {task} {self.status["progress"]}/{total}')
+        finally:
+            self.__db.finish_prune()
+            if self.__on_pruned and self.status['progress'] > 0:
+                self.__on_pruned(sessions_ids)
+
+    def __backfill_coverage(self):
+        '''
+        Aggregate in the coverage grid the rows saved before it existed or imported from other dbs
+        '''
+        pending = self.__db.aggregate_coverage(0)
+        if pending == 0:
+            return
+        self.__set_task('building coverage grid', pending)
+        logging.info(f'[WARDRIVER] Database maintenance: building coverage grid ({pending} rows)')
+        while pending > 0 and self.__wait_scan_idle():
+            pending = self.__db.aggregate_coverage(self.BATCH_SIZE * 10)
+            self.status['progress'] = max(self.status['total'] - pending, 0)
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __backfill_uploaded(self):
+        '''
+        Flag the rows of the sessions uploaded before each row had its own upload flag
+        '''
+        pending = self.__db.backfill_uploaded(0)
+        if pending == 0:
+            return
+        self.__set_task('flagging uploaded observations', pending)
+        logging.info(f'[WARDRIVER] Database maintenance: flagging uploaded observations ({pending} sessions)')
+        while pending > 0 and self.__wait_scan_idle():
+            pending = self.__db.backfill_uploaded(self.BACKFILL_SESSIONS)
+            self.status['progress'] = max(self.status['total'] - pending, 0)
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __backfill_search_index(self):
+        '''
+        Build the search indexes of the networks saved before they existed
+        '''
+        mac_index = self.__db.has_mac_index()
+        pending = self.__db.backfill_search_index(0)
+        if mac_index and pending == 0:
+            return
+        if not mac_index and self.__wait_scan_idle():
+            self.__set_task('building MAC index', 1)
+            logging.info('[WARDRIVER] Database maintenance: building MAC index')
+            self.__db.create_mac_index()
+        self.__set_task('building SSIDs index', pending)
+        if pending > 0:
+            logging.info(f'[WARDRIVER] Database maintenance: building SSIDs index ({pending} networks)')
+        while pending > 0 and self.__wait_scan_idle():
+            pending = self.__db.backfill_search_index(self.BATCH_SIZE * 10)
+            self.status['progress'] = max(self.status['total'] - pending, 0)
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __backfill_spatial_index(self):
+        '''
+        Add to the spatial index the rows saved before it existed
+        '''
+        pending = self.__db.backfill_spatial_index(0)
+        if pending == 0:
+            return
+        self.__set_task('building spatial index', pending)
+        logging.info(f'[WARDRIVER] Database maintenance: building spatial index ({pending} rows)')
+        while pending > 0 and self.__wait_scan_idle():
+            pending = self.__db.backfill_spatial_index(self.BATCH_SIZE * 10)
+            self.status['progress'] = max(self.status['total'] - pending, 0)
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __estimate_locations(self):
+        '''
+        Estimate again the location of the networks seen since the last run
+        '''
+        network_ids, last_id = self.__db.networks_to_locate()
+        if not network_ids:
+            return
+        self.__set_task('estimating networks locations', len(network_ids))
+        logging.info(f'[WARDRIVER] Database maintenance: estimating networks locations ({len(network_ids)} networks)')
+        for start in range(0, len(network_ids), self.LOCATE_BATCH_SIZE):
+            if not self.__wait_scan_idle():
+                return # the last row is saved only with the last batch, the next run starts again
+            batch = network_ids[start:start + self.LOCATE_BATCH_SIZE]
+            observations = self.__db.location_observations(batch)
+            done = start + len(batch) == len(network_ids)
+            self.__db.save_network_locations(self.__estimator.estimate(observations), last_id if done else None)
+            self.status['progress'] = start + len(batch)
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __convert_vacuum(self):
+        '''
+        Databases created by older versions need a full VACUUM to release free space. It's done at startup,
+        before the scans begin, and only if enabled, since it blocks every other write until it's done
+        '''
+        if self.__db.auto_vacuum_mode() == 2: # 2 = INCREMENTAL
+            return
+        if not self.__vacuum_conversion:
+            logging.info('[WARDRIVER] Database maintenance: free space is reused but not released. Set retention.vacuum_conversion to convert the db to incremental vacuum')
+            return
+        logging.warning('[WARDRIVER] Database maintenance: converting db to incremental vacuum. This is done only once and can take a while')
+        self.__set_task('converting to incremental vacuum', 1)
+        start = time.time()
+        self.__db.enable_incremental_vacuum()
+        logging.info(f'[WARDRIVER] Database maintenance: converted db to incremental vacuum in {time.time() - start:.1f}s')
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+
+    def __vacuum(self):
+        if not self.__wait_scan_idle() or self.__db.auto_vacuum_mode() != 2: # 2 = INCREMENTAL
+            return
+        total = self.__db.free_pages()
+        self.__set_task('incremental vacuum', total)
+        while self.status['progress'] < total and self.__wait_scan_idle():
+            self.__db.incremental_vacuum(self.VACUUM_PAGES)
+            self.status['progress'] = total - self.__db.free_pages()
+
+    def run_once(self):
+        removed_rows = self.status['removed_rows']
+        if self.__uploaded_sessions_days > 0:
+            sessions_ids = self.__db.old_sessions(self.__uploaded_sessions_days, self.__current_session_id, uploaded_only = True)
+            self.__prune('dropping old uploaded sessions', sessions_ids, keep_best = False)
+        if self.__best_observation_days > 0:
+            sessions_ids = self.__db.old_sessions(self.__best_observation_days, self.__current_session_id, uploaded_only = self.__uploaded_only)
+            self.__prune('keeping best observations of old sessions', sessions_ids, keep_best = True)
+        if self.status['removed_rows'] > removed_rows and self.__wait_scan_idle():
+            self.__db.remove_empty_sessions(self.__current_session_id)
+            self.status['removed_networks'] += self.__db.remove_orphan_networks()
+        self.__vacuum()
+        self.status['state'] = 'idle'
+        self.status['task'] = None
+        self.status['last_run'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        logging.info(f'[WARDRIVER] Database maintenance completed ({self.status["removed_rows"] - removed_rows} rows removed)')
+
+class CSVGenerator():
+    def __init__(self):
+        self.__wigle_pre_header = None # loaded the first time a WiGLE CSV is generated
+        
+    def __wigle_info(self):
+        '''
+        Return info used in CSV pre-header
+        '''
+        try:
+            data = read_global_config()
+            # Pwnagotchi name
+            device = data['main']['name']
+            # Pwnagotchi display model
+            display = data['ui']['display']['type'] # Pwnagotchi display
+        except Exception:
+            device = 'pwnagotchi'
+            display = 'unknown'
+
+        # Preheader formatting
+        file_format = 'WigleWifi-1.4'
+        app_release = Wardriver.__version__
+        # Device model
+        try:
+            with open('/sys/firmware/devicetree/base/model', 'r') as model_info:
+                model = model_info.read()
+        except Exception:
+            model = 'unknown'
+        # OS version
+        try:
+            with open('/etc/os-release', 'r') as release_info:
+                release = release_info.read().split('\n')[0].split('=')[-1].replace('"', '')
+        except Exception:
+            release = 'unknown'
+        # CPU model
+        try:
+            with open('/proc/cpuinfo', 'r') as cpu_model:
+                board = cpu_model.read().split('\n')[1].split(':')[1][1:]
+        except Exception:
+            board = 'unknown'
+        
+        # Brand: currently set equal to model
+        brand = model
+
+        self.__wigle_pre_header = f'{file_format},{app_release},{model},{release},{device},{display},{board},{brand}\n'
+
+    def wigle_pre_header(self):
+        if not self.__wigle_pre_header:
+            self.__wigle_info()
+        return self.__wigle_pre_header
+
+    def csv_header(self):
+        return 'MAC,SSID,AuthMode,FirstSeen,Channel,RSSI,CurrentLatitude,CurrentLongitude,AltitudeMeters,AccuracyMeters,Type\n'
+    
+    def csv_network(self, network):
+        return f'{network["mac"]},{network["ssid"]},{network["auth_mode"]},{network["seen_timestamp"]},{network["channel"]},{network["rssi"]},{network["latitude"]},{network["longitude"]},{network["altitude"]},{network["accuracy"]},WIFI\n'
+
+    def networks_to_csv(self, networks):
+        return self.csv_header() + ''.join(self.csv_network(network) for network in networks)
+
+    def networks_to_wigle_csv(self, networks):
+        return self.wigle_pre_header() + self.networks_to_csv(networks)
+
+class CSVCache():
+    '''
+    On-disk cache of sessions CSV files. Closed sessions are materialized once as gzipped files (plain and WiGLE
+    variant), while the running session has an append-only plain CSV extended on each APs list
+    '''
+    def __init__(self, path, db, csv_generator):
+        self.__path = path
+        self.__db = db
+        self.__csv_generator = csv_generator
+        self.__lock = Lock()
+        os.makedirs(self.__path, exist_ok = True)
+
+    def __file(self, session_id, wigle = False, compressed = True):
+        return os.path.join(self.__path, f'session_{int(session_id)}{".wigle" if wigle else ""}.csv{".gz" if compressed else ""}')
+
+    def append(self, session_id, networks):
+        '''
+        Append networks to the running session CSV
+        '''
+        running_file = self.__file(session_id, compressed = False)
+        with self.__lock:
+            new_file = not os.path.exists(running_file)
+            with open(running_file, 'a') as csv_file:
+                if new_file:
+                    csv_file.write(self.__csv_generator.csv_header())
+                csv_file.writelines(self.__csv_generator.csv_network(network) for network in networks)
+
+    def running_file(self, session_id):
+        '''
+        Return the running session CSV, creating it if the session has no networks yet
+        '''
+        running_file = self.__file(session_id, compressed = False)
+        if not os.path.exists(running_file):
+            self.append(session_id, [])
+        return running_file
+
+    def __is_complete(self, running_file, session_id):
+        '''
+        The running file of a closed session is trusted only if it has all the session rows (e.g. no crash in between)
+        '''
+        with open(running_file, 'r') as csv_file:
+            rows = sum(1 for _ in csv_file) - 1
+        return rows == self.__db.session_networks_count(session_id)
+
+    def __materialize(self, session_id):
+        tmp_file = self.__file(session_id) + '.tmp'
+        running_file = self.__file(session_id, compressed = False)
+        if os.path.exists(running_file) and self.__is_complete(running_file, session_id):
+            with open(running_file, 'rb') as source, gzip.open(tmp_file, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+        else:
+            networks = self.__db.session_networks(session_id)
+            with gzip.open(tmp_file, 'wt') as destination:
+                destination.write(self.__csv_generator.networks_to_csv(networks))
+        os.replace(tmp_file, self.__file(session_id))
+        if os.path.exists(running_file):
+            os.remove(running_file)
+
+    def __materialize_wigle(self, session_id):
+        tmp_file = self.__file(session_id, wigle = True) + '.tmp'
+        with gzip.open(self.__file(session_id), 'rb') as source, gzip.open(tmp_file, 'wb') as destination:
+            destination.write(self.__csv_generator.wigle_pre_header().encode())
+            shutil.copyfileobj(source, destination)
+        os.replace(tmp_file, self.__file(session_id, wigle = True))
+
+    def session_file(self, session_id, wigle = False):
+        '''
+        Return the gzipped CSV file of a closed session, building it the first time
+        '''
+        with self.__lock:
+            if not os.path.exists(self.__file(session_id)):
+                self.__materialize(session_id)
+            if wigle and not os.path.exists(self.__file(session_id, wigle = True)):
+                self.__materialize_wigle(session_id)
+        return self.__file(session_id, wigle)
+
+    def upload_file(self, session_id, networks):
+        '''
+        Write a WiGLE CSV with only some networks of a session, for partial uploads. The caller removes it once uploaded
+        '''
+        upload_file = os.path.join(self.__path, f'upload_{int(session_id)}.wigle.csv.gz')
+        with gzip.open(upload_file, 'wt') as destination:
+            destination.write(self.__csv_generator.wigle_pre_header() + self.__csv_generator.csv_header())
+            destination.writelines(self.__csv_generator.csv_network(network) for network in networks)
+        return upload_file
+
+    def invalidate(self, sessions_ids):
+        '''
+        Remove the cached files of sessions whose rows have changed
+        '''
+        with self.__lock:
+            for session_id in sessions_ids:
+                for wigle in [ False, True ]:
+                    for compressed in [ False, True ]:
+                        if os.path.exists(self.__file(session_id, wigle, compressed)):
+                            os.remove(self.__file(session_id, wigle, compressed))
+
+class TileCache():
+    '''
+    Map tiles cache stored in a MBTiles (SQLite) file. Missing tiles are fetched from `tile_url` when possible and
+    the least recently used ones are evicted once the cache exceeds `max_size` bytes
+    '''
+    TOUCH_INTERVAL = 3600 # seconds before updating again the last access of a tile, to avoid a write for each hit
+    OFFLINE_BACKOFF = 60 # seconds without trying the tiles server after a failure
+    MAX_SEED_TILES = 10000 # tiles servers don't allow bulk downloads
+    SEED_DELAY = 0.2 # seconds between two tiles downloaded while seeding
+
+    def __init__(self, path, tile_url, max_size, user_agent):
+        self.__tile_url = tile_url
+        self.__max_size = max_size
+        self.__user_agent = user_agent
+        self.__lock = Lock()
+        self.__offline_until = 0
+        self.__seed_thread = None
+        self.__stop = Event()
+        self.status = {
+            'state': 'idle',
+            'progress': 0,
+            'total': 0,
+            'failed': 0
+        }
+        self.__connection = sqlite3.connect(path, check_same_thread = False)
+        cursor = self.__connection.cursor()
+        cursor.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT, PRIMARY KEY(name))')
+        cursor.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, size INTEGER, last_access INTEGER, PRIMARY KEY(zoom_level, tile_column, tile_row))') # tile_row is flipped as required by MBTiles
+        cursor.execute('CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles(last_access)') # used to evict the least recently used tiles
+        cursor.execute('INSERT OR IGNORE INTO metadata(name, value) VALUES (\'name\', \'wardriver\'), (\'format\', \'png\')')
+        cursor.execute('SELECT IFNULL(SUM(size), 0) FROM tiles')
+        self.__size = cursor.fetchone()[0]
+        cursor.close()
+        self.__connection.commit()
+
+    def close(self):
+        self.__stop.set()
+        if self.__seed_thread:
+            self.__seed_thread.join(timeout = 10)
+        with self.__lock:
+            self.__connection.close()
+
+    def size(self):
+        return self.__size
+
+    def get(self, zoom, x, y, fetch = True):
+        '''
+        Return the tile image, fetching it from the tiles server if it's not cached. Return None if it's not available
+        '''
+        row = (1 << zoom) - 1 - y
+        now = int(time.time())
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('SELECT tile_data, last_access FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', [zoom, x, row])
+            tile = cursor.fetchone()
+            if tile and now - tile[1] > self.TOUCH_INTERVAL:
+                cursor.execute('UPDATE tiles SET last_access = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', [now, zoom, x, row])
+                self.__connection.commit()
+            cursor.close()
+        if tile:
+            return tile[0]
+        if not fetch or time.time() < self.__offline_until:
+            return None
+        data = self.__download(zoom, x, y)
+        if data:
+            self.__store(zoom, x, row, data)
+        return data
+
+    def __download(self, zoom, x, y):
+        import requests
+        try:
+            response = requests.get(self.__tile_url.format(z = zoom, x = x, y = y, s = 'abc'[(x + y) % 3]), headers = { 'User-Agent': self.__user_agent }, timeout = 10)
+            response.raise_for_status()
+            return response.content
+        except Exception as e:
+            logging.debug(f'[WARDRIVER] Cannot download tile {zoom}/{x}/{y}: {e}')
+            self.__offline_until = time.time() + self.OFFLINE_BACKOFF
+            return None
+
+    def __store(self, zoom, x, row, data):
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            cursor.execute('INSERT OR REPLACE INTO tiles(zoom_level, tile_column, tile_row, tile_data, size, last_access) VALUES (?, ?, ?, ?, ?, ?)', [zoom, x, row, data, len(data), int(time.time())])
+            self.__size += len(data)
+            if self.__size > self.__max_size:
+                self.__evict(cursor)
+            cursor.close()
+            self.__connection.commit()
+
+    def __evict(self, cursor):
+        '''
+        Remove the least recently used tiles until the cache is 10% below its max size
+        '''
+        target = self.__max_size * 0.9
+        while self.__size > target:
+            cursor.execute('SELECT zoom_level, tile_column, tile_row, size FROM tiles ORDER BY last_access LIMIT 100')
+            tiles = cursor.fetchall()
+            if not tiles:
+                break
+            for zoom, x, row, size in tiles:
+                cursor.execute('DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', [zoom, x, row])
+                self.__size -= size
+                if self.__size <= target:
+                    break
+
+    @staticmethod
+    def tile_xy(latitude, longitude, zoom):
+        '''
+        Return the (x, y) of the tile containing the coordinates at the given zoom
+        '''
+        tiles = 1 << zoom
+        x = int((longitude + 180) / 360 * tiles)
+        y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * tiles)
+        return min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1)
+
+    @classmethod
+    def seed_tiles(cls, bounds, min_zoom, max_zoom):
+        '''
+        Return the (zoom, x, y) tiles covering (south, west, north, east) bounds
+        '''
+        south, west, north, east = bounds
+        for zoom in range(min_zoom, max_zoom + 1):
+            min_x, min_y = cls.tile_xy(north, west, zoom)
+            max_x, max_y = cls.tile_xy(south, east, zoom)
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    yield zoom, x, y
+
+    def seed(self, bounds, min_zoom, max_zoom):
+        '''
+        Download in background the tiles covering (south, west, north, east) bounds. Return False if too many tiles are requested or a seed is running
+        '''
+        total = sum(1 for _ in self.seed_tiles(bounds, min_zoom, max_zoom))
+        if total > self.MAX_SEED_TILES or self.status['state'] == 'running':
+            return False
+        self.status = {
+            'state': 'running',
+            'progress': 0,
+            'total': total,
+            'failed': 0
+        }
+        self.__seed_thread = Thread(target = self.__seed, args = (bounds, min_zoom, max_zoom), name = 'wardriver-tiles-seed', daemon = True)
+        self.__seed_thread.start()
+        return True
+
+    def __seed(self, bounds, min_zoom, max_zoom):
+        for zoom, x, y in self.seed_tiles(bounds, min_zoom, max_zoom):
+            if self.__stop.is_set():
+                break
+            if self.get(zoom, x, y, fetch = False) is None:
+                self.__offline_until = 0 # retry failed tiles while seeding
+                data = self.__download(zoom, x, y)
+                if data:
+                    self.__store(zoom, x, (1 << zoom) - 1 - y, data)
+                else:
+                    self.status['failed'] += 1
+                self.__stop.wait(self.SEED_DELAY)
+            self.status['progress'] += 1
+        self.status['state'] = 'idle'
+
+class ZipStream():
+    '''
+    Unseekable file object collecting what `zipfile` writes, so that the archive can be streamed while it's built
+    '''
+    def __init__(self):
+        self.__chunks = []
+
+    def write(self, data):
+        self.__chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.__chunks)
+        self.__chunks = []
+        return data
+
+class Exporter():
+    '''
+    Stream networks as CSV, gzipped CSV, GeoJSON or KML. The output is either a single file or a ZIP archive
+    with a file for each session
+    '''
+    FORMATS = {
+        'csv': 'text/csv',
+        'csv.gz': 'application/gzip',
+        'geojson': 'application/geo+json',
+        'kml': 'application/vnd.google-earth.kml+xml'
+    }
+
+    def __init__(self, csv_generator, export_format):
+        if export_format not in self.FORMATS:
+            raise ValueError(f'Unsupported export format {export_format}')
+        self.__csv_generator = csv_generator
+        self.format = export_format
+        self.mimetype = self.FORMATS[export_format]
+
+    def __header(self):
+        if self.format in [ 'csv', 'csv.gz' ]:
+            return self.__csv_generator.csv_header()
+        if self.format == 'geojson':
+            return '{"type":"FeatureCollection","features":['
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+
+    def __footer(self):
+        if self.format == 'geojson':
+            return ']}\n'
+        if self.format == 'kml':
+            return '</Document></kml>\n'
+        return ''
+
+    def __network(self, network, first):
+        if self.format in [ 'csv', 'csv.gz' ]:
+            return self.__csv_generator.csv_network(network)
+        if self.format == 'geojson':
+            feature = {
+                'type': 'Feature',
+                'geometry': { 'type': 'Point', 'coordinates': [ float(network['longitude']), float(network['latitude']), float(network['altitude']) ] },
+                'properties': { key: network[key] for key in [ 'session_id', 'mac', 'ssid', 'auth_mode', 'channel', 'rssi', 'accuracy', 'seen_timestamp' ] }
+            }
+            return ('' if first else ',') + json.dumps(feature, separators = (',', ':'))
+        return (f'<Placemark><name>{html.escape(network["ssid"] or "Hidden")}</name>'
+                f'<description>{html.escape(network["mac"])} {html.escape(network["auth_mode"])} channel {network["channel"]} {network["rssi"]} dBm, seen {network["seen_timestamp"]}</description>'
+                f'<Point><coordinates>{network["longitude"]},{network["latitude"]},{network["altitude"]}</coordinates></Point></Placemark>\n')
+
+    def __encode(self, chunks):
+        '''
+        Encode text chunks, compressing them for `csv.gz`
+        '''
+        compressor = zlib.compressobj(wbits = 31) if self.format == 'csv.gz' else None # 31 = gzip container
+        for chunk in chunks:
+            data = chunk.encode()
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+    def __file(self, networks, batch_size = 500):
+        buffer = [ self.__header() ]
+        for position, network in enumerate(networks):
+            buffer.append(self.__network(network, position == 0))
+            if len(buffer) >= batch_size:
+                yield ''.join(buffer)
+                buffer = []
+        buffer.append(self.__footer())
+        yield ''.join(buffer)
+
+    def stream(self, networks):
+        '''
+        Generator of the bytes of a single file containing all `networks`
+        '''
+        return self.__encode(self.__file(networks))
+
+    def zip(self, networks, name = 'session'):
+        '''
+        Generator of the bytes of a ZIP archive with a file for each session
+        '''
+        output = ZipStream()
+        compression = zipfile.ZIP_STORED if self.format == 'csv.gz' else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(output, 'w', compression = compression) as archive:
+            for session_id, session_networks in itertools.groupby(networks, key = lambda network: network['session_id']):
+                entry_name = f'{name}_{session_id}.{self.format}' if session_id is not None else f'{name}.{self.format}'
+                with archive.open(entry_name, 'w', force_zip64 = True) as entry:
+                    for data in self.stream(session_networks):
+                        entry.write(data)
+                        yield output.drain()
+        yield output.drain()
+
+class UploadCancelled(Exception):
+    pass
+
+class MultipartUpload():
+    '''
+    multipart/form-data request body with some form fields and a file. The file is streamed while the request is
+    sent, reporting the bytes read to `on_read`; the upload is aborted with `UploadCancelled` once `cancelled` is set
+    '''
+    def __init__(self, fields, name, filename, file, file_size, on_read = None, cancelled = None):
+        boundary = os.urandom(16).hex()
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n' for key, value in fields.items())
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+        tail = f'\r\n--{boundary}--\r\n'
+        self.__parts = [ io.BytesIO(head.encode()), file, io.BytesIO(tail.encode()) ]
+        self.__length = len(head.encode()) + file_size + len(tail.encode())
+        self.__on_read = on_read
+        self.__cancelled = cancelled
+
+    def __len__(self): # used by requests for the Content-Length header
+        return self.__length
+
+    def read(self, size = -1):
+        if self.__cancelled and self.__cancelled.is_set():
+            raise UploadCancelled()
+        data = b''
+        while self.__parts and (size < 0 or len(data) < size):
+            chunk = self.__parts[0].read(size - len(data) if size >= 0 else -1)
+            if not chunk:
+                self.__parts.pop(0)
+                continue
+            data += chunk
+        if self.__on_read:
+            self.__on_read(len(data))
+        return data
+
+class UploadJobs():
+    '''
+    WiGLE uploads run one at a time by a background thread. Each session has at most one queued or running job,
+    so starting the upload of a session already being uploaded returns the existing job. Jobs can be cancelled
+    and their progress is kept in plain dicts polled by the web UI
+    '''
+    MAX_FINISHED = 20 # finished jobs kept to show their result
+
+    def __init__(self, upload):
+        self.__upload = upload # called with the job and its cancellation event, raises on failure
+        self.__lock = Lock()
+        self.__jobs = dict() # id -> job, in creation order
+        self.__cancelled = dict() # id -> event, for queued and running jobs
+        self.__queue = queue.Queue()
+        self.__last_id = 0
+        self.__thread = None
+
+    def submit(self, session_id):
+        '''
+        Queue the upload of a session. Return the job
+        '''
+        with self.__lock:
+            for job in self.__jobs.values():
+                if job['session_id'] == session_id and job['state'] in [ 'queued', 'running' ]:
+                    return job
+            self.__last_id += 1
+            job = {
+                'id': self.__last_id,
+                'session_id': session_id,
+                'state': 'queued',
+                'rows': 0, # networks sent
+                'skipped': 0, # networks not sent because already uploaded nearby
+                'bytes_sent': 0,
+                'bytes_total': None,
+                'error': None,
+                'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self.__jobs[job['id']] = job
+            self.__cancelled[job['id']] = Event()
+            finished = [ job_id for job_id in self.__jobs if job_id not in self.__cancelled ]
+            for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+                del self.__jobs[job_id]
+            if not self.__thread:
+                self.__thread = Thread(target = self.__run, name = 'wardriver-upload', daemon = True)
+                self.__thread.start()
+        self.__queue.put(job['id'])
+        return job
+
+    def cancel(self, job_id):
+        '''
+        Cancel a queued or running job. Return False if there's no such job or it's already finished
+        '''
+        with self.__lock:
+            cancelled = self.__cancelled.get(job_id)
+            if cancelled is None:
+                return False
+            cancelled.set()
+            return True
+
+    def get(self, job_id):
+        return self.__jobs.get(job_id)
+
+    def jobs(self):
+        with self.__lock:
+            return list(self.__jobs.values())
+
+    def stop(self):
+        with self.__lock:
+            for cancelled in self.__cancelled.values():
+                cancelled.set()
+        self.__queue.put(None)
+        if self.__thread:
+            self.__thread.join(timeout = 5)
+            self.__thread = None
+
+    def __run(self):
+        while True:
+            job_id = self.__queue.get()
+            if job_id is None:
+                return
+            job = self.__jobs[job_id]
+            cancelled = self.__cancelled[job_id]
+            if not cancelled.is_set():
+                job['state'] = 'running'
+                try:
+                    self.__upload(job, cancelled)
+                    job['state'] = 'done'
+                except Exception as e:
+                    if cancelled.is_set():
+                        job['state'] = 'cancelled'
+                    else:
+                        job['state'] = 'failed'
+                        job['error'] = str(e) or type(e).__name__
+            else:
+                job['state'] = 'cancelled'
+            with self.__lock:
+                del self.__cancelled[job_id]
+            if job['state'] == 'cancelled':
+                logging.info(f'[WARDRIVER] Upload of session {job["session_id"]} cancelled')
+
+class DatabaseSync():
+    '''
+    Merges other wardriver dbs or changesets into this one (see `Database.merge`), one at a time in a background
+    thread, and streams the changesets of this db. Merge progress is kept in a plain dict polled by the web UI
+    '''
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, db, path, current_session_id = None, on_merged = None):
+        self.__db = db
+        self.__path = path # changesets are written here while they are streamed or merged
+        self.__current_session_id = current_session_id or (lambda: None)
+        self.__on_merged = on_merged # called with the ids of the closed sessions with new rows
+        self.__lock = Lock()
+        self.__cancelled = Event()
+        self.__thread = None
+        self.status = {
+            'state': 'idle',
+            'source': None,
+            'merged': 0, # source observations merged
+            'total': 0,
+            'added': None, # rows added to each table
+            'error': None,
+            'started_at': None,
+            'finished_at': None
+        }
+
+    def __temporary_file(self, prefix):
+        os.makedirs(self.__path, exist_ok = True)
+        return os.path.join(self.__path, f'{prefix}_{time.time_ns()}.db')
+
+    def changeset(self, wardrive_id = 0, session_id = 0):
+        '''
+        Generator over the gzipped changeset of the rows after the given high-water marks, see `Database.export_changeset`
+        '''
+        path = self.__temporary_file('changeset')
+        try:
+            self.__db.export_changeset(path, wardrive_id, session_id)
+            yield from gzip_chunks(path, self.CHUNK_SIZE)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def source_file(self, name):
+        '''
+        Return the path of the file to merge named `name` inside the sync folder, None if it isn't a file there
+        '''
+        folder = os.path.realpath(self.__path)
+        path = os.path.realpath(os.path.join(folder, name))
+        if os.path.dirname(path) != folder or not os.path.isfile(path): # e.g. '../wardriver.db' or a link to a file elsewhere
+            return None
+        return path
 
-    def map_networks(self):
-        cursor = self.__connection.cursor()
-        cursor.execute('SELECT n.mac, n.ssid, w.latitude, w.longitude, w.altitude, w.accuracy FROM networks n JOIN wardrive w ON n.id = w.network_id')
-        rows = cursor.fetchall()
-        networks = []
-        for row in rows:
-            mac, ssid, latitude, longitude, altitude, accuracy = row
-            networks.append({
-                "mac": mac,
-                "ssid": ssid,
-                "latitude": float(latitude),
-                "longitude": float(longitude),
-                "altitude": float(altitude),
-                "accuracy": int(accuracy)
-            })
-        cursor.close()
-        
-        return networks
+    def save_upload(self, file):
+        '''
+        Save an uploaded db or changeset, gzipped or not, and return its path
+        '''
+        path = self.__temporary_file('upload')
+        with open(path, 'wb') as output:
+            shutil.copyfileobj(file, output, self.CHUNK_SIZE)
+        return path
 
-class CSVGenerator():
-    def __init__(self):
-       self.__wigle_info()
-        
-    def __wigle_info(self):
+    def merge(self, source_path, on_progress = None):
         '''
-        Return info used in CSV pre-header
+        Merge the db or changeset at `source_path` and aggregate the new rows in the coverage grid. Return the rows added
         '''
+        with open(source_path, 'rb') as file:
+            compressed = file.read(2) == b'\x1f\x8b'
+        if compressed:
+            path = self.__temporary_file('merge')
+            try:
+                with gzip.open(source_path, 'rb') as file, open(path, 'wb') as output:
+                    shutil.copyfileobj(file, output, self.CHUNK_SIZE)
+                return self.merge(path, on_progress)
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+        connection = sqlite3.connect(read_only_uri(source_path), uri = True)
         try:
-            with open('/etc/pwnagotchi/config.toml', 'r') as config_file:
-                data = toml.load(config_file)
-                # Pwnagotchi name
-                device = data['main']['name']
-                # Pwnagotchi display model
-                display = data['ui']['display']['type'] # Pwnagotchi display
-        except Exception:
-            device = 'pwnagotchi'
-            display = 'unknown'
+            try:
+                upgrade = connection.execute('SELECT 1 FROM metadata WHERE key = \'device_id\'').fetchone() is None
+            except sqlite3.OperationalError: # no metadata table
+                upgrade = True
+            if upgrade:
+                # dbs of older versions get their device id and the current schema on a copy, the source is never modified
+                path = self.__temporary_file('upgrade')
+                copy = sqlite3.connect(path)
+                try:
+                    connection.backup(copy)
+                finally:
+                    copy.close()
+        finally:
+            connection.close()
+        if upgrade:
+            try:
+                Database(path).disconnect()
+                return self.merge(path, on_progress)
+            finally:
+                for file in [ path, f'{path}-wal', f'{path}-shm' ]:
+                    if os.path.exists(file):
+                        os.remove(file)
+        current_session_id = self.__current_session_id()
+        added, sessions_ids = self.__db.merge(source_path, current_session_id, on_progress, self.__cancelled)
+        sessions_ids = [ session_id for session_id in sessions_ids if session_id != current_session_id ] # its CSV is checked when it's closed
+        if self.__on_merged and sessions_ids:
+            self.__on_merged(sessions_ids)
+        while self.__db.aggregate_coverage(Database.SYNC_BATCH_SIZE) > 0 and not self.__cancelled.is_set():
+            pass
+        return added
 
-        # Preheader formatting
-        file_format = 'WigleWifi-1.4'
-        app_release = Wardriver.__version__
-        # Device model
+    def start(self, source_path, remove = False):
+        '''
+        Merge the db or changeset at `source_path` in background, removing it once done if `remove` is set.
+        Return False if a merge is already running
+        '''
+        with self.__lock:
+            if self.__thread and self.__thread.is_alive():
+                if remove:
+                    os.remove(source_path)
+                return False
+            self.status.update(state = 'running', source = os.path.basename(source_path), merged = 0, total = 0, added = None, error = None,
+                               started_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), finished_at = None)
+            self.__thread = Thread(target = self.__run, args = (source_path, remove), name = 'wardriver-sync', daemon = True)
+            self.__thread.start()
+            return True
+
+    def stop(self):
+        self.__cancelled.set()
+        if self.__thread:
+            self.__thread.join(timeout = 5)
+            self.__thread = None
+
+    def __run(self, source_path, remove):
+        def on_progress(merged, total):
+            self.status['merged'] = merged
+            self.status['total'] = total
         try:
-            with open('/sys/firmware/devicetree/base/model', 'r') as model_info:
-                model = model_info.read()
-        except Exception:
-            model = 'unknown'
-        # OS version
+            self.status['added'] = self.merge(source_path, on_progress)
+            self.status['state'] = 'done'
+        except SyncCancelled:
+            self.status['state'] = 'cancelled'
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed merging {source_path}: {e}')
+            self.status['state'] = 'failed'
+            self.status['error'] = str(e) or type(e).__name__
+        finally:
+            self.status['finished_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            if remove and os.path.exists(source_path):
+                os.remove(source_path)
+
+class BackupCancelled(Exception):
+    pass
+
+class DatabaseBackup():
+    '''
+    Online backups of the db (see `Database.backup`), taken by a background thread every `interval` hours and on
+    request. Backups are gzipped inside `path` and only the newest `keep` are kept. Snapshots of the db can also be
+    streamed without saving them
+    '''
+    PREFIX = 'wardriver_'
+    EXTENSION = '.db.gz'
+    CHUNK_SIZE = 64 * 1024
+    STEP_PAGES = 256 # pages copied at a time, 1MB with the default page size
+    STEP_PAUSE = 0.01 # seconds between steps, the plugin IO is served meanwhile
+    STARTUP_DELAY = 300 # seconds, scheduled backups never slow down the boot
+
+    def __init__(self, db, path, interval = 24, keep = 3):
+        self.__db = db
+        self.__path = path
+        self.__interval = interval * 3600 # 0 for backups on request only
+        self.__keep = keep
+        self.__requested = Event()
+        self.__stopped = Event()
+        self.__thread = None
+        self.status = {
+            'state': 'idle',
+            'copied': 0, # pages
+            'total': 0,
+            'error': None,
+            'last_backup': None
+        }
+
+    def start(self):
+        self.__thread = Thread(target = self.__run, name = 'wardriver-backup', daemon = True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__requested.set()
+        if self.__thread:
+            self.__thread.join(timeout = 5)
+            self.__thread = None
+
+    def request(self):
+        '''
+        Take a backup as soon as possible. Return False if one is already running
+        '''
+        if self.status['state'] == 'running':
+            return False
+        self.__requested.set()
+        return True
+
+    def backups(self):
+        '''
+        Return the saved backups, newest first
+        '''
+        if not os.path.isdir(self.__path):
+            return []
+        backups = []
+        for name in os.listdir(self.__path):
+            if name.startswith(self.PREFIX) and name.endswith(self.EXTENSION):
+                stat = os.stat(os.path.join(self.__path, name))
+                backups.append({
+                    'name': name,
+                    'size': stat.st_size,
+                    'created_at': datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                })
+        return sorted(backups, key = lambda backup: backup['name'], reverse = True) # names contain the UTC time
+
+    def file(self, name):
+        '''
+        Return the path of the backup called `name`, None if there's no such backup
+        '''
+        if name != os.path.basename(name) or not name.startswith(self.PREFIX) or not name.endswith(self.EXTENSION):
+            return None
+        path = os.path.join(self.__path, name)
+        return path if os.path.isfile(path) else None
+
+    def snapshot(self):
+        '''
+        Generator over the gzipped snapshot of the db taken when it's first read
+        '''
+        path = self.__temporary_file()
         try:
-            with open('/etc/os-release', 'r') as release_info:
-                release = release_info.read().split('\n')[0].split('=')[-1].replace('"', '')
-        except Exception:
-            release = 'unknown'
-        # CPU model
+            self.__db.backup(path, self.STEP_PAGES, self.__pause)
+            yield from gzip_chunks(path, self.CHUNK_SIZE)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __temporary_file(self):
+        os.makedirs(self.__path, exist_ok = True)
+        return os.path.join(self.__path, f'snapshot_{time.time_ns()}.db')
+
+    def __pause(self, copied, total):
+        if self.__stopped.is_set():
+            raise BackupCancelled()
+        time.sleep(self.STEP_PAUSE)
+
+    def __progress(self, copied, total):
+        self.status['copied'] = copied
+        self.status['total'] = total
+        self.__pause(copied, total)
+
+    def __run(self):
+        due = None
+        if self.__interval:
+            backups = self.backups()
+            last_backup = datetime.strptime(backups[0]['created_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo = timezone.utc).timestamp() if backups else 0
+            due = max(last_backup + self.__interval, time.time() + self.STARTUP_DELAY)
+        while True:
+            self.__requested.wait(max(due - time.time(), 0) if due else None)
+            if self.__stopped.is_set():
+                return
+            self.__requested.clear()
+            self.__backup()
+            if self.__interval:
+                due = time.time() + self.__interval
+
+    def __backup(self):
+        self.status.update(state = 'running', copied = 0, total = 0, error = None)
+        path = self.__temporary_file()
+        name = f'{self.PREFIX}{datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")}{self.EXTENSION}'
+        partial = os.path.join(self.__path, f'{name}.part')
         try:
-            with open('/proc/cpuinfo', 'r') as cpu_model:
-                board = cpu_model.read().split('\n')[1].split(':')[1][1:]
-        except Exception:
-            board = 'unknown'
-        
-        # Brand: currently set equal to model
-        brand = model
+            self.__db.backup(path, self.STEP_PAGES, self.__progress)
+            with open(partial, 'wb') as output:
+                for chunk in gzip_chunks(path, self.CHUNK_SIZE):
+                    output.write(chunk)
+            os.replace(partial, os.path.join(self.__path, name)) # backups are listed only once complete
+            for backup in self.backups()[self.__keep:]:
+                os.remove(os.path.join(self.__path, backup['name']))
+            self.status.update(state = 'done', last_backup = name)
+            logging.info(f'[WARDRIVER] Saved db backup {name}')
+        except BackupCancelled:
+            self.status['state'] = 'cancelled'
+        except Exception as e:
+            logging.error(f'[WARDRIVER] Failed backing up the db: {e}')
+            self.status.update(state = 'failed', error = str(e) or type(e).__name__)
+        finally:
+            for temporary in [ path, partial ]:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
 
-        self.__wigle_file_format = file_format
-        self.__wigle_app_release = app_release
-        self.__wigle_model = model
-        self.__wigle_release = release
-        self.__wigle_device = device
-        self.__wigle_display = display
-        self.__wigle_board = board
-        self.__wigle_brand = brand
+class WhitelistMatcher():
+    '''
+    Precompiled whitelist. Each rule can be:
+    - an exact SSID (`my-network`)
+    - a wildcard SSID pattern (`corp-*`, `guest-??`)
+    - a regex on the SSID prefixed by `re:` (`re:^printer-[0-9]+$`)
+    - a MAC address or a MAC prefix (`aa:bb:cc` for a whole vendor OUI)
+    '''
+    MAC_RULE = re.compile(r'^[0-9a-fA-F]{2}([:-][0-9a-fA-F]{2}){2,5}$')
+    TRIE_END = '' # marks the end of a MAC prefix inside the trie
 
-    def __csv_header(self):
-        return 'MAC,SSID,AuthMode,FirstSeen,Channel,RSSI,CurrentLatitude,CurrentLongitude,AltitudeMeters,AccuracyMeters,Type\n'
-    
-    def __csv_network(self, network):
-        return f'{network["mac"]},{network["ssid"]},{network["auth_mode"]},{network["seen_timestamp"]},{network["channel"]},{network["rssi"]},{network["latitude"]},{network["longitude"]},{network["altitude"]},{network["accuracy"]},WIFI\n'
+    def __init__(self, rules):
+        self.__ssids = set()
+        self.__mac_trie = dict()
+        self.__pattern = None
+        patterns = []
+        for rule in rules:
+            rule = str(rule)
+            if rule.startswith('re:'):
+                try:
+                    re.compile(rule[3:])
+                    patterns.append(rule[3:])
+                except re.error as e:
+                    logging.error(f'[WARDRIVER] Invalid whitelist regex "{rule[3:]}": {e}')
+            elif '*' in rule or '?' in rule:
+                patterns.append(fnmatch.translate(rule))
+            else:
+                self.__ssids.add(rule)
+                if self.MAC_RULE.match(rule):
+                    self.__add_mac_prefix(rule)
+        if len(patterns) > 0:
+            self.__pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
 
-    def networks_to_csv(self, networks):
-        csv = self.__csv_header()
-        for network in networks:
-            csv += self.__csv_network(network)
-        return csv
+    @staticmethod
+    def __normalize_mac(mac):
+        return mac.lower().replace(':', '').replace('-', '')
 
-    def networks_to_wigle_csv(self, networks):
-        pre_header = f'{self.__wigle_file_format},{self.__wigle_app_release},{self.__wigle_model},{self.__wigle_release},{self.__wigle_device},{self.__wigle_display},{self.__wigle_board},{self.__wigle_brand}\n'
-        
-        return pre_header + self.networks_to_csv(networks)
+    def __add_mac_prefix(self, prefix):
+        node = self.__mac_trie
+        for char in self.__normalize_mac(prefix):
+            node = node.setdefault(char, dict())
+        node[self.TRIE_END] = True
+
+    def __match_mac(self, mac):
+        node = self.__mac_trie
+        for char in self.__normalize_mac(mac):
+            if self.TRIE_END in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return self.TRIE_END in node
+
+    def match(self, ssid, mac):
+        '''
+        Return True if the network is whitelisted
+        '''
+        if ssid in self.__ssids:
+            return True
+        if self.__mac_trie and self.__match_mac(mac):
+            return True
+        return self.__pattern is not None and self.__pattern.fullmatch(ssid) is not None
+
+class BettercapGpsClient():
+    '''
+    GPS position read from bettercap in background, so that the APs list processing only reads the last fix.
+    Only the GPS state is requested (`/api/session/gps`). On pwnagotchi versions that don't support it the full session
+    is too heavy to be polled: it's read only when a fix is needed and the last one is older than `FULL_SESSION_TTL`
+    '''
+    REFRESH_INTERVAL = 1 # seconds between two requests to bettercap
+    FULL_SESSION_TTL = 5 # seconds a fix read from the full session is used for
+    MAX_AGE = 10 # seconds after which the last fix is not used anymore
+
+    def __init__(self, agent):
+        self.__agent = agent
+        self.__full_session = False
+        self.__fix = None # (coordinates, time.monotonic() when they have been read)
+        self.__lock = Lock() # in full session mode, the fix is read by the APs list and by the track
+        self.__stop = Event()
+        self.__thread = None
+
+    def start(self):
+        if self.__thread:
+            return
+        self.__thread = Thread(target = self.__run, name = 'wardriver-bettercap-gps', daemon = True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join(timeout = 5)
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stop.is_set() and not self.__full_session:
+            self.refresh()
+            self.__stop.wait(self.REFRESH_INTERVAL)
+
+    def __read_gps(self):
+        if not self.__full_session:
+            try:
+                gps = self.__agent.session('session/gps')
+                if isinstance(gps, dict) and 'Latitude' in gps:
+                    return gps
+            except Exception:
+                pass
+        gps = self.__agent.session()['gps']
+        if not self.__full_session:
+            logging.info(f'[WARDRIVER] Bettercap GPS state not available alone, reading it from the full session when needed (at most every {self.FULL_SESSION_TTL}s)')
+            self.__full_session = True
+        return gps
+
+    def refresh(self):
+        '''
+        Read the current fix from bettercap. Return False if bettercap can't be reached
+        '''
+        try:
+            gps = self.__read_gps()
+        except Exception as e:
+            logging.debug(f'[WARDRIVER] Cannot read GPS data from bettercap: {e}')
+            return False
+        self.__fix = ({
+            'Latitude': gps.get('Latitude', None),
+            'Longitude': gps.get('Longitude', None),
+            'Altitude': gps.get('Altitude', None),
+            'Speed': gps.get('Speed', None)
+        }, time.monotonic())
+        return True
+
+    def age(self):
+        '''
+        Return the seconds elapsed since the last fix has been read, None if no fix has been read yet
+        '''
+        fix = self.__fix
+        return time.monotonic() - fix[1] if fix else None
+
+    def get_coordinates(self):
+        '''
+        Return the last fix, None if it's older than `MAX_AGE` seconds
+        '''
+        if self.__full_session:
+            with self.__lock:
+                fix = self.__fix
+                if fix is None or time.monotonic() - fix[1] > self.FULL_SESSION_TTL:
+                    self.refresh()
+        fix = self.__fix
+        if fix is None or time.monotonic() - fix[1] > self.MAX_AGE:
+            return None
+        return fix[0]
 
 # Credits to Rai68: https://github.com/rai68/gpsd-easy
 class GpsdClient():
@@ -300,6 +2895,7 @@ class GpsdClient():
         self.port = port
         self.__gpsd_socket = None
         self.__gpsd_stream = None
+        self.__lock = Lock() # polled both for the APs list and for the track
     
     def connect(self):
         logging.debug('[WARDRIVER] Connecting to GPSD socket')
@@ -328,6 +2924,10 @@ class GpsdClient():
             self.__gpsd_stream = None
 
     def get_coordinates(self):
+        with self.__lock:
+            return self.__poll()
+
+    def __poll(self):
         for attempt in range(self.MAX_RETRIES):
             try:
                 self.__gpsd_stream.write('?POLL;\n')
@@ -343,7 +2943,8 @@ class GpsdClient():
                     return {
                         'Latitude': response['tpv'][0].get('lat', None),
                         'Longitude': response['tpv'][0].get('lon', None),
-                        'Altitude': response['tpv'][0].get('alt', None)
+                        'Altitude': response['tpv'][0].get('alt', None),
+                        'Speed': response['tpv'][0].get('speed', None)
                     }
             except:
                 logging.error('[WARDRIVER] GPSD socket error. Reconnecting...')
@@ -371,6 +2972,8 @@ class PwndroidClient:
         self.__websocket = None
     
     async def connect(self):
+        import asyncio
+        import websockets
         while not self.__websocket and not self.__destroy:
             try:
                 self.__websocket = await websockets.connect(f'ws://{self.host}:{self.port}')
@@ -394,6 +2997,8 @@ class PwndroidClient:
         return self.__websocket is not None
     
     async def __get_gps_coordinates(self):
+        import asyncio
+        import websockets
         while self.__websocket:
             try:
                 message = await self.__websocket.recv()
@@ -415,6 +3020,315 @@ class PwndroidClient:
                 logging.error(f'[WARDRIVER] Error while getting GPS position. {e}')
 
 
+class TrackRecorder():
+    '''
+    Record the route: the current GPS fix is read every `interval` seconds and saved in the track table in batches.
+    Fixes are skipped while the position doesn't change, keeping one every `HEARTBEAT` seconds
+    '''
+    FLUSH_INTERVAL = 30 # seconds between two writes
+    MIN_DISTANCE = 3 # meters, nearer fixes are the same position
+    HEARTBEAT = 60 # seconds, a still position is recorded at least this often to tell it apart from a missing fix
+
+    def __init__(self, db, read_fix, interval = 1):
+        self.__db = db
+        self.__read_fix = read_fix # returns the current fix (bettercap/GPSD/pwndroid format) or None
+        self.__interval = interval
+        self.__session_id = None
+        self.__pending = []
+        self.__pending_lock = Lock()
+        self.__last_fix = None # (timestamp, latitude, longitude) of the last recorded fix
+        self.__stop = Event()
+        self.__thread = None
+
+    def start(self, session_id):
+        self.set_current_session(session_id)
+        if self.__thread:
+            return
+        self.__thread = Thread(target = self.__run, name = 'wardriver-track', daemon = True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join(timeout = 10)
+            self.__thread = None
+        self.flush()
+
+    def set_current_session(self, session_id):
+        self.flush() # fixes of the previous session are saved with its id
+        self.__session_id = session_id
+
+    def __run(self):
+        flushed_at = time.monotonic()
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.add(self.__read_fix())
+            except Exception as e:
+                logging.debug(f'[WARDRIVER] Cannot read GPS fix for the track: {e}')
+            if time.monotonic() - flushed_at >= self.FLUSH_INTERVAL:
+                flushed_at = time.monotonic()
+                try:
+                    self.flush()
+                except Exception as e:
+                    logging.error(f'[WARDRIVER] Cannot save GPS track: {e}')
+
+    def add(self, fix):
+        '''
+        Queue the fix, if it's valid and the position changed since the last one
+        '''
+        if not fix or not fix.get('Latitude') or not fix.get('Longitude') or self.__session_id is None:
+            return
+        timestamp, latitude, longitude = int(time.time()), float(fix['Latitude']), float(fix['Longitude'])
+        last = self.__last_fix
+        if last and (timestamp <= last[0] or (timestamp - last[0] < self.HEARTBEAT and haversine(last[1], last[2], latitude, longitude) < self.MIN_DISTANCE)):
+            return
+        self.__last_fix = (timestamp, latitude, longitude)
+        with self.__pending_lock:
+            self.__pending.append((self.__session_id, timestamp, latitude, longitude, fix.get('Altitude'), fix.get('Speed')))
+
+    def pending(self, session_id):
+        '''
+        Return the (timestamp, latitude, longitude) fixes of the session not saved yet
+        '''
+        with self.__pending_lock:
+            return [ fix[1:4] for fix in self.__pending if fix[0] == session_id ]
+
+    def flush(self):
+        with self.__pending_lock:
+            fixes, self.__pending = self.__pending, []
+        if fixes:
+            self.__db.add_track_fixes(fixes)
+
+class StageTimer():
+    '''
+    Context manager that records the duration of a stage and, while profiling, profiles it
+    '''
+    def __init__(self, metrics, stage):
+        self.__metrics = metrics
+        self.__stage = stage
+        self.__profiling = False
+
+    def __enter__(self):
+        self.__profiling = self.__metrics.profile_enable()
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__metrics.observe(self.__stage, time.perf_counter() - self.__start)
+        if self.__profiling:
+            self.__metrics.profile_disable()
+        return False
+
+class Metrics():
+    '''
+    Per-stage latency histograms, counters and gauges of the plugin hot paths, exposed in Prometheus text format.
+    An optional cProfile capture can be toggled at runtime
+    '''
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+    COUNTERS = {
+        'aps_seen': 'APs received from bettercap',
+        'aps_filtered': 'APs filtered out (whitelisted, already reported or motion-aware filtering)',
+        'aps_written': 'APs written to the db',
+        'aps_dropped': 'APs not logged because of missing GPS fix or stationary throttling',
+        'gps_misses': 'APs lists received without a GPS fix'
+    }
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__histograms = dict()
+        self.__counters = { name: 0 for name in self.COUNTERS }
+        self.__gauges = dict()
+        self.__profiler = None
+        self.__profiler_lock = Lock()
+
+    def timer(self, stage):
+        return StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self.__lock:
+            histogram = self.__histograms.get(stage)
+            if not histogram:
+                histogram = { 'buckets': [ 0 ] * len(self.BUCKETS), 'sum': 0, 'count': 0, 'max': 0 }
+                self.__histograms[stage] = histogram
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], seconds)
+
+    def stream_timer(self, stage, chunks):
+        '''
+        Generator over `chunks` recording, as the duration of `stage`, the time until the last one has been sent
+        '''
+        start = time.perf_counter()
+        try:
+            yield from chunks
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, counter, value = 1):
+        with self.__lock:
+            self.__counters[counter] += value
+
+    def gauge(self, name, description, function):
+        '''
+        Register a gauge whose value is read from `function` when metrics are collected
+        '''
+        self.__gauges[name] = (description, function)
+
+    def __gauges_values(self):
+        values = dict()
+        for name, (description, function) in self.__gauges.items():
+            try:
+                value = function()
+                if value is not None: # not available yet
+                    values[name] = value
+            except Exception as e:
+                logging.debug(f'[WARDRIVER] Cannot collect {name} metric: {e}')
+        return values
+
+    def __quantile(self, histogram, quantile):
+        '''
+        Approximate quantile: upper bound of the bucket containing it
+        '''
+        target = histogram['count'] * quantile
+        cumulative = 0
+        for index, bound in enumerate(self.BUCKETS):
+            cumulative += histogram['buckets'][index]
+            if cumulative >= target:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def snapshot(self):
+        with self.__lock:
+            stages = {
+                stage: {
+                    'count': histogram['count'],
+                    'avg_ms': histogram['sum'] / histogram['count'] * 1000 if histogram['count'] else 0,
+                    'p95_ms': self.__quantile(histogram, 0.95) * 1000,
+                    'max_ms': histogram['max'] * 1000
+                } for stage, histogram in self.__histograms.items()
+            }
+            counters = dict(self.__counters)
+        return {
+            'stages': stages,
+            'counters': counters,
+            'gauges': self.__gauges_values(),
+            'profiling': self.__profiler is not None
+        }
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP wardriver_stage_duration_seconds Duration of the plugin hot paths',
+            '# TYPE wardriver_stage_duration_seconds histogram'
+        ]
+        with self.__lock:
+            for stage, histogram in self.__histograms.items():
+                cumulative = 0
+                for index, bound in enumerate(self.BUCKETS):
+                    cumulative += histogram['buckets'][index]
+                    lines.append(f'wardriver_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'wardriver_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'wardriver_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'wardriver_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            for name, value in self.__counters.items():
+                lines.append(f'# HELP wardriver_{name}_total {self.COUNTERS[name]}')
+                lines.append(f'# TYPE wardriver_{name}_total counter')
+                lines.append(f'wardriver_{name}_total {value}')
+        for name, value in self.__gauges_values().items():
+            lines.append(f'# HELP wardriver_{name} {self.__gauges[name][0]}')
+            lines.append(f'# TYPE wardriver_{name} gauge')
+            lines.append(f'wardriver_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Profiling
+    def start_profiling(self):
+        import cProfile
+        with self.__profiler_lock:
+            if not self.__profiler:
+                self.__profiler = cProfile.Profile()
+                logging.info('[WARDRIVER] Profiling started')
+
+    def stop_profiling(self, limit = 50):
+        '''
+        Stop profiling and return the stats of the slowest functions as text
+        '''
+        import pstats
+        with self.__profiler_lock:
+            profiler = self.__profiler
+            self.__profiler = None
+        if not profiler:
+            return 'Profiling not running'
+        logging.info('[WARDRIVER] Profiling stopped')
+        output = io.StringIO()
+        try:
+            pstats.Stats(profiler, stream = output).sort_stats('cumulative').print_stats(limit)
+        except TypeError: # nothing has been profiled
+            return 'No data collected'
+        return output.getvalue()
+
+    def profile_enable(self):
+        '''
+        Profile the calling stage if profiling is active and no other stage is being profiled
+        '''
+        profiler = self.__profiler
+        if profiler and self.__profiler_lock.acquire(blocking = False):
+            if self.__profiler is not profiler:
+                self.__profiler_lock.release()
+                return False
+            profiler.enable()
+            self.__active_profiler = profiler
+            return True
+        return False
+
+    def profile_disable(self):
+        self.__active_profiler.disable()
+        self.__profiler_lock.release()
+
+class MotionTracker():
+    '''
+    Estimate the unit speed from successive GPS fixes (or the speed reported by the GPS) and classify
+    the motion as stationary, moving or fast
+    '''
+    STATIONARY = 'stationary'
+    MOVING = 'moving'
+    FAST = 'fast'
+    SMOOTHING = 0.5 # weight of the newest speed sample
+    MIN_INTERVAL = 1 # seconds between two fixes to compute the speed
+
+    def __init__(self, stationary_speed = 1.0, fast_speed = 15.0):
+        self.__stationary_speed = stationary_speed
+        self.__fast_speed = fast_speed
+        self.__last_fix = None
+        self.speed = None
+        self.state = self.MOVING # until we know better, log as usual
+
+    def update(self, latitude, longitude, speed = None):
+        '''
+        Add a new fix and return the current motion state
+        '''
+        now = time.time()
+        if speed is None and self.__last_fix:
+            last_latitude, last_longitude, last_time = self.__last_fix
+            if now - last_time < self.MIN_INTERVAL:
+                return self.state
+            speed = haversine(last_latitude, last_longitude, latitude, longitude) / (now - last_time)
+        self.__last_fix = (latitude, longitude, now)
+        if speed is None:
+            return self.state
+
+        speed = float(speed)
+        self.speed = speed if self.speed is None else self.SMOOTHING * speed + (1 - self.SMOOTHING) * self.speed
+        if self.speed < self.__stationary_speed:
+            self.state = self.STATIONARY
+        elif self.speed > self.__fast_speed:
+            self.state = self.FAST
+        else:
+            self.state = self.MOVING
+        return self.state
+
 class Wardriver(plugins.Plugin):
     __author__ = 'CyberArtemio'
     __version__ = '2.3'
@@ -423,6 +3337,10 @@ class Wardriver(plugins.Plugin):
 
     DEFAULT_PATH = '/root/wardriver' # SQLite database default path
     DATABASE_NAME = 'wardriver.db' # SQLite database file name
+    CSV_CACHE_DIR = 'csv' # sessions CSV files cache, inside the db path
+    SYNC_DIR = 'sync' # changesets being streamed or merged, inside the db path
+    BACKUP_DIR = 'backups' # db backups, inside the db path
+    WHITELIST_RELOAD_INTERVAL = 30 # seconds between each check for config changes
     ASSETS_URL = [
         {
             "name": "icon_error.bmp",
@@ -434,13 +3352,37 @@ class Wardriver(plugins.Plugin):
         }
     ]
 
+    WEB_ASSETS_DIR = 'web' # Web UI libraries, inside the assets path
+    WEB_ASSETS = [
+        { "name": "pico-2/pico.min.css", "url": "https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css" },
+        { "name": "fontawesome-6.5.1/css/all.min.css", "url": "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css" },
+        { "name": "fontawesome-6.5.1/webfonts/fa-solid-900.woff2", "url": "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/webfonts/fa-solid-900.woff2" },
+        { "name": "fontawesome-6.5.1/webfonts/fa-regular-400.woff2", "url": "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/webfonts/fa-regular-400.woff2" },
+        { "name": "fontawesome-6.5.1/webfonts/fa-brands-400.woff2", "url": "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/webfonts/fa-brands-400.woff2" },
+        { "name": "leaflet-1.9.4/leaflet.css", "url": "https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" },
+        { "name": "leaflet-1.9.4/leaflet.js", "url": "https://unpkg.com/leaflet@1.9.4/dist/leaflet.js" },
+        { "name": "leaflet-1.9.4/images/layers.png", "url": "https://unpkg.com/leaflet@1.9.4/dist/images/layers.png" },
+        { "name": "leaflet-1.9.4/images/layers-2x.png", "url": "https://unpkg.com/leaflet@1.9.4/dist/images/layers-2x.png" },
+        { "name": "leaflet-1.9.4/images/marker-icon.png", "url": "https://unpkg.com/leaflet@1.9.4/dist/images/marker-icon.png" },
+        { "name": "leaflet-1.9.4/images/marker-shadow.png", "url": "https://unpkg.com/leaflet@1.9.4/dist/images/marker-shadow.png" },
+        { "name": "leaflet-canvas-marker-0.2.0/leaflet.canvas-markers.js", "url": "https://unpkg.com/leaflet-canvas-marker@0.2.0" },
+        { "name": "icons8/marker.png", "url": "https://img.icons8.com/metro/26/000000/marker.png" }
+    ]
+    TILE_CACHE_NAME = 'tiles.mbtiles' # map tiles cache, inside the db path
+    WEBHOOK_STAGES = { 'index', 'assets', 'tiles', 'current-session', 'general-stats', 'maintenance', 'metrics', 'csv', 'heatmap', 'track',
+                       'locations', 'spatial', 'backups', 'snapshot', 'sync', 'export', 'sessions', 'upload', 'uploads', 'networks', 'search',
+                       'map-networks' } # first path segments timed on their own, the other paths are timed as webhook:other
+    DEFAULT_TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+
     def __init__(self):
         logging.debug('[WARDRIVER] Plugin created')
         self.__db = None
         self.__current_icon = ""
+        self.__ui_text = None
         self.ready = False
         self.__downloaded_assets = True
         self.__agent_mode = None
+        self.__metrics = Metrics()
         self.__last_gps = {
             "latitude": '-',
             "longitude": '-',
@@ -475,6 +3417,10 @@ class Wardriver(plugins.Plugin):
                 logging.critical(f'[WARDRIVER] Asset {asset["name"]} is missing. Once internet is available it will be downloaded from GitHub')
                 self.__downloaded_assets = False
                 self.__icon = False
+        self.__web_assets_path = os.path.join(self.__assets_path, self.WEB_ASSETS_DIR)
+        if any(not os.path.isfile(os.path.join(self.__web_assets_path, asset["name"])) for asset in self.WEB_ASSETS):
+            logging.info('[WARDRIVER] Web UI libraries will be loaded from CDNs until they are downloaded')
+            self.__downloaded_assets = False
         
         try:
             self.__reverse = self.options['ui']['icon_reverse']
@@ -487,7 +3433,7 @@ class Wardriver(plugins.Plugin):
             self.__ui_position = (7, 95)
         
         try:
-            self.__whitelist = self.options['whitelist']
+            self.__whitelist = list(self.options['whitelist'])
         except Exception:
             self.__whitelist = []
 
@@ -499,6 +3445,14 @@ class Wardriver(plugins.Plugin):
             self.__wigle_donate = self.options['wigle']['donate']
         except Exception:
             self.__wigle_donate = False
+        try:
+            self.__wigle_novel_only = self.options['wigle']['novel_only']
+        except Exception:
+            self.__wigle_novel_only = False
+        try:
+            self.__wigle_novel_distance = float(self.options['wigle']['novel_distance'])
+        except Exception:
+            self.__wigle_novel_distance = 100
         try:
             self.__wigle_enabled = self.options['wigle']['enabled']
             
@@ -521,15 +3475,140 @@ class Wardriver(plugins.Plugin):
             os.makedirs(self.__path)
             logging.warning('[WARDRIVER] Created db directory')
         
-        self.__db = Database(os.path.join(self.__path, self.DATABASE_NAME))
+        self.__retention_config = dict()
+        try:
+            self.__retention_config['best_observation_days'] = int(self.options['retention']['best_observation_days'])
+        except Exception:
+            self.__retention_config['best_observation_days'] = 0
+        try:
+            self.__retention_config['uploaded_sessions_days'] = int(self.options['retention']['uploaded_sessions_days'])
+        except Exception:
+            self.__retention_config['uploaded_sessions_days'] = 0
+        try:
+            self.__retention_config['interval'] = int(self.options['retention']['interval'])
+        except Exception:
+            self.__retention_config['interval'] = 60
+        try:
+            self.__retention_config['vacuum_conversion'] = self.options['retention']['vacuum_conversion']
+        except Exception:
+            self.__retention_config['vacuum_conversion'] = False
+
+        self.__locations_config = dict()
+        try:
+            self.__locations_config['estimate'] = self.options['locations']['estimate']
+        except Exception:
+            self.__locations_config['estimate'] = True
+
+        self.__motion_config = dict()
+        try:
+            self.__motion_config['enabled'] = self.options['motion']['enabled']
+        except Exception:
+            self.__motion_config['enabled'] = False
+        try:
+            self.__motion_config['stationary_speed'] = float(self.options['motion']['stationary_speed'])
+        except Exception:
+            self.__motion_config['stationary_speed'] = 1.0
+        try:
+            self.__motion_config['fast_speed'] = float(self.options['motion']['fast_speed'])
+        except Exception:
+            self.__motion_config['fast_speed'] = 15.0
+        try:
+            self.__motion_config['stationary_interval'] = int(self.options['motion']['stationary_interval'])
+        except Exception:
+            self.__motion_config['stationary_interval'] = 300
+        try:
+            self.__motion_config['fast_max_networks'] = int(self.options['motion']['fast_max_networks'])
+        except Exception:
+            self.__motion_config['fast_max_networks'] = 50
+        try:
+            self.__deduplicate_distance = float(self.options['history']['deduplicate_distance'])
+        except Exception:
+            self.__deduplicate_distance = 0
+
+        self.__session_config = dict()
+        try:
+            self.__session_config['max_duration'] = int(self.options['session']['max_duration'])
+        except Exception:
+            self.__session_config['max_duration'] = 0
+        try:
+            self.__session_config['max_networks'] = int(self.options['session']['max_networks'])
+        except Exception:
+            self.__session_config['max_networks'] = 0
+        try:
+            self.__session_config['idle_gap'] = int(self.options['session']['idle_gap'])
+        except Exception:
+            self.__session_config['idle_gap'] = 0
+
+        self.__track_config = dict()
+        try:
+            self.__track_config['enabled'] = self.options['track']['enabled']
+        except Exception:
+            self.__track_config['enabled'] = True
+        try:
+            self.__track_config['interval'] = max(float(self.options['track']['interval']), 1)
+        except Exception:
+            self.__track_config['interval'] = 1
+
+        self.__backup_config = dict()
+        try:
+            self.__backup_config['interval'] = max(float(self.options['backup']['interval']), 0)
+        except Exception:
+            self.__backup_config['interval'] = 24
+        try:
+            self.__backup_config['keep'] = max(int(self.options['backup']['keep']), 1)
+        except Exception:
+            self.__backup_config['keep'] = 3
+
+        self.__map_config = dict()
+        try:
+            self.__map_config['tile_cache'] = self.options['map']['tile_cache']
+        except Exception:
+            self.__map_config['tile_cache'] = True
+        try:
+            self.__map_config['tile_cache_size'] = int(self.options['map']['tile_cache_size'])
+        except Exception:
+            self.__map_config['tile_cache_size'] = 100
+        try:
+            self.__map_config['tile_url'] = self.options['map']['tile_url']
+        except Exception:
+            self.__map_config['tile_url'] = self.DEFAULT_TILE_URL
+
+        self.__motion = MotionTracker(self.__motion_config['stationary_speed'], self.__motion_config['fast_speed']) if self.__motion_config['enabled'] else None
+        self.__motion_processed_at = 0
+        self.__motion_processed_macs = set()
+
+        self.__db = Database(os.path.join(self.__path, self.DATABASE_NAME), deduplicate_distance = self.__deduplicate_distance)
         self.__csv_generator = CSVGenerator()
-        self.__session_reported = []
+        self.__csv_cache = CSVCache(os.path.join(self.__path, self.CSV_CACHE_DIR), self.__db, self.__csv_generator)
+        self.__maintenance = DatabaseMaintenance(self.__db,
+                                                 best_observation_days = self.__retention_config['best_observation_days'],
+                                                 uploaded_sessions_days = self.__retention_config['uploaded_sessions_days'],
+                                                 interval = self.__retention_config['interval'],
+                                                 uploaded_only = self.__wigle_enabled,
+                                                 on_pruned = self.__csv_cache.invalidate,
+                                                 estimate_locations = self.__locations_config['estimate'],
+                                                 vacuum_conversion = self.__retention_config['vacuum_conversion'])
+        self.__tile_cache = None
+        if self.__map_config['tile_cache']:
+            self.__tile_cache = TileCache(os.path.join(self.__path, self.TILE_CACHE_NAME),
+                                          tile_url = self.__map_config['tile_url'],
+                                          max_size = self.__map_config['tile_cache_size'] * 1024 * 1024,
+                                          user_agent = f'wardriver-pwnagotchi-plugin/{self.__version__}')
+        self.__uploads = UploadJobs(self.__upload_session_to_wigle)
+        self.__sync = DatabaseSync(self.__db, os.path.join(self.__path, self.SYNC_DIR), lambda: self.__session_id, on_merged = self.__csv_cache.invalidate)
+        self.__backup = DatabaseBackup(self.__db, os.path.join(self.__path, self.BACKUP_DIR), self.__backup_config['interval'], self.__backup_config['keep'])
+        self.__track = TrackRecorder(self.__db, self.__read_track_fix, self.__track_config['interval']) if self.__track_config['enabled'] else None
+        self.__session_reported = set()
+        self.__session_lock = Lock() # the session is rotated both by the APs list and when internet is available
+        self.__bettercap_gps = None # started once the agent is available
         self.__last_ap_refresh = None
         self.__last_ap_reported = []
 
         logging.info(f'[WARDRIVER] Wardriver DB can be found in {self.__path}')
         
         self.__load_global_whitelist()
+        self.__whitelist_matcher = WhitelistMatcher(self.__whitelist)
+        self.__whitelist_checked_at = time.time()
         if len(self.__whitelist) > 0:
             logging.info(f'[WARDRIVER] Ignoring {len(self.__whitelist)} networks')
         
@@ -538,6 +3617,17 @@ class Wardriver(plugins.Plugin):
             logging.info('[WARDRIVER] Join the WiGLE group: search "The crew of the Black Pearl" and start wardriving with us!')
 
         self.__session_id = self.__db.new_wardriving_session()
+        self.__session_started_at = time.time()
+        self.__session_written_at = time.time()
+        self.__maintenance.start(self.__session_id)
+        self.__backup.start()
+        if self.__track:
+            self.__track.start(self.__session_id)
+
+        self.__metrics.gauge('db_size_bytes', 'Size of the db file', self.__db.size)
+        self.__metrics.gauge('upload_queue_depth', 'Sessions waiting to be uploaded to WiGLE', lambda: len(self.__db.wigle_sessions_not_uploaded(self.__session_id)) if self.__wigle_enabled else 0)
+        self.__metrics.gauge('session_reported_networks', 'Networks reported in the current session', lambda: len(self.__session_reported))
+        self.__metrics.gauge('gps_fix_age_seconds', 'Seconds since the last GPS fix has been read from bettercap', lambda: self.__bettercap_gps.age() if self.__bettercap_gps else None)
 
         self.ready = True
 
@@ -561,24 +3651,61 @@ class Wardriver(plugins.Plugin):
             except:
                 self.__gps_config['host'] = PwndroidClient.DEFAULT_HOST
                 self.__gps_config['port'] = PwndroidClient.DEFAULT_PORT
-            try:
-                self.__pwndroid_client = PwndroidClient(self.__gps_config['host'], self.__gps_config['port'])
-                asyncio.run(self.__pwndroid_client.connect())
-            except Exception as e:
-                logging.critical(f'[WARDRIVER] Unexpected error while connecting to pwndroid. Error: {e}')
+            self.__pwndroid_client = PwndroidClient(self.__gps_config['host'], self.__gps_config['port'])
+            Thread(target = self.__run_pwndroid_client, name = 'wardriver-pwndroid', daemon = True).start() # the client keeps listening for positions
+
+    def __run_pwndroid_client(self):
+        try:
+            import asyncio
+            asyncio.run(self.__pwndroid_client.connect())
+        except Exception as e:
+            logging.critical(f'[WARDRIVER] Unexpected error while connecting to pwndroid. Error: {e}')
     
     def on_ready(self, agent):
         self.__agent_mode = agent.mode
+        if self.__gps_config['method'] == 'bettercap':
+            self.__start_bettercap_gps(agent)
+
+    def __start_bettercap_gps(self, agent):
+        if self.__bettercap_gps:
+            return
+        self.__bettercap_gps = BettercapGpsClient(agent)
+        self.__bettercap_gps.refresh() # the first fix is read right away, the next ones in background
+        self.__bettercap_gps.start()
         
     def __load_global_whitelist(self):
         try:
-            with open('/etc/pwnagotchi/config.toml', 'r') as config_file:
-                data = toml.load(config_file)
-                for ssid in data['main']['whitelist']:
-                    if ssid not in self.__whitelist:
-                        self.__whitelist.append(ssid)
-        except Exception as e:
-            logging.critical('[WARDRIVER] Cannot read global config. Networks in global whitelist will NOT be ignored')
+            data = read_global_config()
+            self.__whitelist_config_mtime = _global_config_cache['mtime']
+            for ssid in data['main']['whitelist']:
+                if ssid not in self.__whitelist:
+                    self.__whitelist.append(ssid)
+        except Exception as e:
+            self.__whitelist_config_mtime = None
+            logging.critical('[WARDRIVER] Cannot read global config. Networks in global whitelist will NOT be ignored')
+
+    def __reload_whitelist(self):
+        '''
+        Rebuild the whitelist matcher if the global config has changed since the last check
+        '''
+        self.__whitelist_checked_at = time.time()
+        try:
+            if os.stat(GLOBAL_CONFIG_PATH).st_mtime == self.__whitelist_config_mtime:
+                return
+            data = read_global_config()
+        except Exception:
+            return
+        try:
+            whitelist = list(data['main']['plugins']['wardriver']['whitelist'])
+        except Exception: # set elsewhere (e.g. conf.d) or not set: keep the one the plugin has been loaded with
+            try:
+                whitelist = list(self.options['whitelist'])
+            except Exception:
+                whitelist = []
+        self.__whitelist = whitelist
+        self.__load_global_whitelist()
+        self.__whitelist_matcher = WhitelistMatcher(self.__whitelist)
+        logging.info(f'[WARDRIVER] Config changed, reloaded whitelist ({len(self.__whitelist)} rules)')
     
     def on_ui_setup(self, ui):
         if self.__ui_enabled:
@@ -593,22 +3720,29 @@ class Wardriver(plugins.Plugin):
                                             text_font = fonts.Small))
             
             if self.__icon:
-                ui.add_element('wardriver_icon', WardriverIcon(path = f'{self.__assets_path}/icon_working.bmp', xy = self.__ui_position, reverse = self.__reverse))
+                icons = { icon: f'{self.__assets_path}/{icon}.bmp' for icon in [ 'icon_working', 'icon_error' ] }
+                ui.add_element('wardriver_icon', WardriverIcon(paths = icons, xy = self.__ui_position, reverse = self.__reverse, value = 'icon_working'))
                 self.__current_icon = 'icon_working'
 
     def on_ui_update(self, ui):
+        with self.__metrics.timer('on_ui_update'):
+            self.__update_ui(ui)
+
+    def __update_ui(self, ui):
         if self.__gps_config['method'] == 'gpsd' and self.ready:
             self.__gpsd_client.get_coordinates() # Poll to keep the socket open
         if self.__ui_enabled and self.ready and self.__agent_mode and self.__agent_mode != "manual":
-            ui.set('wardriver', f'{self.__db.session_networks_count(self.__session_id)} {"networks" if self.__icon else "nets"}')
-            if self.__gps_available and self.__current_icon == 'icon_error':
-                ui.remove_element('wardriver_icon')
-                ui.add_element('wardriver_icon', WardriverIcon(path = f'{self.__assets_path}/icon_working.bmp', xy = self.__ui_position, reverse = self.__reverse))
-                self.__current_icon = 'icon_working'
-            elif not self.__gps_available and self.__current_icon == 'icon_working':
-                ui.remove_element('wardriver_icon')
-                ui.add_element('wardriver_icon', WardriverIcon(path = f'{self.__assets_path}/icon_error.bmp', xy = self.__ui_position, reverse = self.__reverse))
-                self.__current_icon = 'icon_error'
+            # each network reported in this session has a row in the db, so there's no need to count them there.
+            # The display is touched only on changes to avoid needless e-ink refreshes
+            text = f'{len(self.__session_reported)} {"networks" if self.__icon else "nets"}'
+            if text != self.__ui_text:
+                ui.set('wardriver', text)
+                self.__ui_text = text
+            if self.__icon:
+                icon = 'icon_working' if self.__gps_available else 'icon_error'
+                if icon != self.__current_icon:
+                    ui.set('wardriver_icon', icon)
+                    self.__current_icon = icon
 
     def on_unload(self, ui):
         if self.__ui_enabled:
@@ -619,7 +3753,18 @@ class Wardriver(plugins.Plugin):
         if self.__gps_config['method'] == 'gpsd':
             self.__gpsd_client.disconnect()
         if self.__gps_config['method'] == 'pwndroid':
+            import asyncio
             asyncio.run(self.__pwndroid_client.disconnect())
+        if self.__bettercap_gps:
+            self.__bettercap_gps.stop()
+        self.__uploads.stop()
+        self.__sync.stop()
+        self.__backup.stop()
+        self.__maintenance.stop()
+        if self.__track:
+            self.__track.stop()
+        if self.__tile_cache:
+            self.__tile_cache.close()
         self.__db.disconnect()
         logging.info('[WARDRIVER] Plugin unloaded')
 
@@ -627,25 +3772,69 @@ class Wardriver(plugins.Plugin):
         '''
         Filter whitelisted networks
         '''
-        filtered_aps = [ ap for ap in unfiltered_aps if ap['hostname'] not in self.__whitelist ]
+        if time.time() - self.__whitelist_checked_at > self.WHITELIST_RELOAD_INTERVAL:
+            self.__reload_whitelist()
+        matcher = self.__whitelist_matcher
+        filtered_aps = [ ap for ap in unfiltered_aps if not matcher.match(ap['hostname'], ap['mac']) ]
         return filtered_aps
     
+    @staticmethod
+    def __ap_key(ap):
+        return (ap['mac'], ap['hostname'] if ap['hostname'] != '<hidden>' else '')
+
     def __filter_reported_aps(self, unfiltered_aps):
         '''
         Filter already reported networks
         '''
-        filtered_aps = [ ap for ap in unfiltered_aps if (ap['mac'], ap['hostname']) not in self.__session_reported ]
+        filtered_aps = [ ap for ap in unfiltered_aps if self.__ap_key(ap) not in self.__session_reported ]
         return filtered_aps
 
+    def __filter_motion_aps(self, unfiltered_aps):
+        '''
+        Adapt the networks to log to the unit motion:
+        - stationary: only networks never saved in the db
+        - fast: networks never saved in the db first, then the strongest ones, up to `fast_max_networks`
+        '''
+        state = self.__motion.state
+        if state == MotionTracker.MOVING or len(unfiltered_aps) == 0:
+            return unfiltered_aps
+        known = self.__db.known_networks([ self.__ap_key(ap) for ap in unfiltered_aps ])
+        if state == MotionTracker.STATIONARY:
+            return [ ap for ap in unfiltered_aps if self.__ap_key(ap) not in known ]
+        prioritized = sorted(unfiltered_aps, key = lambda ap: (self.__ap_key(ap) in known, -ap['rssi']))
+        return prioritized[:self.__motion_config['fast_max_networks']] # the others will be logged on the next APs list
+
+    def __skip_stationary_aps(self, aps):
+        '''
+        While stationary, process the APs list at most every `stationary_interval` seconds unless a new MAC shows up
+        '''
+        if self.__motion.state != MotionTracker.STATIONARY:
+            self.__motion_processed_macs = set()
+            return False
+        macs = { ap['mac'] for ap in aps }
+        if time.time() - self.__motion_processed_at < self.__motion_config['stationary_interval'] and macs <= self.__motion_processed_macs:
+            return True
+        self.__motion_processed_at = time.time()
+        self.__motion_processed_macs = macs
+        return False
+
     def on_unfiltered_ap_list(self, agent, aps):
-        gps_data = None
         if not self.ready: # it is ready once the session file has been initialized with pre-header and header
             logging.error('[WARDRIVER] Plugin not ready... skip wardriving log')
             return
-        
+
+        self.__maintenance.scan_started() # keep db maintenance away from the scan burst
+        try:
+            with self.__metrics.timer('on_unfiltered_ap_list'):
+                self.__wardrive_aps(agent, aps)
+        finally:
+            self.__maintenance.scan_finished()
+
+    def __get_gps_data(self, agent):
+        gps_data = None
         if self.__gps_config['method'] == 'bettercap':
-            info = agent.session()
-            gps_data = info["gps"]
+            self.__start_bettercap_gps(agent)
+            gps_data = self.__bettercap_gps.get_coordinates()
 
         if self.__gps_config['method'] == 'gpsd':
             try:
@@ -656,15 +3845,33 @@ class Wardriver(plugins.Plugin):
         if self.__gps_config['method'] == 'pwndroid':
             if self.__pwndroid_client.is_connected():
                 gps_data = self.__pwndroid_client.coordinates
+        return gps_data
+
+    def __read_track_fix(self):
+        '''
+        Current GPS fix for the track, without waiting for the agent
+        '''
+        if self.__gps_config['method'] == 'bettercap':
+            return self.__bettercap_gps.get_coordinates() if self.__bettercap_gps else None
+        if self.__gps_config['method'] == 'gpsd':
+            return self.__gpsd_client.get_coordinates()
+        if self.__gps_config['method'] == 'pwndroid' and self.__pwndroid_client.is_connected():
+            return self.__pwndroid_client.coordinates
+        return None
+
+    def __wardrive_aps(self, agent, aps):
+        self.__metrics.increment('aps_seen', len(aps))
+        with self.__metrics.timer('gps'):
+            gps_data = self.__get_gps_data(agent)
 
         if gps_data and all([ gps_data["Latitude"], gps_data["Longitude"] ]):
             self.__gps_available = True
             self.__last_ap_refresh = datetime.now()
             self.__last_ap_reported = []
-            coordinates = {
-                'latitude': gps_data["Latitude"],
-                'longitude': gps_data["Longitude"],
-                'altitude': gps_data["Altitude"],
+            coordinates = { # stored as text, formatted here so that the cached CSV matches the db
+                'latitude': as_db_text(gps_data["Latitude"]),
+                'longitude': as_db_text(gps_data["Longitude"]),
+                'altitude': as_db_text(gps_data["Altitude"]),
                 'accuracy': 50 # TODO: how can this be calculated?
             }
 
@@ -672,87 +3879,183 @@ class Wardriver(plugins.Plugin):
             self.__last_gps['longitude'] = gps_data['Longitude']
             self.__last_gps['altitude'] = gps_data['Altitude']
 
-            filtered_aps = self.__filter_whitelist_aps(aps)
-            filtered_aps = self.__filter_reported_aps(filtered_aps)
+            if self.__motion:
+                self.__motion.update(gps_data['Latitude'], gps_data['Longitude'], gps_data.get('Speed'))
+                if self.__skip_stationary_aps(aps):
+                    self.__metrics.increment('aps_dropped', len(aps))
+                    logging.debug('[WARDRIVER] Stationary and no new networks... skip wardriving log')
+                    return
+
+            filtered_aps = self.__filter_reported_aps(aps)
+            filtered_aps = self.__filter_whitelist_aps(filtered_aps)
+            if self.__motion:
+                filtered_aps = self.__filter_motion_aps(filtered_aps)
+            self.__metrics.increment('aps_filtered', len(aps) - len(filtered_aps))
             
             if len(filtered_aps) > 0:
-                logging.info(f'[WARDRIVER] Discovered {len(filtered_aps)} new networks')
-                for ap in filtered_aps:
-                    mac = ap['mac']
-                    ssid = ap['hostname'] if ap['hostname'] != '<hidden>' else ''
-                    capabilities = ''
-                    if ap['encryption'] != '':
-                        capabilities = f'{capabilities}[{ap["encryption"]}]'
-                    if ap['cipher'] != '':
-                        capabilities = f'{capabilities}[{ap["cipher"]}]'
-                    if ap['authentication'] != '':
-                        capabilities = f'{capabilities}[{ap["authentication"]}]'
-                    channel = ap['channel']
-                    rssi = ap['rssi']
-                    self.__last_ap_reported.append({
-                        "mac": mac,
-                        "ssid": ssid,
-                        "capabilities": capabilities,
-                        "channel": channel,
-                        "rssi": rssi
-                    })
-                    self.__session_reported.append((mac, ssid))
-                    self.__db.add_wardrived_network(session_id = self.__session_id,
-                                                    mac = mac,
-                                                    ssid = ssid,
-                                                    auth_mode = capabilities,
-                                                    channel = channel,
-                                                    rssi = rssi,
-                                                    latitude = coordinates['latitude'],
-                                                    longitude = coordinates['longitude'],
-                                                    altitude = coordinates['altitude'],
-                                                    accuracy = coordinates['accuracy'])
+                with self.__session_lock:
+                    self.__rotate_session_if_needed()
+                    logging.info(f'[WARDRIVER] Discovered {len(filtered_aps)} new networks')
+                    seen_timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                    written_networks = []
+                    for ap in filtered_aps:
+                        mac = ap['mac']
+                        ssid = ap['hostname'] if ap['hostname'] != '<hidden>' else ''
+                        capabilities = ''
+                        if ap['encryption'] != '':
+                            capabilities = f'{capabilities}[{ap["encryption"]}]'
+                        if ap['cipher'] != '':
+                            capabilities = f'{capabilities}[{ap["cipher"]}]'
+                        if ap['authentication'] != '':
+                            capabilities = f'{capabilities}[{ap["authentication"]}]'
+                        channel = ap['channel']
+                        rssi = ap['rssi']
+                        self.__last_ap_reported.append({
+                            "mac": mac,
+                            "ssid": ssid,
+                            "capabilities": capabilities,
+                            "channel": channel,
+                            "rssi": rssi
+                        })
+                        self.__session_reported.add((mac, ssid))
+                        with self.__metrics.timer('db_insert'):
+                            latitude, longitude, altitude, accuracy = self.__db.add_wardrived_network(session_id = self.__session_id,
+                                                            mac = mac,
+                                                            ssid = ssid,
+                                                            auth_mode = capabilities,
+                                                            channel = channel,
+                                                            rssi = rssi,
+                                                            latitude = coordinates['latitude'],
+                                                            longitude = coordinates['longitude'],
+                                                            altitude = coordinates['altitude'],
+                                                            accuracy = coordinates['accuracy'],
+                                                            seen_timestamp = seen_timestamp)
+                        self.__metrics.increment('aps_written')
+                        written_networks.append({
+                            'mac': mac,
+                            'ssid': ssid,
+                            'auth_mode': capabilities,
+                            'seen_timestamp': seen_timestamp,
+                            'channel': channel,
+                            'rssi': rssi,
+                            'latitude': latitude, # coordinates of the previous observation if the network has been sighted again
+                            'longitude': longitude,
+                            'altitude': altitude,
+                            'accuracy': accuracy
+                        })
+                    self.__csv_cache.append(self.__session_id, written_networks)
+                    self.__session_written_at = time.time()
+                with self.__metrics.timer('coverage'):
+                    self.__db.aggregate_coverage(len(written_networks)) # while the maintenance job is backfilling, this helps it catch up
         else:
+            self.__metrics.increment('gps_misses')
+            self.__metrics.increment('aps_dropped', len(aps))
             self.__gps_available = False
             self.__last_gps['latitude'] = '-'
             self.__last_gps['longitude'] = '-'
             self.__last_gps['altitude'] = '-'
             logging.warning("[WARDRIVER] GPS not available... skip wardriving log")
         
-    def __upload_session_to_wigle(self, session_id):
-        if self.__wigle_api_key != '':
-            headers = {
-                'Authorization': f'Basic {self.__wigle_api_key}',
-                'Accept': 'application/json'
-            }
-            networks = self.__db.session_networks(session_id)
-            csv = self.__csv_generator.networks_to_wigle_csv(networks)
-            
-            data = {
-                'donate': 'on' if self.__wigle_donate else 'off'
-            }
-
-            file_form = {
-                'file': (f'session_{session_id}.csv', csv)
-            }
+    def __rotate_session_if_needed(self):
+        '''
+        Close the running session and start a new one if it's too long, too big or networks haven't been logged for
+        a while. Closed sessions can be uploaded right away, so every upload has a bounded size
+        '''
+        if len(self.__session_reported) == 0: # nothing to close
+            return
+        now = time.time()
+        if self.__session_config['max_duration'] > 0 and now - self.__session_started_at >= self.__session_config['max_duration'] * 60:
+            reason = 'max duration reached'
+        elif self.__session_config['max_networks'] > 0 and len(self.__session_reported) >= self.__session_config['max_networks']:
+            reason = 'max networks reached'
+        elif self.__session_config['idle_gap'] > 0 and now - self.__session_written_at >= self.__session_config['idle_gap'] * 60:
+            reason = 'idle gap'
+        else:
+            return
+        closed_session_id = self.__session_id
+        self.__session_id = self.__db.new_wardriving_session()
+        self.__session_started_at = now
+        self.__session_written_at = now
+        self.__session_reported = set()
+        self.__maintenance.set_current_session(self.__session_id)
+        if self.__track:
+            self.__track.set_current_session(self.__session_id)
+        # the running CSV of the closed session is compressed now, so the upload doesn't have to
+        Thread(target = self.__csv_cache.session_file, args = (closed_session_id, self.__wigle_enabled), name = 'wardriver-csv', daemon = True).start()
+        logging.info(f'[WARDRIVER] Session {closed_session_id} closed ({reason}), started session {self.__session_id}')
 
-            try:
+    def __upload_session_to_wigle(self, job, cancelled):
+        '''
+        Upload job: stream the WiGLE CSV of the job session to WiGLE, updating the job progress. Raise an exception on failure
+        '''
+        import requests
+        session_id = job['session_id']
+        if not self.__wigle_api_key:
+            raise Exception('WiGLE API key not set')
+        upload_file = None
+        try:
+            if self.__db.session_networks_count(session_id) == 0:
+                raise Exception('Session without networks')
+            if not self.__wigle_novel_only and self.__db.session_uploaded_observations(session_id) == 0:
+                # the whole session is sent: the cached CSV can be used
+                job['rows'], positions = self.__db.session_upload_positions(session_id) # network id -> coordinates sent to WiGLE
+                csv_file = self.__csv_cache.session_file(session_id, wigle = True)
+            else:
+                positions = dict()
+                csv_file = upload_file = self.__csv_cache.upload_file(session_id, self.__novel_networks(job, positions))
+            if job['rows'] == 0:
+                logging.info(f'[WARDRIVER] Nothing new to upload for session with id {session_id}')
+                self.__db.session_uploaded_to_wigle(session_id)
+                return
+            with open(csv_file, 'rb') as csv:
+                def on_read(size):
+                    job['bytes_sent'] += size
+                body = MultipartUpload({ 'donate': 'on' if self.__wigle_donate else 'off' }, 'file', f'session_{session_id}.csv.gz', csv, os.path.getsize(csv_file), on_read = on_read, cancelled = cancelled)
+                job['bytes_total'] = len(body)
+                headers = {
+                    'Authorization': f'Basic {self.__wigle_api_key}',
+                    'Accept': 'application/json',
+                    'Content-Type': body.content_type
+                }
                 response = requests.post(
                     url = 'https://api.wigle.net/api/v2/file/upload',
                     headers = headers,
-                    data = data,
-                    files = file_form,
+                    data = body,
                     timeout = 300
                 )
-                response.raise_for_status()
-                self.__db.session_uploaded_to_wigle(session_id)
-                logging.info(f'[WARDRIVER] Uploaded successfully session with id {session_id} on WiGLE')
-                return True
-            except Exception as e:
+            response.raise_for_status()
+        except Exception as e:
+            if not cancelled.is_set():
                 logging.error(f'[WARDRIVER] Failed uploading session with id {session_id}: {e}')
-                return False
-        else:
-            return False
+            raise
+        finally:
+            if upload_file and os.path.exists(upload_file):
+                os.remove(upload_file)
+        self.__db.session_uploaded_to_wigle(session_id, positions)
+        logging.info(f'[WARDRIVER] Uploaded successfully session with id {session_id} on WiGLE ({job["rows"]} networks, {job["skipped"]} skipped)')
+
+    def __novel_networks(self, job, positions):
+        '''
+        Generator over the observations of the job session not uploaded yet. With `wigle.novel_only`, networks already
+        uploaded from a position within `wigle.novel_distance` are skipped. The position of the returned networks
+        is saved in `positions`, the returned and skipped ones are counted in the job
+        '''
+        for network in self.__db.session_upload_candidates(job['session_id']):
+            latitude, longitude = float(network['latitude']), float(network['longitude'])
+            if self.__wigle_novel_only:
+                previous = positions.get(network['network_id']) or network['uploaded_position']
+                if previous and haversine(latitude, longitude, *previous) <= self.__wigle_novel_distance:
+                    job['skipped'] += 1
+                    continue
+            positions[network['network_id']] = (latitude, longitude)
+            job['rows'] += 1
+            yield network
     
     def on_internet_available(self, agent):
         if not self.__lock.locked() and self.ready:
             with self.__lock:
                 if not self.__downloaded_assets:
+                    import requests
                     logging.info(f'[WARDRIVER] Dowloading wardriver assets from Github')
                     self.__downloaded_assets = True
                     for asset in self.ASSETS_URL:
@@ -764,6 +4067,23 @@ class Wardriver(plugins.Plugin):
                         except Exception as e:
                             logging.error(f'[WARDRIVER] Failed downloading {asset["name"]}: {e}')
                             self.__downloaded_assets = False
+                    for asset in self.WEB_ASSETS:
+                        asset_path = os.path.join(self.__web_assets_path, asset["name"])
+                        if os.path.isfile(asset_path):
+                            continue
+                        try:
+                            response = requests.get(asset["url"], timeout = 30)
+                            response.raise_for_status()
+                            os.makedirs(os.path.dirname(asset_path), exist_ok = True)
+                            with open(f'{asset_path}.tmp', 'wb') as f:
+                                f.write(response.content)
+                            os.replace(f'{asset_path}.tmp', asset_path)
+                        except Exception as e:
+                            logging.error(f'[WARDRIVER] Failed downloading {asset["name"]}: {e}')
+                            self.__downloaded_assets = False
+
+                with self.__session_lock: # a parked unit doesn't log networks: close its session on idle gap or max duration
+                    self.__rotate_session_if_needed()
 
                 if self.__wigle_enabled:
                     sessions_to_upload = self.__db.wigle_sessions_not_uploaded(self.__session_id)
@@ -771,12 +4091,148 @@ class Wardriver(plugins.Plugin):
                         logging.info(f'[WARDRIVER] Uploading previous sessions on WiGLE ({len(sessions_to_upload)} sessions) - current session will not be uploaded')
 
                         for session_id in sessions_to_upload:
-                            self.__upload_session_to_wigle(session_id)
+                            self.__uploads.submit(session_id) # sessions already queued are not queued again
     
+    def __web_assets_urls(self):
+        '''
+        Return the URL of each Web UI library: served by the plugin if downloaded, otherwise from its CDN
+        '''
+        urls = dict()
+        for asset in self.WEB_ASSETS:
+            if os.path.isfile(os.path.join(self.__web_assets_path, asset['name'])):
+                urls[asset['name']] = f'/plugins/wardriver/assets/{asset["name"]}'
+            else:
+                urls[asset['name']] = asset['url']
+        return urls
+
+    @staticmethod
+    def __coverage_precision(zoom):
+        '''
+        Return the coverage grid precision with cells of a few pixels at the given map zoom
+        '''
+        if zoom <= 9:
+            return 5
+        if zoom <= 11:
+            return 6
+        if zoom <= 14:
+            return 7
+        return 8
+
+    def __spatial_query(self, query, request):
+        '''
+        Networks inside `bbox` (south,west,north,east), within `radius` meters from `lat`,`lon` or the `k` nearest to them
+        '''
+        try:
+            limit = min(max(int(request.args.get('limit', 1000)), 1), 10000)
+            if query == 'bbox':
+                bounds = [ float(value) for value in request.args['bbox'].split(',') ]
+                if len(bounds) != 4:
+                    abort(400)
+                networks = self.__db.networks_in_bounds(*bounds, limit)
+            elif query in [ 'radius', 'nearest' ]:
+                latitude, longitude = float(request.args['lat']), float(request.args['lon'])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    abort(400)
+                if query == 'radius':
+                    radius = min(float(request.args.get('radius', 200)), Database.SPATIAL_MAX_RADIUS)
+                    networks = self.__db.networks_in_radius(latitude, longitude, radius, limit)
+                else:
+                    networks = self.__db.nearest_networks(latitude, longitude, min(max(int(request.args.get('k', 10)), 1), limit))
+            else:
+                abort(404)
+        except (KeyError, ValueError):
+            abort(400)
+        return json.dumps({
+            'columns': Database.SPATIAL_COLUMNS,
+            'rows': networks
+        }, separators = (',', ':'))
+
+    def __export(self, request):
+        '''
+        Export the sessions given as `sessions` (comma separated ids) or created between `from` and `to`
+        (YYYY-MM-DD) in `format`. With `archive=zip` (default) each session is a file of a ZIP archive,
+        with `archive=none` a single file is streamed. `dedup=1` keeps only the best observation of each network,
+        `location=estimated` replaces the observations coordinates with the estimated location of the networks
+        '''
+        try:
+            exporter = Exporter(self.__csv_generator, request.args.get('format', 'csv'))
+            if request.args.get('sessions'):
+                sessions_ids = [ int(session_id) for session_id in request.args.get('sessions').split(',') ]
+            else:
+                sessions_ids = self.__db.sessions_in_range(request.args.get('from') or None, request.args.get('to') or None)
+        except ValueError:
+            abort(400)
+        deduplicate = request.args.get('dedup') in [ '1', 'true' ]
+        networks = self.__db.export_networks(sessions_ids, deduplicate, estimated = request.args.get('location') == 'estimated')
+        if deduplicate: # networks from different sessions end up in the same file
+            networks = (dict(network, session_id = None) for network in networks)
+
+        if request.args.get('archive', 'zip') == 'zip':
+            return Response(exporter.zip(networks, name = 'networks' if deduplicate else 'session'),
+                            mimetype = 'application/zip',
+                            headers = { 'Content-Disposition': 'attachment; filename=wardriver_export.zip' })
+        return Response(exporter.stream(networks),
+                        mimetype = exporter.mimetype,
+                        headers = { 'Content-Disposition': f'attachment; filename=wardriver_export.{exporter.format}' })
+
     def on_webhook(self, path, request):
+        if path and path.startswith('profile/'): # the profiler toggles are never timed nor profiled
+            return self.__handle_webhook(path, request)
+        name = path.split('/')[0] if path and path != '/' else 'index'
+        stage = f'webhook:{name if name in self.WEBHOOK_STAGES else "other"}'
+        with self.__metrics.timer(stage):
+            response = self.__handle_webhook(path, request)
+        if isinstance(getattr(response, 'response', None), types.GeneratorType): # streamed: the body is built while it's sent
+            response.response = self.__metrics.stream_timer(f'{stage}:stream', response.response)
+        return response
+
+    def __handle_webhook(self, path, request):
         if request.method == 'GET':
             if path == '/' or not path:
-                return render_template_string(HTML_PAGE, plugin_version = self.__version__)
+                return render_template_string(HTML_PAGE,
+                                              plugin_version = self.__version__,
+                                              assets = self.__web_assets_urls(),
+                                              tile_url = '/plugins/wardriver/tiles/{z}/{x}/{y}.png' if self.__tile_cache else self.__map_config['tile_url'],
+                                              fallback_tile_url = self.__map_config['tile_url'] if self.__tile_cache else None)
+            elif path.startswith('assets/'):
+                assets_path = os.path.realpath(self.__web_assets_path)
+                asset_path = os.path.realpath(os.path.join(assets_path, path[len('assets/'):]))
+                if not asset_path.startswith(assets_path + os.sep) or not os.path.isfile(asset_path):
+                    abort(404)
+                response = send_file(asset_path)
+                response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' # assets paths contain the library version
+                return response
+            elif path == 'tiles/seed':
+                if not self.__tile_cache:
+                    abort(404)
+                try:
+                    bounds = [ float(value) for value in request.args['bbox'].split(',') ] # south,west,north,east
+                    min_zoom = int(request.args.get('min_zoom', 10))
+                    max_zoom = int(request.args.get('max_zoom', 16))
+                except (KeyError, ValueError):
+                    abort(400)
+                if len(bounds) != 4 or not 0 <= min_zoom <= max_zoom <= 19:
+                    abort(400)
+                started = self.__tile_cache.seed(bounds, min_zoom, max_zoom)
+                return json.dumps({ 'started': started, 'max_tiles': TileCache.MAX_SEED_TILES, **self.__tile_cache.status })
+            elif path == 'tiles/status':
+                if not self.__tile_cache:
+                    abort(404)
+                return json.dumps({ 'size': self.__tile_cache.size(), 'max_size': self.__map_config['tile_cache_size'] * 1024 * 1024, **self.__tile_cache.status })
+            elif path.startswith('tiles/'):
+                if not self.__tile_cache:
+                    abort(404)
+                try:
+                    zoom, x, y = path[len('tiles/'):].removesuffix('.png').split('/')
+                    zoom, x, y = int(zoom), int(x), int(y)
+                except ValueError:
+                    abort(400)
+                tile = self.__tile_cache.get(zoom, x, y)
+                if tile is None:
+                    abort(404)
+                response = Response(tile, mimetype = 'image/png')
+                response.headers['Cache-Control'] = 'public, max-age=604800'
+                return response
             elif path == 'current-session':
                 if not self.__agent_mode or self.__agent_mode == "manual":
                     return json.dumps({
@@ -785,13 +4241,17 @@ class Wardriver(plugins.Plugin):
                         "networks": None,
                         "last_ap_refresh": None,
                         "last_ap_reported": None,
-                        'gps': self.__last_gps
+                        'gps': self.__last_gps,
+                        'gps_age': None,
+                        'motion': None
                     })
                 else:
                     data = self.__db.current_session_stats(self.__session_id)
                     data['last_ap_refresh'] = self.__last_ap_refresh.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if self.__last_ap_refresh else None
                     data['last_ap_reported'] = self.__last_ap_reported
                     data['gps'] = self.__last_gps
+                    data['gps_age'] = self.__bettercap_gps.age() if self.__bettercap_gps else None
+                    data['motion'] = { 'state': self.__motion.state, 'speed': self.__motion.speed } if self.__motion else None
                     return json.dumps(data)
             elif path == 'general-stats':
                 stats = self.__db.general_stats()
@@ -801,53 +4261,248 @@ class Wardriver(plugins.Plugin):
                     'db_path': self.__path,
                     'ui_enabled': self.__ui_enabled,
                     'wigle_api_key': self.__wigle_api_key,
-                    'gps': self.__gps_config
+                    'wigle_novel_only': self.__wigle_novel_only,
+                    'gps': self.__gps_config,
+                    'retention': self.__retention_config,
+                    'deduplicate_distance': self.__deduplicate_distance,
+                    'session': self.__session_config,
+                    'map': self.__map_config,
+                    'backup': self.__backup_config
                 }
+                stats['maintenance'] = self.__maintenance.status
                 return json.dumps(stats)
+            elif path == 'maintenance':
+                return json.dumps(self.__maintenance.status)
+            elif path == 'metrics':
+                if request.args.get('format') == 'json':
+                    return json.dumps(self.__metrics.snapshot())
+                return Response(self.__metrics.to_prometheus(), mimetype = 'text/plain; version=0.0.4')
+            elif path == 'profile/start':
+                self.__metrics.start_profiling()
+                return '{ "status": "Success" }'
+            elif path == 'profile/stop':
+                return Response(self.__metrics.stop_profiling(), mimetype = 'text/plain')
             elif "csv/" in path:
-                session_id = path.split('/')[-1]
-                networks = self.__db.session_networks(session_id)
-                csv = self.__csv_generator.networks_to_csv(networks)
-                return csv
+                try:
+                    session_id = int(path.split('/')[-1])
+                except ValueError:
+                    abort(404)
+                if session_id == self.__session_id:
+                    return send_file(self.__csv_cache.running_file(session_id), mimetype = 'text/csv')
+                if not self.__db.session_exists(session_id):
+                    abort(404) # don't cache an empty CSV for unknown ids
+                csv_file = self.__csv_cache.session_file(session_id)
+                if 'gzip' in request.accept_encodings:
+                    response = send_file(csv_file, mimetype = 'text/csv')
+                    response.headers['Content-Encoding'] = 'gzip' # the browser gets the plain CSV
+                else: # e.g. curl without --compressed
+                    response = Response(gunzip_chunks(csv_file), mimetype = 'text/csv')
+                response.headers['Vary'] = 'Accept-Encoding'
+                return response
+            elif path == 'heatmap':
+                try:
+                    precision = int(request.args['precision']) if 'precision' in request.args else self.__coverage_precision(int(request.args.get('zoom', 13)))
+                    bounds = [ float(value) for value in request.args['bbox'].split(',') ] if 'bbox' in request.args else None # south,west,north,east
+                except ValueError:
+                    abort(400)
+                if precision not in Database.COVERAGE_PRECISIONS or (bounds and len(bounds) != 4):
+                    abort(400)
+                return json.dumps({
+                    'precision': precision,
+                    'cells': self.__db.coverage(precision, bounds) # [ south, west, north, east, networks, max rssi, last seen ]
+                }, separators = (',', ':'))
+            elif path.startswith('track/'):
+                try:
+                    session_id = int(path.split('/')[-1])
+                    zoom = min(max(int(request.args.get('zoom', 13)), 0), 22)
+                except ValueError:
+                    abort(400)
+                fixes = self.__db.session_track(session_id)
+                if self.__track:
+                    fixes += self.__track.pending(session_id)
+                segments, gaps = simplify_track(fixes, zoom)
+                return json.dumps({
+                    'session_id': session_id,
+                    'fixes': len(fixes),
+                    'segments': segments, # [ [ latitude, longitude, timestamp ], ... ] for each stretch without gaps
+                    'gaps': gaps # [ last fix before the gap, first fix after it ]
+                }, separators = (',', ':'))
+            elif path == 'locations':
+                try:
+                    bounds = [ float(value) for value in request.args['bbox'].split(',') ] if 'bbox' in request.args else None # south,west,north,east
+                    limit = min(max(int(request.args.get('limit', 5000)), 1), 20000)
+                except ValueError:
+                    abort(400)
+                if bounds and len(bounds) != 4:
+                    abort(400)
+                return json.dumps({
+                    'locations': self.__db.estimated_locations(bounds, limit) # [ latitude, longitude, uncertainty, observations, mac, ssid ]
+                }, separators = (',', ':'))
+            elif path.startswith('spatial/'):
+                return self.__spatial_query(path.split('/', 1)[1], request)
+            elif path == 'backups':
+                return json.dumps({
+                    'backups': self.__backup.backups(),
+                    'status': self.__backup.status
+                })
+            elif path.startswith('backups/'):
+                backup_path = self.__backup.file(path[len('backups/'):])
+                if backup_path is None:
+                    abort(404)
+                response = send_file(backup_path, mimetype = 'application/gzip')
+                response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(backup_path)}'
+                return response
+            elif path == 'snapshot':
+                name = f'{DatabaseBackup.PREFIX}{datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")}{DatabaseBackup.EXTENSION}'
+                return Response(self.__backup.snapshot(),
+                                mimetype = 'application/gzip',
+                                headers = { 'Content-Disposition': f'attachment; filename={name}' })
+            elif path == 'sync':
+                return json.dumps({
+                    'device_id': self.__db.device_id(),
+                    'peers': self.__db.sync_peers(), # high-water marks of the merged devices
+                    'job': self.__sync.status
+                })
+            elif path == 'sync/changeset':
+                try:
+                    wardrive_id = int(request.args.get('wardrive_id', 0))
+                    session_id = int(request.args.get('session_id', 0))
+                except ValueError:
+                    abort(400)
+                return Response(self.__sync.changeset(wardrive_id, session_id),
+                                mimetype = 'application/gzip',
+                                headers = { 'Content-Disposition': f'attachment; filename=wardriver_{self.__db.device_id()}.changeset.gz' })
+            elif path == 'export':
+                return self.__export(request)
             elif path == 'sessions':
                 sessions = self.__db.sessions()
                 return json.dumps(sessions)
-            elif 'upload/' in path:
-                session_id = path.split('/')[-1]
-                result = self.__upload_session_to_wigle(session_id)
-                logging.info(result)
-                return '{ "status": "Success" }' if result else'{ "status": "Error! Check the logs" }'
+            elif path.startswith('upload/'): # kept for compatibility, same as POST
+                return self.__start_upload(path)
+            elif path == 'uploads':
+                return json.dumps(self.__uploads.jobs())
+            elif path.startswith('uploads/'):
+                try:
+                    job = self.__uploads.get(int(path.split('/')[-1]))
+                except ValueError:
+                    abort(400)
+                if job is None:
+                    abort(404)
+                return json.dumps(job)
             elif path == 'networks':
-                networks = self.__db.networks()
-                return json.dumps(networks)
+                try:
+                    after_id = int(request.args.get('after', 0))
+                    limit = min(int(request.args.get('limit', 5000)), 20000)
+                except ValueError:
+                    abort(400)
+                networks, next_id = self.__db.networks(after_id, limit)
+                # compact rows instead of objects, the Web UI appends pages while the user is already browsing the first ones
+                return json.dumps({
+                    'columns': Database.NETWORKS_COLUMNS,
+                    'rows': networks,
+                    'next': next_id
+                }, separators = (',', ':'))
+            elif path == 'search':
+                try:
+                    offset = max(int(request.args.get('offset', 0)), 0)
+                    limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+                except ValueError:
+                    abort(400)
+                networks, next_offset = self.__db.search_networks(request.args.get('q', ''), limit, offset)
+                return json.dumps({
+                    'columns': Database.NETWORKS_COLUMNS,
+                    'rows': networks,
+                    'next': next_offset
+                }, separators = (',', ':'))
             elif path == 'map-networks':
-                networks = self.__db.map_networks()
+                points = self.__db.map_points()
                 center = ['-', '-']
                 if self.__last_gps['latitude'] != "-" and self.__last_gps['longitude'] != "-":
                     center[0] = self.__last_gps['latitude']
                     center[1] = self.__last_gps['longitude']
-                elif len(networks) > 0:
-                    center[0] = networks[0]['latitude']
-                    center[1] = networks[0]['longitude']
+                elif len(points) > 0:
+                    center[0] = points[0][1]
+                    center[1] = points[0][2]
 
-                map_data = {
-                    'center': center,
-                    'networks': networks
-                }
-                return json.dumps(map_data)
+                # GeoJSON with a point for each coordinates and the number of networks seen there. The networks are fetched only when a popup is opened.
+                # Features are formatted directly as they can be hundreds of thousands
+                features = ','.join(f'{{"type":"Feature","id":{point_id},"geometry":{{"type":"Point","coordinates":[{longitude!r},{latitude!r}]}},"properties":{{"n":{count}}}}}' for point_id, latitude, longitude, count in points)
+                map_data = f'{{"type":"FeatureCollection","center":{json.dumps(center)},"features":[{features}]}}'
+                return Response(map_data, mimetype = 'application/geo+json')
+            elif path.startswith('map-networks/'):
+                try:
+                    point_id = int(path.split('/')[-1])
+                except ValueError:
+                    abort(400)
+                point = self.__db.map_point_networks(point_id)
+                if point is None:
+                    abort(404)
+                return json.dumps(point)
             else:
                 abort(404)
+        elif request.method == 'POST':
+            if path.startswith('upload/'):
+                return self.__start_upload(path)
+            elif path.startswith('uploads/') and path.endswith('/cancel'):
+                try:
+                    job_id = int(path.split('/')[1])
+                except ValueError:
+                    abort(400)
+                return json.dumps({ 'cancelled': self.__uploads.cancel(job_id) })
+            elif path == 'backups':
+                return json.dumps({ 'started': self.__backup.request(), **self.__backup.status })
+            elif path == 'sync/import':
+                if 'file' not in request.files:
+                    abort(400)
+                started = self.__sync.start(self.__sync.save_upload(request.files['file'].stream), remove = True)
+                return json.dumps({ 'started': started, **self.__sync.status })
+            elif path == 'sync/attach':
+                source_path = self.__sync.source_file(request.form.get('path', '')) # only files copied in the sync folder
+                if source_path is None:
+                    abort(400)
+                return json.dumps({ 'started': self.__sync.start(source_path), **self.__sync.status })
         abort(404)
 
+    def __start_upload(self, path):
+        '''
+        Queue the upload of the session in the path and return its job, the progress is read from the uploads endpoints
+        '''
+        try:
+            session_id = int(path.split('/')[-1])
+        except ValueError:
+            abort(400)
+        if session_id == self.__session_id:
+            return json.dumps({ 'error': 'The running session cannot be uploaded' })
+        if not self.__wigle_api_key:
+            return json.dumps({ 'error': 'WiGLE API key not set' })
+        return json.dumps(self.__uploads.submit(session_id))
+
 class WardriverIcon(Widget):
-    def __init__(self, path, xy, reverse, color = 0):
+    '''
+    Status icon with an image for each state. Images are decoded once and shared between instances, the current
+    state is the widget value so it can be switched with `ui.set` without replacing the element
+    '''
+    IMAGES = dict() # (path, reverse) -> decoded image
+
+    def __init__(self, paths, xy, reverse, value, color = 0):
         super().__init__(xy, color)
-        self.image = Image.open(path)
-        if(reverse):
-            self.image = ImageOps.invert(self.image.convert('L'))
+        self.images = { state: self.__load(path, reverse) for state, path in paths.items() }
+        self.value = value
+
+    @classmethod
+    def __load(cls, path, reverse):
+        image = cls.IMAGES.get((path, reverse))
+        if image is None:
+            from PIL import Image, ImageOps
+            image = Image.open(path)
+            image.load() # decode now and release the file
+            if(reverse):
+                image = ImageOps.invert(image.convert('L'))
+            cls.IMAGES[(path, reverse)] = image
+        return image
 
     def draw(self, canvas, drawer):
-        canvas.paste(self.image, self.xy)
+        canvas.paste(self.images[self.value], self.xy)
 
 HTML_PAGE = '''
 {% extends "base.html" %}
@@ -859,13 +4514,12 @@ HTML_PAGE = '''
 {% block meta %}
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, user-scalable=0" />
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/datatables/1.10.21/css/jquery.dataTables.min.css" integrity="sha512-1k7mWiTNoyx2XtmI96o+hdjP8nn0f3Z2N4oF/9ZZRgijyV4omsKOXEnqL1gKQNPy2MTSP9rIEWGcH/CInulptA==" crossorigin="anonymous" referrerpolicy="no-referrer" />
     <link
         rel="stylesheet"
-        href="https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css"
+        href="{{ assets['pico-2/pico.min.css'] }}"
     />
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css" integrity="sha512-DTOQO9RWCH3ppGqcWaEA1BIZOC6xxalwEsw9c2QQeAIftl+Vegovlnee1c9QX4TctnWMn13TZye+giMm8e2LwA==" crossorigin="anonymous" referrerpolicy="no-referrer" />
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
+    <link rel="stylesheet" href="{{ assets['fontawesome-6.5.1/css/all.min.css'] }}" integrity="sha512-DTOQO9RWCH3ppGqcWaEA1BIZOC6xxalwEsw9c2QQeAIftl+Vegovlnee1c9QX4TctnWMn13TZye+giMm8e2LwA==" crossorigin="anonymous" referrerpolicy="no-referrer" />
+    <link rel="stylesheet" href="{{ assets['leaflet-1.9.4/leaflet.css'] }}"
         integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY="
         crossorigin=""/>
 
@@ -901,6 +4555,25 @@ HTML_PAGE = '''
         #map_networks {
             height: 600px;
         }
+        .virtual-table {
+            max-height: 70vh;
+            overflow: auto;
+        }
+        .virtual-table thead th {
+            position: sticky;
+            top: 0;
+            cursor: pointer;
+            white-space: nowrap;
+        }
+        .virtual-table tbody td {
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
+        }
+        .virtual-table tr.spacer td {
+            padding: 0;
+            border: none;
+        }
         #sessions-table i {
             cursor: pointer;
             margin-right: 15px;
@@ -984,6 +4657,7 @@ HTML_PAGE = '''
                             <article class="center">
                                 <header>Latitude</header>
                                 <span id="current-session-gps-latitude">-</span>
+                                <br><small id="current-session-gps-age"></small>
                             </article>
                         </div>
                         <div>
@@ -998,22 +4672,15 @@ HTML_PAGE = '''
                                 <span id="current-session-gps-altitude">-</span>
                             </article>
                         </div>
+                        <div>
+                            <article class="center">
+                                <header>Speed</header>
+                                <span id="current-session-gps-speed">-</span>
+                            </article>
+                        </div>
                     </div>
                     <h4>Last APs refresh networks</h4>
-                    <div class="overflow-auto">
-                        <table>
-                            <thead>
-                                <th scope="col">SSID</th>
-                                <th scope="col">MAC</th>
-                                <th scope="col">Channel</th>
-                                <th scope="col">RSSI</th>
-                                <th scope="col">Capabilities</th>
-                            </thead>
-                            <tbody id="current-session-table">
-                                <tr><td colspan="5" class="center">No networks.</td></tr>
-                            </tbody>
-                        </table>
-                    </div>
+                    <div id="current-session-table" class="virtual-table"></div>
                     <p class="center"><i>This page will automatically refresh every 30s</i></p>
                 </div>
                 <div id="stats">
@@ -1062,58 +4729,102 @@ HTML_PAGE = '''
                                     <li><b>UI enabled</b>: <span id="config-ui">-</span></li>
                                     <li><b>Database file path</b>: <span id="config-db">-</span></li>
                                     <li><b>GPS</b>:<ul id="config-gps"></ul></li>
+                                    <li><b>Retention</b>:<ul id="config-retention"></ul></li>
+                                    <li><b>Session rotation</b>:<ul id="config-session"></ul></li>
                                     <li><b>Whitelist networks</b>:<ul id="config-whitelist"></ul></li>
                                 </ul>
                             </article>
                         </div>
                     </div>
+                    <h3>Performance</h3>
+                    <article>
+                        <div class="overflow-auto">
+                            <table>
+                                <thead>
+                                    <th scope="col">Stage</th>
+                                    <th scope="col">Calls</th>
+                                    <th scope="col">Avg (ms)</th>
+                                    <th scope="col">p95 (ms)</th>
+                                    <th scope="col">Max (ms)</th>
+                                </thead>
+                                <tbody id="metrics-stages">
+                                    <tr><td colspan="5" class="center">No data.</td></tr>
+                                </tbody>
+                            </table>
+                        </div>
+                        <ul id="metrics-counters"></ul>
+                        <p class="center">
+                            <button id="profile-toggle" class="outline">Start profiling</button>
+                            <a href="/plugins/wardriver/metrics" target="_blank">Prometheus metrics</a>
+                        </p>
+                        <pre id="profile-output" class="hidden"></pre>
+                    </article>
+                    <h3>Backups</h3>
+                    <article>
+                        <ul id="backups-list"></ul>
+                        <p class="center">
+                            <button id="backup-now" class="outline">Back up now</button>
+                            <a href="/plugins/wardriver/snapshot">Download current db</a>
+                            <small id="backup-status"></small>
+                        </p>
+                    </article>
                 </div>
                 <div id="sessions">
                     <h3>Wardriving sessions</h3>
                     <p><b>Actions:</b><br />
                     <i class="fa-solid fa-file-csv"></i> : download session's CSV file<br />
                     <i class="fa-solid fa-cloud-arrow-up"></i> : upload session to WiGLE<br />
+                    <i class="fa-solid fa-route"></i> : show session's route on the map<br />
                     <!--<i class="fa-solid fa-trash"></i> : delete the session (<b>not the networks</b>)-->
                     </p>
-                    <div class="overflow-auto">
-                        <table>
-                            <thead>
-                                <th scope="col">ID</th>
-                                <th scope="col">Date</th>
-                                <th scope="col">Networks</th>
-                                <th scope="col">Uploaded</th>
-                                <th scope="col">Actions</th>
-                            </thead>
-                            <tbody id="sessions-table">
-    
-                            </tbody>
-                        </table>
-                    </div>
+                    <details>
+                        <summary><i class="fa-solid fa-file-export"></i> Export sessions</summary>
+                        <div class="grid">
+                            <label>From <input type="date" id="export-from" /></label>
+                            <label>To <input type="date" id="export-to" /></label>
+                            <label>Format
+                                <select id="export-format">
+                                    <option value="csv">CSV</option>
+                                    <option value="csv.gz">Gzipped CSV</option>
+                                    <option value="geojson">GeoJSON</option>
+                                    <option value="kml">KML</option>
+                                </select>
+                            </label>
+                            <label>Output
+                                <select id="export-archive">
+                                    <option value="zip">ZIP (a file for each session)</option>
+                                    <option value="none">Single file</option>
+                                </select>
+                            </label>
+                        </div>
+                        <label><input type="checkbox" id="export-dedup" /> Only the best observation of each network</label>
+                        <label><input type="checkbox" id="export-estimated" /> Estimated location of the networks instead of where they were seen</label>
+                        <small>Select sessions in the table to export only them, otherwise all sessions in the date range are exported.</small>
+                        <button id="export-button">Export</button>
+                    </details>
+                    <details id="sync-details">
+                        <summary><i class="fa-solid fa-arrows-rotate"></i> Sync with other devices</summary>
+                        <p><small>This device id: <code id="sync-device"></code></small></p>
+                        <p><small>Download the changeset of this device and import it into another one, or import here the changeset (or the <code>wardriver.db</code> file) of another device. Rows already merged are skipped.</small></p>
+                        <button id="sync-download" class="outline">Download changeset</button>
+                        <label>Changeset or db to import <input type="file" id="sync-file" /></label>
+                        <button id="sync-import">Import</button>
+                        <p><small id="sync-status"></small></p>
+                    </details>
+                    <div id="upload-jobs"></div>
+                    <div id="sessions-table" class="virtual-table"></div>
                 </div>
                 <div id="networks">
                     <h3>Networks</h3>
-                    <div class="overflow-auto">
-                        <table id="networks-table-container">
-                            <thead>
-                                <th scope="col">ID</th>
-                                <th scope="col">MAC</th>
-                                <th scope="col">SSID</th>
-                                <th scope="col">First seen</th>
-                                <th scope="col">First session ID</th>
-                                <th scope="col">Last seen</th>
-                                <th scope="col">Last session ID</th>
-                                <th scope="col"># sessions</th>
-                            </thead>
-                            <tbody id="networks-table">
-    
-                            </tbody>
-                        </table>
-                    </div>
+                    <input type="search" id="networks-search" placeholder="Search by SSID, MAC or vendor prefix (e.g. aa:bb:cc)" />
+                    <div id="networks-table" class="virtual-table"></div>
+                    <p class="center"><small id="networks-count"></small> <button id="networks-more" class="outline" hidden>Load more</button></p>
                 </div>
                 <div id="map">
                     <h3>Networks map</h3>
                     <p class="center"><i><i class="fa-solid fa-lightbulb"></i> Tip: click on a point to see the networks discovered there</i></p>
                     <div id="map_networks"></div>
+                    <p class="center"><button id="tiles-seed" class="outline">Save visible area for offline use</button> <small id="tiles-seed-status"></small></p>
                 </div>
             </div>
         </main>
@@ -1125,17 +4836,18 @@ HTML_PAGE = '''
 {% block script %}
     </script>
     <!--<script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.7.1/jquery.min.js" integrity="sha512-v2CJ7UaYy4JwqLDIrZUI/4hqeoQieOmAZNXBeQyjo21dadnwR+8ZaIJVT8EE2iyI61OV8e6M8PP2/4hpQINQ/g==" crossorigin="anonymous" referrerpolicy="no-referrer"></script>-->
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/datatables/1.10.21/js/jquery.dataTables.min.js" integrity="sha512-BkpSL20WETFylMrcirBahHfSnY++H2O1W+UnEEO4yNIl+jI2+zowyoGJpbtk6bx97fBXf++WJHSSK2MV4ghPcg==" crossorigin="anonymous" referrerpolicy="no-referrer"></script>
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
+    <script src="{{ assets['leaflet-1.9.4/leaflet.js'] }}"
         integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
         crossorigin=""></script>
-    <script src="https://unpkg.com/leaflet-canvas-marker@0.2.0"></script>
+    <script src="{{ assets['leaflet-canvas-marker-0.2.0/leaflet.canvas-markers.js'] }}"></script>
     <script>
     (function() {
         container = document.getElementById("data-container")
         setupMenuClickListeners()
         showCurrentSession()
         var map
+        var trackSession = null // session whose route is drawn on the map
+        var trackLayer = null
 
         function downloadCSV(session_id) {
             request("GET", "/plugins/wardriver/csv/" + session_id, function(text) {
@@ -1159,12 +4871,325 @@ HTML_PAGE = '''
             })
         }
 
+        function exportSessions() {
+            var params = new URLSearchParams()
+            var sessions = Array.from(selectedSessions)
+            if(sessions.length > 0)
+                params.set("sessions", sessions.join(","))
+            else {
+                params.set("from", document.getElementById("export-from").value)
+                params.set("to", document.getElementById("export-to").value)
+            }
+            params.set("format", document.getElementById("export-format").value)
+            params.set("archive", document.getElementById("export-archive").value)
+            params.set("dedup", document.getElementById("export-dedup").checked ? "1" : "0")
+            if(document.getElementById("export-estimated").checked)
+                params.set("location", "estimated")
+            // Navigate instead of using request() so that the browser streams the download to disk
+            window.location.href = "/plugins/wardriver/export?" + params.toString()
+        }
+
+        // Merges run in background: their progress is polled while one is running
+        var syncTimer = null
+        var syncActive = false
+        function showSync() {
+            clearTimeout(syncTimer)
+            request('GET', '/plugins/wardriver/sync', function(data) {
+                document.getElementById("sync-device").textContent = data.device_id
+                var job = data.job
+                var text = ""
+                if(job.state != "idle") {
+                    text = "Merge of " + job.source + ": " + job.state
+                    if(job.state == "running" && job.total)
+                        text += ", " + job.merged + " / " + job.total + " observations"
+                    if(job.added)
+                        text += ", added " + job.added.observations + " observations, " + job.added.sightings + " sightings, " + job.added.networks + " networks, " + job.added.sessions + " sessions"
+                    if(job.error)
+                        text += " (" + job.error + ")"
+                }
+                document.getElementById("sync-status").textContent = text
+                if(job.state == "running")
+                    syncTimer = setTimeout(showSync, 1000)
+                else if(syncActive)
+                    loadSessions() // sessions just merged
+                syncActive = job.state == "running"
+            })
+        }
+        function importSync() {
+            var file = document.getElementById("sync-file").files[0]
+            if(!file)
+                return
+            var form = new FormData()
+            form.append("file", file)
+            var xobj = new XMLHttpRequest()
+            xobj.open("POST", "/plugins/wardriver/sync/import", true)
+            xobj.setRequestHeader("X-CSRFToken", "{{ csrf_token() }}") // required by pwnagotchi web server
+            xobj.upload.addEventListener("progress", function(event) {
+                document.getElementById("sync-status").textContent = "Uploading " + file.name + ": " + (event.loaded / 1024).toFixed(0) + " / " + (event.total / 1024).toFixed(0) + " KB"
+            })
+            xobj.onreadystatechange = function () {
+                if (xobj.readyState == 4) {
+                    if(xobj.status == "200" && !JSON.parse(xobj.responseText).started)
+                        alert("Another merge is running")
+                    syncActive = true
+                    showSync()
+                }
+            }
+            xobj.send(form)
+        }
+
         function uploadSessionsToWigle(session_id) {
-            request('GET', '/plugins/wardriver/upload/' + session_id, function(message) {
-                showSessions()
-                alert(message.status)
+            request('POST', '/plugins/wardriver/upload/' + session_id, function(job) {
+                if(job.error) {
+                    alert(job.error)
+                    return
+                }
+                showUploads()
+            })
+        }
+        // WiGLE uploads run in background: their progress is polled while some of them are queued or running
+        var uploadsTimer = null
+        var uploadsActive = false
+        function showUploads() {
+            clearTimeout(uploadsTimer)
+            request('GET', '/plugins/wardriver/uploads', function(jobs) {
+                var container = document.getElementById("upload-jobs")
+                container.innerHTML = ""
+                var active = false
+                jobs.forEach(function(job) {
+                    var running = job.state == "queued" || job.state == "running"
+                    active = active || running
+                    var item = document.createElement("p")
+                    var text = "Upload of session #" + job.session_id + ": " + job.state
+                    if(job.rows || job.skipped)
+                        text += ", " + job.rows + " networks" + (job.skipped ? " (" + job.skipped + " already uploaded)" : "")
+                    if(job.bytes_total)
+                        text += ", " + (job.bytes_sent / 1024).toFixed(0) + " / " + (job.bytes_total / 1024).toFixed(0) + " KB"
+                    if(job.error)
+                        text += " (" + job.error + ")"
+                    var label = document.createElement("small")
+                    label.textContent = text
+                    item.appendChild(label)
+                    if(running) {
+                        var progress = document.createElement("progress")
+                        if(job.bytes_total) { // indeterminate while queued
+                            progress.max = job.bytes_total
+                            progress.value = job.bytes_sent
+                        }
+                        item.appendChild(progress)
+                        var cancel = document.createElement("button")
+                        cancel.className = "secondary outline"
+                        cancel.textContent = "Cancel"
+                        cancel.addEventListener("click", function() {
+                            request('POST', '/plugins/wardriver/uploads/' + job.id + '/cancel', showUploads)
+                        })
+                        item.appendChild(cancel)
+                    }
+                    container.appendChild(item)
+                })
+                if(active)
+                    uploadsTimer = setTimeout(showUploads, 1000)
+                else if(uploadsActive)
+                    loadSessions() // sessions just uploaded
+                uploadsActive = active
+            })
+        }
+
+        // Table rendering only the rows inside its visible area. Rows are kept in a column store, so sorting
+        // and filtering work on plain arrays and never touch the DOM
+        function VirtualTable(container, columns, emptyText) {
+            this.container = container
+            this.columns = columns // [{ key, label, searchable, render(td, value, row) }]
+            this.emptyText = emptyText || "No data."
+            this.rowHeight = 45 // measured again after the first render
+            this.overscan = 10
+            this.columnsData = columns.map(function() { return [] })
+            this.searchData = []
+            this.length = 0
+            this.view = [] // indexes of the rows to show, filtered and sorted
+            this.query = ""
+            this.sortColumn = -1
+            this.sortDescending = false
+            this.pool = []
+            this.renderScheduled = false
+
+            var table = document.createElement("table")
+            var head = document.createElement("thead")
+            var headRow = document.createElement("tr")
+            var self = this
+            columns.forEach(function(column, index) {
+                var th = document.createElement("th")
+                th.scope = "col"
+                th.textContent = column.label
+                th.addEventListener("click", function() { self.sortBy(index) })
+                headRow.appendChild(th)
+            })
+            head.appendChild(headRow)
+            this.headers = headRow.children
+            this.body = document.createElement("tbody")
+            this.topSpacer = this.spacer()
+            this.bottomSpacer = this.spacer()
+            table.appendChild(head)
+            table.appendChild(this.body)
+            container.innerHTML = ""
+            container.appendChild(table)
+            container.addEventListener("scroll", function() { self.scheduleRender() })
+            this.render()
+        }
+        VirtualTable.prototype.spacer = function() {
+            var row = document.createElement("tr")
+            row.className = "spacer"
+            var cell = document.createElement("td")
+            cell.colSpan = this.columns.length
+            row.appendChild(cell)
+            return row
+        }
+        VirtualTable.prototype.clear = function() {
+            this.columnsData = this.columns.map(function() { return [] })
+            this.searchData = []
+            this.length = 0
+            this.view = []
+            this.render()
+        }
+        VirtualTable.prototype.setRows = function(rows) {
+            this.columnsData = this.columns.map(function() { return [] })
+            this.searchData = []
+            this.length = 0
+            this.view = []
+            this.append(rows)
+        }
+        VirtualTable.prototype.append = function(rows) {
+            var searchable = []
+            this.columns.forEach(function(column, index) { if(column.searchable) searchable.push(index) })
+            for(var row of rows) {
+                var index = this.length++
+                for(var column = 0; column < this.columns.length; column++)
+                    this.columnsData[column].push(row[column])
+                this.searchData.push(searchable.map(function(column) { return String(row[column] || "").toLowerCase() }).join("\\u0000"))
+                if(this.matches(index))
+                    this.view.push(index)
+            }
+            if(this.sortColumn >= 0)
+                this.sortView()
+            this.render()
+        }
+        VirtualTable.prototype.matches = function(index) {
+            return this.query == "" || this.searchData[index].indexOf(this.query) != -1
+        }
+        VirtualTable.prototype.row = function(index) {
+            return this.columnsData.map(function(values) { return values[index] })
+        }
+        VirtualTable.prototype.search = function(query) {
+            this.query = query.toLowerCase()
+            this.view = []
+            for(var index = 0; index < this.length; index++)
+                if(this.matches(index))
+                    this.view.push(index)
+            if(this.sortColumn >= 0)
+                this.sortView()
+            this.container.scrollTop = 0
+            this.render()
+        }
+        VirtualTable.prototype.sortBy = function(column) {
+            this.sortDescending = this.sortColumn == column ? !this.sortDescending : false
+            this.sortColumn = column
+            for(var index = 0; index < this.headers.length; index++)
+                this.headers[index].textContent = this.columns[index].label + (index == column ? (this.sortDescending ? " \\u25BC" : " \\u25B2") : "")
+            this.sortView()
+            this.render()
+        }
+        VirtualTable.prototype.sortView = function() {
+            var values = this.columnsData[this.sortColumn]
+            var direction = this.sortDescending ? -1 : 1
+            this.view.sort(function(a, b) {
+                var first = values[a], second = values[b]
+                if(first == second)
+                    return a - b
+                if(first == null)
+                    return 1
+                if(second == null)
+                    return -1
+                return (first < second ? -1 : 1) * direction
+            })
+        }
+        VirtualTable.prototype.scheduleRender = function() {
+            if(this.renderScheduled)
+                return
+            this.renderScheduled = true
+            var self = this
+            requestAnimationFrame(function() {
+                self.renderScheduled = false
+                self.render()
             })
         }
+        VirtualTable.prototype.render = function() {
+            if(this.view.length == 0) {
+                this.body.innerHTML = "<tr><td colspan='" + this.columns.length + "' class='center'>" + this.emptyText + "</td></tr>"
+                return
+            }
+            var height = this.container.clientHeight || window.innerHeight
+            var first = Math.max(0, Math.floor(this.container.scrollTop / this.rowHeight) - this.overscan)
+            var last = Math.min(this.view.length, Math.ceil((this.container.scrollTop + height) / this.rowHeight) + this.overscan)
+            var rows = [this.topSpacer]
+            for(var position = first; position < last; position++) {
+                var tableRow = this.pool[position - first]
+                if(!tableRow) {
+                    tableRow = document.createElement("tr")
+                    for(var column = 0; column < this.columns.length; column++)
+                        tableRow.appendChild(document.createElement("td"))
+                    this.pool.push(tableRow)
+                }
+                var index = this.view[position]
+                for(var column = 0; column < this.columns.length; column++) {
+                    var cell = tableRow.children[column]
+                    var value = this.columnsData[column][index]
+                    if(this.columns[column].render) {
+                        cell.innerHTML = ""
+                        this.columns[column].render(cell, value, this.row(index))
+                    }
+                    else
+                        cell.textContent = value == null ? "" : value
+                }
+                rows.push(tableRow)
+            }
+            rows.push(this.bottomSpacer)
+            this.topSpacer.firstChild.style.height = (first * this.rowHeight) + "px"
+            this.bottomSpacer.firstChild.style.height = ((this.view.length - last) * this.rowHeight) + "px"
+            this.body.replaceChildren.apply(this.body, rows)
+            if(last > first && rows[1].offsetHeight > 0 && Math.abs(rows[1].offsetHeight - this.rowHeight) > 1) {
+                this.rowHeight = rows[1].offsetHeight
+                this.scheduleRender()
+            }
+        }
+
+        var currentSessionTable = new VirtualTable(document.getElementById("current-session-table"), [
+            { key: "ssid", label: "SSID", searchable: true },
+            { key: "mac", label: "MAC", searchable: true },
+            { key: "channel", label: "Channel" },
+            { key: "rssi", label: "RSSI" },
+            { key: "capabilities", label: "Capabilities" }
+        ], "No networks.")
+        var sessionsTable = new VirtualTable(document.getElementById("sessions-table"), [
+            { key: "id", label: "", render: renderSessionCheckbox },
+            { key: "id", label: "ID" },
+            { key: "created_at", label: "Date" },
+            { key: "networks", label: "Networks" },
+            { key: "wigle_uploaded", label: "Uploaded", render: function(cell, value) { cell.innerHTML = "<i class='fa-regular " + (value ? "fa-square-check" : "fa-square") + "'></i>" } },
+            { key: "actions", label: "Actions", render: renderSessionActions }
+        ], "No sessions.")
+        var networksTable = new VirtualTable(document.getElementById("networks-table"), [
+            { key: "id", label: "ID" },
+            { key: "mac", label: "MAC", searchable: true },
+            { key: "ssid", label: "SSID", searchable: true },
+            { key: "first_seen", label: "First seen" },
+            { key: "first_session", label: "First session ID" },
+            { key: "last_seen", label: "Last seen" },
+            { key: "last_session", label: "Last session ID" },
+            { key: "sessions_count", label: "# sessions" }
+        ], "No networks.")
+        var networksLoading = 0 // incremented on each load, so that pages of a previous load are ignored
+        var networksSearchTimer = null
+        var networksSearchNext = null // offset of the next page of search results
 
         function getCurrentSessionStats() {
             request('GET', "/plugins/wardriver/current-session", function(data) {
@@ -1180,6 +5205,8 @@ HTML_PAGE = '''
                 document.getElementById("current-session-gps-latitude").innerHTML = data.gps.latitude
                 document.getElementById("current-session-gps-longitude").innerHTML = data.gps.longitude
                 document.getElementById("current-session-gps-altitude").innerHTML = data.gps.altitude
+                document.getElementById("current-session-gps-age").innerHTML = data.gps_age != null ? "fix read " + Math.round(data.gps_age) + "s ago" : ""
+                document.getElementById("current-session-gps-speed").innerHTML = data.motion && data.motion.speed != null ? (data.motion.speed * 3.6).toFixed(1) + " km/h (" + data.motion.state + ")" : "-"
 
                 document.getElementById("manu-alert").className = 'hidden'
                 document.getElementById("current-session-id").innerHTML = data.id
@@ -1187,33 +5214,13 @@ HTML_PAGE = '''
                 document.getElementById("current-session-last-update").innerHTML = data.last_ap_refresh ? "<time class='timeago' datetime='" + parseUTCDate(data.last_ap_refresh).toISOString() + "'>-</time>" : "-"
                 var sessionStartDate = parseUTCDate(data.created_at)
                 document.getElementById("current-session-start").innerHTML = ("0" + sessionStartDate.getHours()).slice(-2) + ":" + ("0" + sessionStartDate.getMinutes()).slice(-2)
-                var apTable = document.getElementById("current-session-table")
-                apTable.innerHTML = ""
-                if(data.last_ap_reported.length == 0) {
-                    var tableRow = document.createElement('tr')
-                    tableRow.innerHTML = "<td colspan='5' class='center'>No networks.</td>"
-                    apTable.appendChild(tableRow)
+                var lastApReported = JSON.stringify(data.last_ap_reported)
+                if(lastApReported != currentSessionTable.source) { // rendered again only when the APs list changed
+                    currentSessionTable.source = lastApReported
+                    currentSessionTable.setRows(data.last_ap_reported.map(function(network) {
+                        return [network.ssid, network.mac, network.channel, network.rssi, network.capabilities]
+                    }))
                 }
-                else
-                    for(var network of data.last_ap_reported) {
-                        var tableRow = document.createElement('tr')
-                        var macCol = document.createElement('td')
-                        var ssidCol = document.createElement('td')
-                        var channelCol = document.createElement('td')
-                        var rssiCol = document.createElement('td')
-                        var capabilitiesCol = document.createElement('td')
-                        macCol.innerText = network.mac
-                        ssidCol.innerText = network.ssid
-                        channelCol.innerText = network.channel
-                        rssiCol.innerText = network.rssi
-                        capabilitiesCol.innerText = network.capabilities
-                        tableRow.appendChild(macCol)
-                        tableRow.appendChild(ssidCol)
-                        tableRow.appendChild(channelCol)
-                        tableRow.appendChild(rssiCol)
-                        tableRow.appendChild(capabilitiesCol)
-                        apTable.appendChild(tableRow)
-                    }
                 jQuery("time.timeago").timeago();
             })
         }
@@ -1225,6 +5232,8 @@ HTML_PAGE = '''
             var xobj = new XMLHttpRequest();
             xobj.overrideMimeType("application/json")
             xobj.open(method, url, true);
+            if(method == "POST")
+                xobj.setRequestHeader("X-CSRFToken", "{{ csrf_token() }}") // required by pwnagotchi web server
             xobj.onreadystatechange = function () {
                 if (xobj.readyState == 4 && xobj.status == "200") {
                     var response = xobj.responseText
@@ -1265,8 +5274,6 @@ HTML_PAGE = '''
                 "map"
             ]
 
-            $("#networks-table-container").DataTable().destroy();
-
             for(var view of views)
                 document.getElementById(view).className = view == showing ? "visible" : "hidden"
         }
@@ -1305,7 +5312,34 @@ HTML_PAGE = '''
                     port.innerHTML = "Port: <code>" + data.config.gps.port + "</code>"
                     document.getElementById("config-gps").appendChild(port)
                 }
+
+                document.getElementById("config-retention").innerHTML = ""
+                var retention = [
+                    "Keep best observation after: <code>" + (data.config.retention.best_observation_days > 0 ? data.config.retention.best_observation_days + " days" : "disabled") + "</code>",
+                    "Drop uploaded sessions after: <code>" + (data.config.retention.uploaded_sessions_days > 0 ? data.config.retention.uploaded_sessions_days + " days" : "disabled") + "</code>",
+                    "Maintenance: <code>" + (data.maintenance.task ? data.maintenance.task + " (" + data.maintenance.progress + "/" + data.maintenance.total + ")" : data.maintenance.state) + "</code>" + (data.maintenance.last_run ? ", last run " + data.maintenance.last_run + " UTC" : "")
+                ]
+                for(var line of retention) {
+                    var item = document.createElement("li")
+                    item.innerHTML = line
+                    document.getElementById("config-retention").appendChild(item)
+                }
+
+                document.getElementById("config-session").innerHTML = ""
+                var rotation = [
+                    "Max duration: <code>" + (data.config.session.max_duration > 0 ? data.config.session.max_duration + " minutes" : "disabled") + "</code>",
+                    "Max networks: <code>" + (data.config.session.max_networks > 0 ? data.config.session.max_networks : "disabled") + "</code>",
+                    "Idle gap: <code>" + (data.config.session.idle_gap > 0 ? data.config.session.idle_gap + " minutes" : "disabled") + "</code>"
+                ]
+                for(var line of rotation) {
+                    var item = document.createElement("li")
+                    item.innerHTML = line
+                    document.getElementById("config-session").appendChild(item)
+                }
                 
+                showMetrics()
+                showBackups()
+
                 if(data.config.wigle_api_key) {
                     loadWigleStats(data.config.wigle_api_key, function(stats) {
                         document.getElementById("wigle-username").innerText = stats.user
@@ -1320,142 +5354,339 @@ HTML_PAGE = '''
                 }
             })
         }
-        function showSessions() {
-            updateContainerView("sessions")
-            request('GET', "/plugins/wardriver/sessions", function(data) {
-                var sessionsTable = document.getElementById("sessions-table")
-                sessionsTable.innerHTML = ""
-                for(var session of data) {
+        function showMetrics() {
+            request('GET', "/plugins/wardriver/metrics?format=json", function(data) {
+                var stagesTable = document.getElementById("metrics-stages")
+                stagesTable.innerHTML = ""
+                for(var stage of Object.keys(data.stages).sort()) {
+                    var metrics = data.stages[stage]
                     var tableRow = document.createElement("tr")
-                    var idCol = document.createElement("td")
-                    var createdCol = document.createElement("td")
-                    var networksCol = document.createElement("td")
-                    var wigleCol = document.createElement("td")
-                    var actionsCol = document.createElement("td")
-
-                    idCol.innerHTML = session.id
-                    createdCol.innerHTML = session.created_at
-                    networksCol.innerHTML = session.networks
-                    wigleCol.innerHTML = "<i class='fa-regular " + (session.wigle_uploaded ? "fa-square-check" : "fa-square") + "'></i>"
-                    csvIcon = document.createElement('i')
-                    csvIcon.className = 'fa-solid fa-file-csv'
-                    csvIcon.addEventListener("click", function(session_id) { return function() { downloadCSV(session_id)} } (session.id))
-                    wigleIcon = document.createElement('i')
-                    wigleIcon.className = 'fa-solid fa-cloud-arrow-up'
-                    deleteIcon = document.createElement('i')
-                    deleteIcon.className = 'fa-solid fa-trash'
-                    actionsCol.appendChild(csvIcon)
-                    if(!session.wigle_uploaded) {
-                        wigleIcon.addEventListener("click", function(session_id) { return function() { uploadSessionsToWigle(session_id)} } (session.id))
-                        actionsCol.appendChild(wigleIcon)
+                    for(var value of [stage, metrics.count, metrics.avg_ms.toFixed(1), metrics.p95_ms.toFixed(1), metrics.max_ms.toFixed(1)]) {
+                        var col = document.createElement("td")
+                        col.innerText = value
+                        tableRow.appendChild(col)
                     }
-                    //actionsCol.appendChild(deleteIcon)
-                    tableRow.appendChild(idCol)
-                    tableRow.appendChild(createdCol)
-                    tableRow.appendChild(networksCol)
-                    tableRow.appendChild(wigleCol)
-                    tableRow.appendChild(actionsCol)
-                    sessionsTable.appendChild(tableRow)
+                    stagesTable.appendChild(tableRow)
+                }
+                var counters = document.getElementById("metrics-counters")
+                counters.innerHTML = ""
+                var values = Object.assign({}, data.counters, data.gauges)
+                for(var name of Object.keys(values)) {
+                    var item = document.createElement("li")
+                    item.innerHTML = "<b>" + name.replaceAll("_", " ") + "</b>: " + values[name]
+                    counters.appendChild(item)
                 }
+                document.getElementById("profile-toggle").innerText = data.profiling ? "Stop profiling" : "Start profiling"
+            })
+        }
+        // Backups are taken in background: their progress is polled while one is running
+        var backupsTimer = null
+        function showBackups() {
+            clearTimeout(backupsTimer)
+            request('GET', '/plugins/wardriver/backups', function(data) {
+                var list = document.getElementById("backups-list")
+                list.innerHTML = ""
+                if(data.backups.length == 0)
+                    list.innerHTML = "<li>No backups yet.</li>"
+                data.backups.forEach(function(backup) {
+                    var item = document.createElement("li")
+                    var link = document.createElement("a")
+                    link.href = "/plugins/wardriver/backups/" + backup.name
+                    link.textContent = backup.name
+                    item.appendChild(link)
+                    item.appendChild(document.createTextNode(" (" + (backup.size / 1024 / 1024).toFixed(1) + " MB, " + backup.created_at + " UTC)"))
+                    list.appendChild(item)
+                })
+                var status = data.status
+                var text = ""
+                if(status.state == "running")
+                    text = "Backing up" + (status.total ? ": " + Math.round(status.copied * 100 / status.total) + "%" : "...")
+                else if(status.state == "failed")
+                    text = "Backup failed (" + status.error + ")"
+                document.getElementById("backup-status").textContent = text
+                if(status.state == "running")
+                    backupsTimer = setTimeout(showBackups, 1000)
+            })
+        }
+        function toggleProfiling() {
+            var button = document.getElementById("profile-toggle")
+            if(button.innerText == "Start profiling")
+                request('GET', "/plugins/wardriver/profile/start", function() {
+                    button.innerText = "Stop profiling"
+                })
+            else
+                request('GET', "/plugins/wardriver/profile/stop", function(stats) {
+                    button.innerText = "Start profiling"
+                    var output = document.getElementById("profile-output")
+                    output.innerText = stats
+                    output.className = "visible"
+                })
+        }
+        var selectedSessions = new Set() // sessions to export, kept here as rows are rendered again while scrolling
+        function renderSessionCheckbox(cell, value) {
+            var checkbox = document.createElement("input")
+            checkbox.type = "checkbox"
+            checkbox.checked = selectedSessions.has(value)
+            checkbox.addEventListener("change", function() {
+                if(checkbox.checked)
+                    selectedSessions.add(value)
+                else
+                    selectedSessions.delete(value)
+            })
+            cell.appendChild(checkbox)
+        }
+        function renderSessionActions(cell, value, row) {
+            var session_id = row[1]
+            var csvIcon = document.createElement('i')
+            csvIcon.className = 'fa-solid fa-file-csv'
+            csvIcon.addEventListener("click", function() { downloadCSV(session_id) })
+            cell.appendChild(csvIcon)
+            var routeIcon = document.createElement('i')
+            routeIcon.className = 'fa-solid fa-route'
+            routeIcon.addEventListener("click", function() { showSessionTrack(session_id) })
+            cell.appendChild(routeIcon)
+            if(!row[4]) {
+                var wigleIcon = document.createElement('i')
+                wigleIcon.className = 'fa-solid fa-cloud-arrow-up'
+                wigleIcon.addEventListener("click", function() { uploadSessionsToWigle(session_id) })
+                cell.appendChild(wigleIcon)
+            }
+        }
+        function showSessions() {
+            updateContainerView("sessions")
+            loadSessions()
+            showUploads()
+            showSync()
+        }
+        function loadSessions() {
+            request('GET', "/plugins/wardriver/sessions", function(data) {
+                sessionsTable.setRows(data.map(function(session) {
+                    return [session.id, session.id, session.created_at, session.networks, session.wigle_uploaded, null]
+                }))
             })
         }
         function showNetworks() {
             updateContainerView("networks")
-            request('GET', "/plugins/wardriver/networks", function(data) {
-                $('#networks-table-container').DataTable({
-                    data: data,
-                    searching: false,
-                    lengthChange: false,
-                    pageLength: 25,
-                    columns: [
-                        { data: "id", width: "5%" },
-                        { data: "mac", width: "15%" },
-                        { data: "ssid", width: "20%" },
-                        { data: "first_seen", width: "15%" },
-                        { data: "first_session", width: "10%" },
-                        { data: "last_seen", width: "15%" },
-                        { data: "last_session", width: "10%" },
-                        { data: "sessions_count", width: "10%" }
-                    ]
-                })
+            networksTable.clear()
+            document.getElementById("networks-more").hidden = true
+            var query = document.getElementById("networks-search").value.trim()
+            if(query != "")
+                searchNetworks(++networksLoading, query, 0)
+            else
+                loadNetworks(++networksLoading, 0)
+        }
+        function searchNetworks(loading, query, offset) {
+            request('GET', "/plugins/wardriver/search?q=" + encodeURIComponent(query) + "&offset=" + offset, function(page) {
+                if(loading != networksLoading)
+                    return
+                if(offset == 0)
+                    networksTable.setRows(page.rows)
+                else
+                    networksTable.append(page.rows)
+                networksSearchNext = page.next
+                document.getElementById("networks-count").innerHTML = networksTable.length + (page.next != null ? "+" : "") + " results"
+                document.getElementById("networks-more").hidden = page.next == null
+            })
+        }
+        function loadNetworks(loading, after) {
+            request('GET', "/plugins/wardriver/networks?after=" + after, function(page) {
+                if(loading != networksLoading)
+                    return
+                networksTable.append(page.rows)
+                document.getElementById("networks-count").innerHTML = networksTable.length + " networks" + (page.next != null ? ", loading..." : "")
+                if(page.next != null)
+                    loadNetworks(loading, page.next)
             })
         }
-        function showMap() {
+        function showSessionTrack(session_id) {
+            trackSession = session_id
+            showMap(true)
+        }
+        function showMap(keepTrack) {
+            if(keepTrack !== true)
+                trackSession = null
             updateContainerView("map")
             request('GET', '/plugins/wardriver/map-networks', function(response) {
-                var networks = response.networks
+                var points = response.features
                 var center = response.center
                 if(center[0] == "-" || center[1] == "-") {
                     if(navigator.geolocation) {
                         navigator.geolocation.getCurrentPosition(function(position) {
                             center[0] = position.coords.latitude
                             center[1] = position.coords.longitude
-                            renderMap(networks, center)
+                            renderMap(points, center)
                         }, function() {
                             center[0] = 51.505
                             center[1] = -0.09
-                            renderMap(networks, center)
+                            renderMap(points, center)
                         })
                     }
                     else {
                         center[0] = 51.505
                         center[1] = -0.09
-                        renderMap(networks, center)
+                        renderMap(points, center)
                     }
                 }
                 else {
-                    renderMap(networks, center)
+                    renderMap(points, center)
                 }
             })
         }
-        function renderMap(networks, center) {
+        function renderMap(points, center) {
             if(map)
                 map.remove()
             map = L.map("map_networks", { center: center, zoom: 13, zoomControl: false})
-            L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {
+            var tiles = L.tileLayer({{ tile_url|tojson }}, {
                 maxZoom: 19,
                 attribution: '&copy; <a href="http://www.openstreetmap.org/copyright">OpenStreetMap</a>'
             }).addTo(map)
+            var fallbackTileUrl = {{ fallback_tile_url|tojson }}
+            if(fallbackTileUrl) {
+                // tiles missing from the cache can't be downloaded while the unit is offline: the browser may still be online
+                tiles.on("tileerror", function(e) {
+                    if(e.tile.dataset.fallback)
+                        return
+                    e.tile.dataset.fallback = "1"
+                    e.tile.src = L.Util.template(fallbackTileUrl, { s: "abc"[(e.coords.x + e.coords.y) % 3], x: e.coords.x, y: e.coords.y, z: e.coords.z })
+                })
+            }
             var ciLayer = L.canvasIconLayer({}).addTo(map)
             var icon = L.icon({
-                iconUrl: 'https://img.icons8.com/metro/26/000000/marker.png',
+                iconUrl: '{{ assets['icons8/marker.png'] }}',
                 iconSize: [20, 18],
                 iconAnchor: [10, 9]
             })
 
-            var networksGrouped = networks.reduce(function (n, network) {
-                var key = network.latitude + "," + network.longitude
-                n[key] = n[key] || []
-                n[key].push(network)
-                return n
-            }, Object.create(null))
-            
             var markers = []
-            var mapCenter
-            Object.keys(networksGrouped).forEach(key => {
-                var networks = networksGrouped[key]
-                var coordinates = key.split(",")
-                if(!mapCenter)
-                    mapCenter = coordinates
-                var popupText = ""
-                var popupCounter = 0
-                while(popupCounter < Math.min(networks.length, 7)) {
-                    var network = networks[popupCounter]
-                    if(network.ssid == "")
-                        popupText += "<b>Hidden</b>"
-                    else
-                        popupText += "<b>" + network.ssid + "</b>"
-                    
-                    popupText += " (" + network.mac + ")<br />"
-                    popupCounter++
-                }
-                if(networks.length > popupCounter)
-                    popupText += '&plus;' + (networks.length - popupCounter) + ' more networks'
-                var marker = L.marker([coordinates[0], coordinates[1]], {icon: icon}).bindPopup(popupText)
+            for(var point of points) {
+                var coordinates = point.geometry.coordinates
+                var marker = L.marker([coordinates[1], coordinates[0]], {icon: icon}).bindPopup(point.properties.n + " networks")
+                marker.on("popupopen", function(point_id) { return function(event) { loadPopup(event.popup, point_id) } } (point.id))
                 markers.push(marker)
-            })
+            }
 
             ciLayer.addLayers(markers)
+
+            var coverageLayer = L.layerGroup()
+            var locationsLayer = L.layerGroup()
+            L.control.layers(null, { "Networks": ciLayer, "Coverage": coverageLayer, "Estimated AP locations": locationsLayer }).addTo(map)
+            map.on("overlayadd moveend", function() {
+                if(map.hasLayer(coverageLayer))
+                    loadCoverage(coverageLayer)
+                if(map.hasLayer(locationsLayer))
+                    loadLocations(locationsLayer)
+            })
+            trackLayer = L.layerGroup().addTo(map)
+            if(trackSession != null) {
+                loadTrack(true)
+                map.on("zoomend", function() { loadTrack(false) })
+            }
+        }
+        function loadTrack(fit) {
+            var session_id = trackSession
+            request('GET', '/plugins/wardriver/track/' + session_id + '?zoom=' + map.getZoom(), function(response) {
+                if(session_id != trackSession)
+                    return
+                trackLayer.clearLayers()
+                if(response.segments.length == 0 || response.segments[0].length == 0) {
+                    alert("No route recorded for session " + session_id)
+                    return
+                }
+                var bounds = L.latLngBounds([])
+                for(var segment of response.segments) {
+                    var line = segment.map(function(fix) { return [fix[0], fix[1]] })
+                    L.polyline(line, { color: "#3388ff", weight: 4 }).bindPopup("Session " + session_id + " route").addTo(trackLayer)
+                    bounds.extend(line)
+                }
+                for(var gap of response.gaps) {
+                    var minutes = Math.round((gap[1][2] - gap[0][2]) / 60)
+                    L.polyline([[gap[0][0], gap[0][1]], [gap[1][0], gap[1][1]]], { color: "#e53935", weight: 3, dashArray: "6 8" })
+                        .bindPopup("No GPS fix for " + minutes + " minutes").addTo(trackLayer)
+                }
+                if(fit)
+                    map.fitBounds(bounds)
+            })
+        }
+        function loadLocations(locationsLayer) {
+            var bounds = map.getBounds()
+            var bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(",")
+            request('GET', '/plugins/wardriver/locations?bbox=' + bbox, function(response) {
+                locationsLayer.clearLayers()
+                var renderer = L.canvas()
+                for(var location of response.locations) {
+                    var [latitude, longitude, uncertainty, observations, mac, ssid] = location
+                    var popup = document.createElement("div")
+                    popup.innerHTML = "<b></b><br /><span></span><br />&plusmn; " + Math.round(uncertainty) + " m, " + observations + " observations"
+                    popup.querySelector("b").textContent = ssid || "<hidden>"
+                    popup.querySelector("span").textContent = mac
+                    L.circle([latitude, longitude], {
+                        renderer: renderer,
+                        radius: Math.max(uncertainty, 5),
+                        weight: 1,
+                        color: "#3388ff",
+                        fillOpacity: 0.2
+                    }).bindPopup(popup).addTo(locationsLayer)
+                    L.circleMarker([latitude, longitude], { renderer: renderer, radius: 3, stroke: false, fillOpacity: 1 }).bindPopup(popup).addTo(locationsLayer)
+                }
+            })
+        }
+        function loadCoverage(coverageLayer) {
+            var bounds = map.getBounds()
+            var bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(",")
+            request('GET', '/plugins/wardriver/heatmap?zoom=' + map.getZoom() + '&bbox=' + bbox, function(response) {
+                coverageLayer.clearLayers()
+                var renderer = L.canvas()
+                var maxNetworks = response.cells.reduce(function(max, cell) { return Math.max(max, cell[4]) }, 1)
+                for(var cell of response.cells) {
+                    var [south, west, north, east, networks, maxRssi, lastSeen] = cell
+                    var strength = Math.min(Math.max((maxRssi + 90) / 60, 0), 1) // -90 dBm (blue) to -30 dBm (red)
+                    var density = Math.log(1 + networks) / Math.log(1 + maxNetworks)
+                    L.rectangle([[south, west], [north, east]], {
+                        renderer: renderer,
+                        stroke: false,
+                        fillColor: "hsl(" + Math.round(240 * (1 - strength)) + ", 90%, 50%)",
+                        fillOpacity: 0.15 + 0.5 * density
+                    }).bindPopup("<b>" + networks + "</b> networks<br />Best signal: " + maxRssi + " dBm<br />Last seen: " + lastSeen).addTo(coverageLayer)
+                }
+            })
+        }
+        function seedTiles() {
+            var bounds = map.getBounds()
+            var bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(",")
+            var minZoom = Math.max(map.getZoom() - 2, 0)
+            var maxZoom = Math.min(map.getZoom() + 3, 17)
+            request('GET', '/plugins/wardriver/tiles/seed?bbox=' + bbox + '&min_zoom=' + minZoom + '&max_zoom=' + maxZoom, function(status) {
+                if(!status.started && status.state != "running") {
+                    alert("The area is too big: zoom in and try again (max " + status.max_tiles + " tiles)")
+                    return
+                }
+                showSeedStatus()
+            })
+        }
+        function showSeedStatus() {
+            request('GET', '/plugins/wardriver/tiles/status', function(status) {
+                var text = "Offline tiles: " + (status.size / 1024 / 1024).toFixed(1) + " / " + (status.max_size / 1024 / 1024).toFixed(0) + " MB"
+                if(status.state == "running") {
+                    text += " - downloading " + status.progress + "/" + status.total
+                    setTimeout(showSeedStatus, 2000)
+                }
+                else if(status.failed > 0)
+                    text += " - " + status.failed + " tiles failed, check your internet connection"
+                document.getElementById("tiles-seed-status").innerHTML = text
+            })
+        }
+        function loadPopup(popup, point_id) {
+            request('GET', '/plugins/wardriver/map-networks/' + point_id, function(point) {
+                var content = document.createElement("div") // SSIDs are broadcast by anyone: never parsed as HTML
+                for(var network of point.networks) {
+                    var ssid = document.createElement("b")
+                    ssid.textContent = network.ssid == "" ? "Hidden" : network.ssid
+                    content.append(ssid, " (" + network.mac + ")", document.createElement("br"))
+                }
+                if(point.total > point.networks.length)
+                    content.append("+" + (point.total - point.networks.length) + " more networks")
+                popup.setContent(content)
+            })
         }
         function setupMenuClickListeners() {
             document.getElementById("menu-current-session").addEventListener("click", showCurrentSession)
@@ -1463,7 +5694,59 @@ HTML_PAGE = '''
             document.getElementById("menu-sessions").addEventListener("click", showSessions)
             document.getElementById("menu-networks").addEventListener("click", showNetworks)
             document.getElementById("menu-map").addEventListener("click", showMap)
+            document.getElementById("profile-toggle").addEventListener("click", toggleProfiling)
+            document.getElementById("backup-now").addEventListener("click", function() {
+                request('POST', '/plugins/wardriver/backups', function() {
+                    setTimeout(showBackups, 500) // the backup thread picks up the request
+                })
+            })
+            document.getElementById("export-button").addEventListener("click", exportSessions)
+            document.getElementById("sync-download").addEventListener("click", function() {
+                window.location.href = "/plugins/wardriver/sync/changeset" // streamed to disk by the browser
+            })
+            document.getElementById("sync-import").addEventListener("click", importSync)
+            document.getElementById("tiles-seed").addEventListener("click", seedTiles)
+            document.getElementById("networks-search").addEventListener("input", function() {
+                clearTimeout(networksSearchTimer)
+                networksSearchTimer = setTimeout(showNetworks, 300) // search once the user stops typing
+            })
+            document.getElementById("networks-more").addEventListener("click", function() {
+                this.hidden = true
+                searchNetworks(networksLoading, document.getElementById("networks-search").value.trim(), networksSearchNext)
+            })
         }
     })()
 {% endblock %}
-'''
\ No newline at end of file
+'''
+
+if __name__ == '__main__':
+    # command line merge, e.g. to collect the dbs of several devices in one file
+    import argparse
+    logging.basicConfig(level = logging.INFO)
+    parser = argparse.ArgumentParser(description = 'Merge the wardriver dbs of several devices')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    merge_parser = commands.add_parser('merge', help = 'merge other dbs or changesets into a db')
+    merge_parser.add_argument('db')
+    merge_parser.add_argument('sources', nargs = '+', help = 'wardriver dbs or changesets (gzipped or not)')
+    changeset_parser = commands.add_parser('changeset', help = 'write the gzipped changeset of a db')
+    changeset_parser.add_argument('db')
+    changeset_parser.add_argument('output')
+    changeset_parser.add_argument('--wardrive-id', type = int, default = 0, help = 'high-water mark of the observations already merged')
+    changeset_parser.add_argument('--session-id', type = int, default = 0, help = 'high-water mark of the sessions already merged')
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    path = os.path.dirname(os.path.abspath(args.db))
+    csv_cache_path = os.path.join(path, Wardriver.CSV_CACHE_DIR) # the db of a pwnagotchi, its cached CSVs of the merged sessions are stale
+    on_merged = CSVCache(csv_cache_path, db, CSVGenerator()).invalidate if os.path.isdir(csv_cache_path) else None
+    sync = DatabaseSync(db, os.path.join(path, Wardriver.SYNC_DIR), on_merged = on_merged)
+    try:
+        if args.command == 'merge':
+            for source in args.sources:
+                print(f'{source}: {sync.merge(source)}')
+        else:
+            with open(args.output, 'wb') as output:
+                for chunk in sync.changeset(args.wardrive_id, args.session_id):
+                    output.write(chunk)
+    finally:
+        db.disconnect()